@@ -0,0 +1,163 @@
+"""Benchmark of structuring parsed papers into documents by `TokenChunker`
+against the code before it, which made a `TokenTextSplitter` per paper and split
+each section by it.
+
+Both time and the memory retained by the documents are measured. The encoder of
+the model is downloaded by tiktoken on first use.
+
+Usage:
+    poetry run python -m benchmarks.chunking_benchmark --pages 10 100 300
+"""
+import argparse
+import time
+import tracemalloc
+from typing import Callable, Final
+
+from langchain.docstore.document import Document
+from langchain.text_splitter import TextSplitter, TokenTextSplitter
+
+from benchmarks.parse_pdf_benchmark import make_mathpix_text
+from src.domain.parsed_paper_dto import ParsedPaperDTO, SubsectionDTO
+from src.usecase.mathpix_pdf_parser import MathpixPdfParser
+from src.usecase.summarizer.ochiai_format_summarizer import OchiaiFormatSummarizer
+from src.usecase.summary_handler import SummaryHandler
+from src.usecase.text_chunker import TokenChunker
+
+MODEL_NAME: Final = "gpt-3.5-turbo"
+CHUNK_SIZE: Final = 200
+CHUNK_OVERLAP: Final = 40
+
+
+def structure_per_section(parsed_paper: ParsedPaperDTO) -> list[Document]:
+    """Structure the paper by the code before `TokenChunker`."""
+    text_splitter = TokenTextSplitter.from_tiktoken_encoder(
+        model_name=MODEL_NAME, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP
+    )
+    documents = [
+        Document(page_content=parsed_paper.abstract, metadata={"section": "abstract"})
+    ]
+    for each_section in parsed_paper.section:
+        section_title = each_section.section_title
+        if section_title == "References" or section_title == "REFERENCES":
+            continue
+
+        section_id = each_section.section_id
+        section_text = each_section.section_text
+        if section_text:
+            for chunk_id, each_section_text in enumerate(
+                text_splitter.split_text(section_text)
+            ):
+                metadata = {
+                    "section_id": f"{section_id}",
+                    "section": f"{section_title}",
+                    "chunk_id": chunk_id,
+                }
+                documents.append(
+                    Document(page_content=each_section_text, metadata=metadata)
+                )
+
+        structure_subsections(
+            each_section.subsection_list,
+            f"{section_id}",
+            f"{section_title}",
+            text_splitter,
+            documents,
+        )
+    return documents
+
+
+def structure_subsections(
+    subsection_list: list[SubsectionDTO],
+    parent_id: str,
+    parent_title: str,
+    text_splitter: TextSplitter,
+    documents: list[Document],
+) -> None:
+    """Structure nested subsections by the code before `TokenChunker`."""
+    for each_subsection in subsection_list:
+        subsection_id = f"{parent_id}.{each_subsection.subsection_id}"
+        subsection_title = f"{parent_title}/{each_subsection.subsection_title}"
+        subsection_text = each_subsection.subsection_text
+        for chunk_id, each_subsection_text in enumerate(
+            text_splitter.split_text(subsection_text)
+        ):
+            metadata = {
+                "section_id": subsection_id,
+                "section": subsection_title,
+                "chunk_id": chunk_id,
+            }
+            documents.append(
+                Document(page_content=each_subsection_text, metadata=metadata)
+            )
+
+        structure_subsections(
+            each_subsection.subsection_list,
+            subsection_id,
+            subsection_title,
+            text_splitter,
+            documents,
+        )
+
+
+def structure_by_chunker(parsed_paper: ParsedPaperDTO) -> list[Document]:
+    """Structure the paper by `SummaryHandler` with the chunker."""
+    chunker = TokenChunker(
+        model_name=MODEL_NAME, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP
+    )
+    return SummaryHandler(OchiaiFormatSummarizer).structure_latex_documents(
+        parsed_paper, chunker
+    )
+
+
+def measure(
+    structure: Callable[[ParsedPaperDTO], list[Document]],
+    parsed_paper: ParsedPaperDTO,
+    repeat: int,
+) -> tuple[float, int]:
+    """Return the best elapsed time in seconds and the bytes retained by the
+    documents."""
+    elapsed_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        structure(parsed_paper)
+        elapsed_times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    documents = structure(parsed_paper)
+    retained_size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del documents
+    return min(elapsed_times), retained_size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 100, 300])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    pdf_parser = MathpixPdfParser()
+    print(
+        f"{'pages':>6} {'chunks':>7} {'per section [ms]':>17}"
+        f" {'chunker [ms]':>13} {'speedup':>8}"
+        f" {'per section [KiB]':>18} {'chunker [KiB]':>14}"
+    )
+    for num_pages in args.pages:
+        parsed_paper = pdf_parser.parse_pdf(make_mathpix_text(num_pages))
+        documents = structure_per_section(parsed_paper)
+        assert [document.page_content for document in documents] == [
+            document.page_content for document in structure_by_chunker(parsed_paper)
+        ]
+        per_section, per_section_size = measure(
+            structure_per_section, parsed_paper, args.repeat
+        )
+        chunker, chunker_size = measure(structure_by_chunker, parsed_paper, args.repeat)
+        print(
+            f"{num_pages:>6} {len(documents):>7} {per_section * 1000:>17.2f}"
+            f" {chunker * 1000:>13.2f} {per_section / chunker:>7.1f}x"
+            f" {per_section_size / 1024:>18.1f} {chunker_size / 1024:>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""Local stand-ins of the Mathpix and OpenAI APIs for benchmarks.
+
+The fake servers implement only the endpoints used by the backend, and respond
+after a delay sampled from a configurable latency distribution, so the pipeline
+can be measured without API keys, costs or rate limits.
+
+Point the backend at them by the environment variables:
+    MATHPIX_API_URL=http://127.0.0.1:<port>/v3/pdf
+    OPENAI_API_BASE=http://127.0.0.1:<port>/v1
+"""
+import asyncio
+import hashlib
+import io
+import json
+import random
+import socket
+import threading
+import time
+import uuid
+import zipfile
+from typing import Any, AsyncIterator, Final
+
+import fastapi
+import numpy as np
+import uvicorn
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from benchmarks.parse_pdf_benchmark import make_mathpix_text
+
+DEFAULT_EMBEDDING_DIM: Final = 1536
+# Rough number of characters per token of English texts.
+CHARS_PER_TOKEN: Final = 4
+
+
+class LatencyDistribution:
+    """Distribution of the latency of a fake API call in seconds.
+
+    Specified as `constant:<seconds>`, `uniform:<low>,<high>` or
+    `lognormal:<median>,<sigma>`. The log-normal distribution has a long tail like
+    real APIs.
+
+    Args:
+        spec (str): specification of the distribution
+        seed (int | None, optional): random seed. Defaults to None.
+
+    """
+
+    def __init__(self, spec: str, seed: int | None = None) -> None:
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(param) for param in params.split(",") if param]
+        expected_num_params = {"constant": 1, "uniform": 2, "lognormal": 2}
+        if expected_num_params.get(kind) != len(self.params):
+            raise ValueError(f"Invalid latency distribution `{spec}`.")
+        self.spec = spec
+        self.rng = random.Random(seed)
+
+    def sample(self) -> float:
+        """Sample a latency in seconds."""
+        if self.kind == "constant":
+            return self.params[0]
+        elif self.kind == "uniform":
+            return self.rng.uniform(self.params[0], self.params[1])
+        median, sigma = self.params
+        return self.rng.lognormvariate(np.log(median), sigma) if median > 0 else 0.0
+
+    def __repr__(self) -> str:
+        return self.spec
+
+
+def make_fake_mathpix_app(
+    processing_latency: LatencyDistribution, num_pages: int = 10
+) -> fastapi.FastAPI:
+    """Make a fake Mathpix PDF API.
+
+    A submitted pdf is being processed until its sampled processing time passes,
+    and then converted to a synthetic paper of `num_pages` pages. Each pdf gets a
+    different paper, so no paper hits the caches of the backend.
+
+    Args:
+        processing_latency (LatencyDistribution): time to process a pdf
+        num_pages (int, optional): number of pages of the converted paper.
+            Defaults to 10.
+
+    Returns:
+        fastapi.FastAPI: the fake API
+    """
+    app = fastapi.FastAPI()
+    completed_at: dict[str, float] = dict()
+    mmd_texts: dict[str, str] = dict()
+
+    @app.post("/v3/pdf")
+    async def submit(request: Request) -> dict[str, str]:
+        await request.form()
+        pdf_id = uuid.uuid4().hex
+        mmd_texts[pdf_id] = make_mathpix_text(num_pages, seed=int(pdf_id, 16))
+        completed_at[pdf_id] = time.monotonic() + processing_latency.sample()
+        return {"pdf_id": pdf_id}
+
+    @app.get("/v3/pdf/{pdf_id}.mmd")
+    async def download_mmd(pdf_id: str) -> Response:
+        return Response(mmd_texts[pdf_id], media_type="text/plain")
+
+    @app.get("/v3/pdf/{pdf_id}.tex.zip")
+    async def download_tex_zip(pdf_id: str) -> Response:
+        tex_zip = io.BytesIO()
+        with zipfile.ZipFile(tex_zip, "w") as z:
+            z.writestr("paper.tex", mmd_texts[pdf_id])
+        return Response(tex_zip.getvalue(), media_type="application/zip")
+
+    @app.get("/v3/pdf/{pdf_id}")
+    async def poll(pdf_id: str) -> JSONResponse:
+        if pdf_id not in completed_at:
+            return JSONResponse({"status": "error"}, status_code=404)
+        if time.monotonic() < completed_at[pdf_id]:
+            return JSONResponse({"status": "split"})
+        return JSONResponse({"status": "completed"})
+
+    return app
+
+
+def make_fake_openai_app(
+    chat_latency: LatencyDistribution,
+    embedding_latency: LatencyDistribution,
+    embedding_dim: int = DEFAULT_EMBEDDING_DIM,
+) -> fastapi.FastAPI:
+    """Make a fake OpenAI API of chat completions and embeddings.
+
+    Embeddings are deterministic pseudo-random unit vectors of the inputs, so
+    identical texts have identical embeddings as with the real API. Streamed chat
+    completions send the first token after the latency and one character per
+    chunk after it.
+
+    Args:
+        chat_latency (LatencyDistribution): time to complete a chat
+        embedding_latency (LatencyDistribution): time to embed a batch of inputs
+        embedding_dim (int, optional): dimension of embeddings. Defaults to 1536.
+
+    Returns:
+        fastapi.FastAPI: the fake API
+    """
+    app = fastapi.FastAPI()
+
+    @app.post("/v1/chat/completions", response_model=None)
+    async def chat_completions(
+        request: Request,
+    ) -> dict[str, Any] | StreamingResponse:
+        body = await request.json()
+        await asyncio.sleep(chat_latency.sample())
+        prompt_tokens = (
+            sum(len(message.get("content") or "") for message in body["messages"])
+            // CHARS_PER_TOKEN
+        )
+        content = "これは性能計測用のダミーの要約である。"
+        completion_tokens = len(content)
+        response_id = f"chatcmpl-{uuid.uuid4().hex}"
+        model_name = body.get("model", "gpt-3.5-turbo")
+        if body.get("stream"):
+
+            async def stream() -> AsyncIterator[str]:
+                for i, char in enumerate(content):
+                    chunk = {
+                        "id": response_id,
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": model_name,
+                        "choices": [
+                            {
+                                "index": 0,
+                                "delta": (
+                                    {"role": "assistant", "content": char}
+                                    if i == 0
+                                    else {"content": char}
+                                ),
+                                "finish_reason": None,
+                            }
+                        ],
+                    }
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(stream(), media_type="text/event-stream")
+
+        return {
+            "id": response_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model_name,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request) -> dict[str, Any]:
+        body = await request.json()
+        # The input is a text, token ids, or a list of them.
+        inputs = body["input"]
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        await asyncio.sleep(embedding_latency.sample())
+        data = []
+        num_tokens = 0
+        for index, each in enumerate(inputs):
+            # Inputs are texts, or token ids when the client tokenizes them.
+            text = each if isinstance(each, str) else " ".join(map(str, each))
+            num_tokens += (
+                len(each) if isinstance(each, list) else len(text) // CHARS_PER_TOKEN
+            )
+            seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "big")
+            vector = np.random.default_rng(seed).standard_normal(embedding_dim)
+            data.append(
+                {
+                    "object": "embedding",
+                    "index": index,
+                    "embedding": (vector / np.linalg.norm(vector)).tolist(),
+                }
+            )
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "text-embedding-ada-002"),
+            "usage": {"prompt_tokens": num_tokens, "total_tokens": num_tokens},
+        }
+
+    return app
+
+
+def find_free_port() -> int:
+    """Find a free TCP port of the localhost."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return int(s.getsockname()[1])
+
+
+class BackgroundServer:
+    """Server of an ASGI app running in a background thread.
+
+    Args:
+        app (fastapi.FastAPI): app to serve
+        port (int | None, optional): port to listen. A free port if None.
+            Defaults to None.
+
+    """
+
+    def __init__(self, app: fastapi.FastAPI, port: int | None = None) -> None:
+        self.port = port or find_free_port()
+        self.server = uvicorn.Server(
+            uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning")
+        )
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self) -> "BackgroundServer":
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.server.should_exit = True
+        self.thread.join()
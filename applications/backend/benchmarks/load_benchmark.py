@@ -0,0 +1,281 @@
+"""End-to-end load benchmark of `/papers/summarize` with fake Mathpix and OpenAI.
+
+The backend is run by gunicorn as in production, with the Mathpix and OpenAI APIs
+replaced by the local fakes of `benchmarks.fake_services` and the storage in a
+temporary directory. Papers are sent at a fixed concurrency, and each uploaded pdf
+is made unique, so every paper goes through the whole pipeline.
+
+Reports the throughput in papers/min, the percentiles of the request latency and
+the peak RSS of each worker. Peak RSS is read from `/proc`, so it is only
+reported on Linux.
+
+Usage:
+    poetry run python -m benchmarks.load_benchmark --requests 40 --concurrency 8 \
+        --workers 2 --chat-latency lognormal:2,0.5
+"""
+import argparse
+import asyncio
+import logging
+import os
+import pathlib
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, Final
+
+import httpx
+import numpy as np
+
+from benchmarks.fake_services import (
+    BackgroundServer,
+    LatencyDistribution,
+    find_free_port,
+    make_fake_mathpix_app,
+    make_fake_openai_app,
+)
+
+BACKEND_ROOT: Final = pathlib.Path(__file__).resolve().parents[1]
+SAMPLE_PDF_PATH: Final = BACKEND_ROOT / "tests" / "samples" / "sample_paper.pdf"
+STARTUP_TIMEOUT_SECONDS: Final = 120.0
+
+
+def start_backend(
+    port: int, num_workers: int, env: dict[str, str], log_path: pathlib.Path
+) -> subprocess.Popen:
+    """Start the backend by gunicorn with uvicorn workers.
+
+    Args:
+        port (int): port to listen
+        num_workers (int): number of worker processes
+        env (dict[str, str]): environment variables added to the current ones
+        log_path (pathlib.Path): path to write the logs of the backend
+
+    Returns:
+        subprocess.Popen: process of the gunicorn master
+    """
+    with log_path.open("w") as log_file:
+        return subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "gunicorn",
+                "src.app:main",
+                "-k",
+                "uvicorn.workers.UvicornWorker",
+                "-w",
+                str(num_workers),
+                "-b",
+                f"127.0.0.1:{port}",
+                "-t",
+                "6000",
+                "--log-level",
+                "warning",
+            ],
+            cwd=BACKEND_ROOT,
+            env={**os.environ, **env},
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+        )
+
+
+def wait_until_healthy(url: str, backend: subprocess.Popen) -> None:
+    """Wait until the backend responds to the health check."""
+    deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        if backend.poll() is not None:
+            raise RuntimeError("The backend exited during startup.")
+        try:
+            if httpx.get(f"{url}/health").status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError("The backend did not start in time.")
+
+
+def get_worker_pids(master_pid: int) -> list[int]:
+    """Get the process IDs of the workers of the gunicorn master."""
+    children_path = pathlib.Path(f"/proc/{master_pid}/task/{master_pid}/children")
+    if not children_path.exists():
+        return []
+    return [int(pid) for pid in children_path.read_text().split()]
+
+
+def get_peak_rss(pid: int) -> int | None:
+    """Get the peak resident set size of the process in bytes."""
+    status_path = pathlib.Path(f"/proc/{pid}/status")
+    if not status_path.exists():
+        return None
+    for line in status_path.read_text().splitlines():
+        if line.startswith("VmHWM:"):
+            return int(line.split()[1]) * 1024
+    return None
+
+
+async def send_papers(
+    client: httpx.AsyncClient,
+    url: str,
+    pdf_bytes: bytes,
+    num_papers: int,
+    form: dict[str, str],
+) -> tuple[float, int]:
+    """Send unique copies of the pdf in a request and wait for the summaries.
+
+    Args:
+        client (httpx.AsyncClient): client to send the request
+        url (str): URL of the backend
+        pdf_bytes (bytes): content of the pdf
+        num_papers (int): number of papers in the request
+        form (dict[str, str]): form fields of the request
+
+    Returns:
+        tuple[float, int]: latency in seconds and the number of failed papers
+    """
+    # Bytes after `%%EOF` are ignored by readers, but change the content hash.
+    files = [
+        (
+            "pdf_files",
+            (
+                f"paper_{i}.pdf",
+                pdf_bytes + f"\n% {uuid.uuid4().hex}\n".encode(),
+                "application/pdf",
+            ),
+        )
+        for i in range(num_papers)
+    ]
+    start = time.perf_counter()
+    response = await client.post(f"{url}/papers/summarize", data=form, files=files)
+    latency = time.perf_counter() - start
+    if response.status_code != 200:
+        return latency, num_papers
+    return latency, sum(result["error"] is not None for result in response.json())
+
+
+async def drive(
+    url: str,
+    pdf_bytes: bytes,
+    num_requests: int,
+    concurrency: int,
+    papers_per_request: int,
+    form: dict[str, str],
+) -> tuple[list[float], int, float]:
+    """Send the requests at the concurrency.
+
+    Returns:
+        tuple[list[float], int, float]: latencies of the requests, the number of
+            failed papers and the elapsed seconds
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(timeout=None) as client:
+
+        async def send() -> tuple[float, int]:
+            async with semaphore:
+                return await send_papers(
+                    client, url, pdf_bytes, papers_per_request, form
+                )
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*[send() for _ in range(num_requests)])
+        elapsed_time = time.perf_counter() - start
+    latencies = [latency for latency, _ in results]
+    return latencies, sum(num_failed for _, num_failed in results), elapsed_time
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--pdf", type=pathlib.Path, default=SAMPLE_PDF_PATH)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--papers-per-request", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--mathpix-latency", default="lognormal:3,0.5")
+    parser.add_argument("--chat-latency", default="lognormal:1,0.5")
+    parser.add_argument("--embedding-latency", default="constant:0.1")
+    parser.add_argument("--llm-model-name", default="gpt-3.5-turbo")
+    parser.add_argument(
+        "--embedding-backend", choices=["openai", "hashing"], default="openai"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    # Logs of each request of the driver would bury the report.
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    mathpix_latency = LatencyDistribution(args.mathpix_latency, seed=args.seed)
+    chat_latency = LatencyDistribution(args.chat_latency, seed=args.seed + 1)
+    embedding_latency = LatencyDistribution(args.embedding_latency, seed=args.seed + 2)
+    form = {
+        "openai_api_key": "sk-fake",
+        "mathpix_api_key": "fake",
+        "mathpix_api_id": "fake",
+        "llm_model_name": args.llm_model_name,
+        "embedding_backend": args.embedding_backend,
+    }
+    pdf_bytes = args.pdf.read_bytes()
+
+    with BackgroundServer(
+        make_fake_mathpix_app(mathpix_latency, num_pages=args.pages)
+    ) as mathpix, BackgroundServer(
+        make_fake_openai_app(chat_latency, embedding_latency)
+    ) as openai, tempfile.TemporaryDirectory() as storage_root:
+        port = find_free_port()
+        url = f"http://127.0.0.1:{port}"
+        log_path = pathlib.Path(storage_root) / "backend.log"
+        backend = start_backend(
+            port,
+            args.workers,
+            {
+                "MATHPIX_API_URL": f"{mathpix.url}/v3/pdf",
+                "OPENAI_API_BASE": f"{openai.url}/v1",
+                "BACKEND_STORAGE_ROOT": storage_root,
+            },
+            log_path,
+        )
+        try:
+            wait_until_healthy(url, backend)
+            latencies, num_failed, elapsed_time = asyncio.run(
+                drive(
+                    url,
+                    pdf_bytes,
+                    args.requests,
+                    args.concurrency,
+                    args.papers_per_request,
+                    form,
+                )
+            )
+            peak_rss = {pid: get_peak_rss(pid) for pid in get_worker_pids(backend.pid)}
+        except Exception:
+            print(log_path.read_text()[-5000:], file=sys.stderr)
+            raise
+        finally:
+            backend.send_signal(signal.SIGTERM)
+            backend.wait()
+
+    num_papers = args.requests * args.papers_per_request
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    report: dict[str, Any] = {
+        "workers": args.workers,
+        "concurrency": args.concurrency,
+        "papers": num_papers,
+        "failed papers": num_failed,
+        "elapsed [s]": f"{elapsed_time:.1f}",
+        "papers/min": f"{(num_papers - num_failed) / elapsed_time * 60:.1f}",
+        "latency p50 [s]": f"{p50:.2f}",
+        "latency p95 [s]": f"{p95:.2f}",
+        "latency p99 [s]": f"{p99:.2f}",
+    }
+    for pid, rss in peak_rss.items():
+        report[f"peak RSS of worker {pid} [MiB]"] = (
+            f"{rss / 1024 / 1024:.1f}" if rss is not None else "unknown"
+        )
+    for name, value in report.items():
+        print(f"{name:<36} {value:>10}")
+
+
+if __name__ == "__main__":
+    main()
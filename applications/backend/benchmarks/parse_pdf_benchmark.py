@@ -0,0 +1,72 @@
+"""Benchmark of `MathpixPdfParser.parse_pdf` on long papers.
+
+Usage:
+    poetry run python -m benchmarks.parse_pdf_benchmark --pages 10 100 300
+"""
+import argparse
+import random
+import time
+from typing import Final
+
+from src.usecase.mathpix_pdf_parser import MathpixPdfParser
+
+WORDS_PER_PAGE: Final = 600
+VOCABULARY: Final = "the of model we method data results propose show learning".split()
+
+
+def make_mathpix_text(num_pages: int, seed: int = 0) -> str:
+    """Make a synthetic Mathpix markdown text of a paper.
+
+    Args:
+        num_pages (int): number of pages of the paper
+        seed (int, optional): random seed. Defaults to 0.
+
+    Returns:
+        str: Mathpix markdown text
+    """
+    rng = random.Random(seed)
+
+    def paragraph(num_words: int) -> str:
+        return " ".join(rng.choice(VOCABULARY) for _ in range(num_words)) + "\n\n"
+
+    pieces = [
+        "\\title{Synthetic paper}\n\n\\begin{abstract}\n",
+        paragraph(200),
+        "\\end{abstract}\n\n",
+    ]
+    for page in range(num_pages):
+        if page % 4 == 0:
+            pieces.append(f"\\section{{Section {page // 4 + 1}}}\n\n")
+        pieces.append(f"\\subsection{{Subsection {page}}}\n\n")
+        pieces.append(paragraph(WORDS_PER_PAGE // 2))
+        pieces.append(f"\\subsubsection{{Detail {page}}}\n\n")
+        pieces.append(paragraph(WORDS_PER_PAGE // 2))
+        pieces.append("![](https://cdn.mathpix.com/figure.jpg)\n")
+        pieces.append("\\begin{tabular}{cc}\na & b \\\\\nc & d\n\\end{tabular}\n\n")
+    return "".join(pieces)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 100, 300])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    pdf_parser = MathpixPdfParser()
+    print(f"{'pages':>6} {'chars':>10} {'best [ms]':>10} {'MB/s':>8}")
+    for num_pages in args.pages:
+        text = make_mathpix_text(num_pages)
+        elapsed_times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            pdf_parser.parse_pdf(text)
+            elapsed_times.append(time.perf_counter() - start)
+        best = min(elapsed_times)
+        print(
+            f"{num_pages:>6} {len(text):>10} {best * 1000:>10.2f}"
+            f" {len(text) / best / 1e6:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Report of the import time of the app and the time of its warmup.
+
+Each measurement runs in a fresh interpreter, since modules imported once are
+cached. With `--check`, exits with 1 if importing the app imports any of the heavy
+packages, which should be imported on first use.
+
+Usage:
+    poetry run python -m benchmarks.startup_benchmark --top 15 --check
+"""
+import argparse
+import json
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Final, NamedTuple
+
+APP_MODULE: Final = "src.app"
+HEAVY_PACKAGES: Final = ["langchain", "faiss", "tiktoken", "openai", "jinja2"]
+IMPORT_TIME_PATTERN: Final = re.compile(
+    r"^import time:\s+(?P<self>\d+) \|\s+(?P<cumulative>\d+) \|\s+(?P<name>\S+)$"
+)
+
+
+class ImportTime(NamedTuple):
+    name: str
+    self_us: int
+    cumulative_us: int
+
+
+def measure_imports(module: str) -> list[ImportTime]:
+    """Import the module in a fresh interpreter with `-X importtime`.
+
+    Args:
+        module (str): name of the module to import
+
+    Returns:
+        list[ImportTime]: import time of each module imported
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    import_times = []
+    for line in completed.stderr.splitlines():
+        match = IMPORT_TIME_PATTERN.match(line)
+        if match is not None:
+            import_times.append(
+                ImportTime(
+                    name=match["name"],
+                    self_us=int(match["self"]),
+                    cumulative_us=int(match["cumulative"]),
+                )
+            )
+    return import_times
+
+
+def measure_warmup() -> dict[str, float]:
+    """Run the warmup of the app in a fresh interpreter.
+
+    Returns:
+        dict[str, float]: elapsed seconds of each step of the warmup
+    """
+    completed = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import json; from src.warmup import warmup; print(json.dumps(warmup()))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(completed.stdout.splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--skip-warmup", action="store_true")
+    args = parser.parse_args()
+
+    import_times = measure_imports(APP_MODULE)
+    (app_import_time,) = [each for each in import_times if each.name == APP_MODULE]
+    print(f"import {APP_MODULE}: {app_import_time.cumulative_us / 1000:.1f} ms")
+
+    # Self times of the modules of each top-level package add up to the time
+    # spent in the package itself.
+    package_times: defaultdict[str, int] = defaultdict(int)
+    for each in import_times:
+        package_times[each.name.split(".")[0]] += each.self_us
+    print(f"\n{'package':<30} {'self [ms]':>16}")
+    for package, self_us in sorted(
+        package_times.items(), key=lambda item: item[1], reverse=True
+    )[: args.top]:
+        print(f"{package:<30} {self_us / 1000:>16.1f}")
+
+    imported_packages = {each.name.split(".")[0] for each in import_times}
+    heavy_imported = [each for each in HEAVY_PACKAGES if each in imported_packages]
+    print(f"\nheavy packages imported eagerly: {', '.join(heavy_imported) or 'none'}")
+
+    if not args.skip_warmup:
+        print(f"\n{'warmup step':<30} {'elapsed [ms]':>16}")
+        for step, elapsed_time in measure_warmup().items():
+            print(f"{step:<30} {elapsed_time * 1000:>16.1f}")
+
+    if args.check and heavy_imported:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,429 @@
+import asyncio
+import datetime
+import fcntl
+import logging
+import os
+import pathlib
+import uuid
+from typing import TYPE_CHECKING, Any, Final
+
+from src.adapter.rdb_repository_gateway import RDBRepositoryGateway
+from src.domain.credentials_dto import CredentialsDTO
+from src.domain.job_dto import JobDTO, JobResultDTO, PaperProgressDTO
+from src.domain.paper_format_dto import SummaryConfigDTO, SummaryResultDTO
+
+if TYPE_CHECKING:
+    # The controller imports langchain, which the routers should not import
+    # together with the exceptions of this module.
+    from src.adapter.summary_controller import SummaryController
+
+logger: Final = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+FINISHED_PAPER_STATUSES: Final = ("succeeded", "failed")
+INTERRUPTED_ERROR: Final = (
+    "Interrupted: the worker processing the paper stopped. Submit it again."
+)
+
+
+class JobNotFoundError(KeyError):
+    """Raised when the requested job does not exist."""
+
+
+class JobNotFinishedError(RuntimeError):
+    """Raised when the result of a job is requested before it completes."""
+
+
+class JobController:
+    """The controller class for summarizing papers in background jobs.
+
+    Submitted papers are put into a queue and processed by a pool of worker tasks
+    running on the event loop, so the HTTP request returns immediately. Jobs and
+    the progress of their papers are stored in the repositories, so any worker
+    process can report them, and they survive restarts.
+
+    The credentials of a job are kept with its queued papers in memory only, and
+    never stored nor exposed by the job. So papers are processed by the worker
+    process which accepted them. Each worker process holds the lock of a file
+    under `lock_dir` while it lives, and unfinished papers of a worker whose lock
+    is free are reported as failed, since nobody can resume them.
+
+    Args:
+        summary_controller (SummaryController): controller to summarize a paper
+        job_repository (RDBRepositoryGateway): repository for jobs
+        job_paper_repository (RDBRepositoryGateway): repository for the progress
+            and the result of each paper of jobs
+        lock_dir (pathlib.Path): directory of the lock files of worker processes
+        num_workers (int, optional): number of papers processed at once.
+            Defaults to 4.
+        max_finished_jobs (int, optional): number of finished jobs to keep.
+            The oldest finished job is discarded when exceeded. Defaults to 1000.
+
+    """
+
+    def __init__(
+        self,
+        summary_controller: "SummaryController",
+        job_repository: RDBRepositoryGateway,
+        job_paper_repository: RDBRepositoryGateway,
+        lock_dir: pathlib.Path,
+        num_workers: int = 4,
+        max_finished_jobs: int = 1000,
+    ) -> None:
+        self.summary_controller = summary_controller
+        self.job_repository = job_repository
+        self.job_paper_repository = job_paper_repository
+        self.lock_dir = lock_dir
+        self.num_workers = num_workers
+        self.max_finished_jobs = max_finished_jobs
+        self.queue: asyncio.Queue[
+            tuple[str, int, pathlib.Path, SummaryConfigDTO, CredentialsDTO]
+        ] = asyncio.Queue()
+        self.workers: list[asyncio.Task] = []
+
+        # The lock is released by the OS when the process dies.
+        self.worker_id = uuid.uuid4().hex
+        lock_dir.mkdir(parents=True, exist_ok=True)
+        self.worker_lock_fd = os.open(
+            self._get_worker_lock_path(self.worker_id), os.O_RDWR | os.O_CREAT
+        )
+        fcntl.flock(self.worker_lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    async def submit(
+        self,
+        pdf_files: list[tuple[str, pathlib.Path]],
+        summary_config: SummaryConfigDTO,
+        credentials: CredentialsDTO,
+    ) -> JobDTO:
+        """Submit a job to summarize saved pdf files.
+
+        Args:
+            pdf_files (list[tuple[str, pathlib.Path]]): Pairs of the filename and
+                the path to the saved pdf file.
+            summary_config (SummaryConfigDTO): The config for summarizing.
+            credentials (CredentialsDTO): The credentials of the request.
+
+        Returns:
+            JobDTO: The submitted job.
+        """
+        self._ensure_workers()
+        job = JobDTO(
+            job_id=uuid.uuid4().hex,
+            created_at=datetime.datetime.now(datetime.timezone.utc),
+            papers=[PaperProgressDTO(filename=filename) for filename, _ in pdf_files],
+        )
+        await asyncio.to_thread(self._save_job, job)
+        await asyncio.to_thread(
+            self._save_papers,
+            job.job_id,
+            {index: paper for index, paper in enumerate(job.papers)},
+        )
+        for index, (_, pdf_file_path) in enumerate(pdf_files):
+            self.queue.put_nowait(
+                (job.job_id, index, pdf_file_path, summary_config, credentials)
+            )
+        logger.info(f"Job `{job.job_id}` is submitted with {len(pdf_files)} papers.")
+        return job
+
+    async def get_job(self, job_id: str) -> JobDTO:
+        """Get the progress of the job.
+
+        Args:
+            job_id (str): The ID of the job.
+
+        Returns:
+            JobDTO: The job.
+        """
+        job, _ = await asyncio.to_thread(self._load_job, job_id)
+        return job
+
+    async def get_result(self, job_id: str) -> JobResultDTO:
+        """Get the result of the completed job.
+
+        Args:
+            job_id (str): The ID of the job.
+
+        Returns:
+            JobResultDTO: The summary results of the job.
+        """
+        job, results = await asyncio.to_thread(self._load_job, job_id)
+        if job.status != "completed":
+            raise JobNotFinishedError(job_id)
+        return JobResultDTO(
+            job_id=job_id,
+            results=[result for result in results if result is not None],
+        )
+
+    def _ensure_workers(self) -> None:
+        """Start the worker tasks if they are not running."""
+        self.workers = [worker for worker in self.workers if not worker.done()]
+        for _ in range(self.num_workers - len(self.workers)):
+            self.workers.append(asyncio.create_task(self._worker()))
+
+    async def _worker(self) -> None:
+        """Process queued papers one by one."""
+        while True:
+            (
+                job_id,
+                index,
+                pdf_file_path,
+                summary_config,
+                credentials,
+            ) = await self.queue.get()
+            try:
+                await self._process_paper(
+                    job_id, index, pdf_file_path, summary_config, credentials
+                )
+            except Exception:
+                logger.exception(f"Worker failed to process job `{job_id}`.")
+            finally:
+                self.queue.task_done()
+
+    async def _process_paper(
+        self,
+        job_id: str,
+        index: int,
+        pdf_file_path: pathlib.Path,
+        summary_config: SummaryConfigDTO,
+        credentials: CredentialsDTO,
+    ) -> None:
+        """Summarize a paper of the job and record its progress.
+
+        Args:
+            job_id (str): The ID of the job.
+            index (int): The index of the paper in the job.
+            pdf_file_path (pathlib.Path): The path to the saved pdf file.
+            summary_config (SummaryConfigDTO): The config for summarizing.
+            credentials (CredentialsDTO): The credentials of the job.
+        """
+        job, _ = await asyncio.to_thread(self._load_job, job_id)
+        paper = job.papers[index]
+        if job.status == "pending":
+            job.status = "running"
+            await asyncio.to_thread(self._save_job, job)
+        paper.status = "running"
+        await asyncio.to_thread(self._save_papers, job_id, {index: paper})
+
+        # Stages are recorded in the background, in order, so the pipeline does
+        # not wait for the repository.
+        stage_updates: list[asyncio.Task] = []
+
+        def on_stage(stage: str) -> None:
+            paper.stage = stage
+            previous_update = stage_updates[-1] if stage_updates else None
+            stage_updates.append(
+                asyncio.create_task(
+                    self._asave_stage(job_id, index, paper.copy(), previous_update)
+                )
+            )
+
+        result = await self.summary_controller.summarize_pdf(
+            pdf_file_path,
+            paper.filename,
+            summary_config,
+            credentials,
+            on_stage=on_stage,
+        )
+        await asyncio.gather(*stage_updates, return_exceptions=True)
+        paper.stage = None
+        paper.status = "failed" if result.error is not None else "succeeded"
+        paper.error = result.error
+        await asyncio.to_thread(
+            self._save_papers, job_id, {index: paper}, {index: result}
+        )
+
+        # Other papers of the job may have finished meanwhile.
+        job, _ = await asyncio.to_thread(self._load_job, job_id)
+        if job.status == "completed":
+            job.finished_at = datetime.datetime.now(datetime.timezone.utc)
+            await asyncio.to_thread(self._save_job, job)
+            logger.info(f"Job `{job_id}` is completed.")
+            await asyncio.to_thread(self._discard_old_jobs)
+
+    async def _asave_stage(
+        self,
+        job_id: str,
+        index: int,
+        paper: PaperProgressDTO,
+        previous_update: asyncio.Task | None,
+    ) -> None:
+        """Save the stage of the paper after the previous stage is saved."""
+        if previous_update is not None:
+            await asyncio.wait([previous_update])
+        await asyncio.to_thread(self._save_papers, job_id, {index: paper})
+
+    def _load_job(self, job_id: str) -> tuple[JobDTO, list[SummaryResultDTO | None]]:
+        """Load the job and the results of its papers from the repositories.
+
+        Unfinished papers of a stopped worker process are marked as failed.
+
+        Args:
+            job_id (str): The ID of the job.
+
+        Returns:
+            tuple[JobDTO, list[SummaryResultDTO | None]]: The job, and the result
+                of each paper if it is finished.
+        """
+        job_records = self.job_repository.get({"job_id": job_id})
+        if not job_records:
+            raise JobNotFoundError(job_id)
+        paper_records = sorted(
+            self.job_paper_repository.get({"job_id": job_id}),
+            key=lambda record: int(record["paper_index"]),
+        )
+
+        papers = [
+            PaperProgressDTO(
+                filename=record["filename"],
+                status=record["status"],
+                stage=record["stage"],
+                error=record["error"],
+            )
+            for record in paper_records
+        ]
+        results = [
+            SummaryResultDTO.parse_obj(record["result"])
+            if record["result"] is not None
+            else None
+            for record in paper_records
+        ]
+        interrupted_papers = {
+            index: paper
+            for index, (paper, record) in enumerate(zip(papers, paper_records))
+            if paper.status not in FINISHED_PAPER_STATUSES
+            and not self._is_worker_alive(record["worker_id"])
+        }
+        interrupted_results = {
+            index: SummaryResultDTO(filename=paper.filename, error=INTERRUPTED_ERROR)
+            for index, paper in interrupted_papers.items()
+        }
+        for index, paper in interrupted_papers.items():
+            paper.status = "failed"
+            paper.stage = None
+            paper.error = INTERRUPTED_ERROR
+            results[index] = interrupted_results[index]
+        if interrupted_papers:
+            logger.warning(
+                f"{len(interrupted_papers)} papers of job `{job_id}` were interrupted."
+            )
+            self._save_papers(job_id, interrupted_papers, interrupted_results)
+
+        job_record = job_records[0]
+        job = JobDTO(
+            job_id=job_id,
+            status=job_record["status"],
+            created_at=_from_timestamp(job_record["created_at"]),
+            finished_at=(
+                _from_timestamp(job_record["finished_at"])
+                if job_record["finished_at"] is not None
+                else None
+            ),
+            papers=papers,
+        )
+        if all(paper.status in FINISHED_PAPER_STATUSES for paper in papers):
+            job.status = "completed"
+            if job.finished_at is None and interrupted_papers:
+                job.finished_at = datetime.datetime.now(datetime.timezone.utc)
+                self._save_job(job)
+        return job, results
+
+    def _save_job(self, job: JobDTO) -> None:
+        """Save the job without its papers to the repository."""
+        self.job_repository.set(
+            [
+                {
+                    "job_id": job.job_id,
+                    "status": job.status,
+                    "created_at": job.created_at.timestamp(),
+                    "finished_at": (
+                        job.finished_at.timestamp()
+                        if job.finished_at is not None
+                        else None
+                    ),
+                }
+            ]
+        )
+
+    def _save_papers(
+        self,
+        job_id: str,
+        papers: dict[int, PaperProgressDTO],
+        results: dict[int, SummaryResultDTO] = {},
+    ) -> None:
+        """Save the progress and the results of the papers to the repository.
+
+        Args:
+            job_id (str): The ID of the job.
+            papers (dict[int, PaperProgressDTO]): The papers by index.
+            results (dict[int, SummaryResultDTO], optional): The results of the
+                finished papers by index. Defaults to {}.
+        """
+        records: list[dict[str, Any]] = [
+            {
+                "job_id": job_id,
+                "paper_index": index,
+                "filename": paper.filename,
+                "status": paper.status,
+                "stage": paper.stage,
+                "error": paper.error,
+                "result": (
+                    results[index].dict(exclude_none=True) if index in results else None
+                ),
+                "worker_id": self.worker_id,
+            }
+            for index, paper in papers.items()
+        ]
+        self.job_paper_repository.set(records)
+
+    def _discard_old_jobs(self) -> None:
+        """Discard the oldest finished jobs beyond `max_finished_jobs`.
+
+        Only the IDs of the jobs to discard are read, in the order of the index of
+        the status and the finish time.
+        """
+        job_ids = [
+            record["job_id"]
+            for record in self.job_repository.get(
+                {"status": "completed"},
+                columns=["job_id"],
+                order_by="finished_at",
+                descending=True,
+                offset=self.max_finished_jobs,
+            )
+        ]
+        if not job_ids:
+            return
+        self.job_paper_repository.delete({"job_id": job_ids})
+        self.job_repository.delete({"job_id": job_ids})
+
+    def _get_worker_lock_path(self, worker_id: str) -> pathlib.Path:
+        return self.lock_dir / f"job_worker_{worker_id}.lock"
+
+    def _is_worker_alive(self, worker_id: str) -> bool:
+        """Check whether the worker process still holds its lock.
+
+        Args:
+            worker_id (str): The ID of the worker process.
+
+        Returns:
+            bool: True if the worker process is alive.
+        """
+        if worker_id == self.worker_id:
+            return True
+        try:
+            fd = os.open(self._get_worker_lock_path(worker_id), os.O_RDWR)
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+        # Nobody will take the lock of the stopped worker again.
+        self._get_worker_lock_path(worker_id).unlink(missing_ok=True)
+        return False
+
+
+def _from_timestamp(timestamp: float) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
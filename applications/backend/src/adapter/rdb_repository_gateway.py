@@ -4,13 +4,25 @@ from typing import Any
 
 class RDBRepositoryGateway(ABC):
     @abstractmethod
-    def get(self, element: int | dict[str, Any]) -> list[Any]:
+    def get(
+        self,
+        element: int | dict[str, Any],
+        columns: list[str] | None = None,
+        order_by: str | None = None,
+        descending: bool = False,
+        limit: int | None = None,
+        offset: int = 0,
+    ) -> list[Any]:
         pass
 
     @abstractmethod
     def set(self, record: list[Any]) -> bool:
         pass
 
+    @abstractmethod
+    def delete(self, element: int | dict[str, Any]) -> int:
+        pass
+
     @abstractmethod
     def is_exist(self, element: int | dict[str, Any]) -> bool:
         pass
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+from typing import Final
+
+import numpy as np
+
+from src.domain.credentials_dto import CredentialsDTO, get_secret_value
+from src.domain.search_dto import ChunkSearchResultDTO
+from src.usecase.embeddings import build_embeddings
+from src.usecase.rate_limiter import OpenAIRateLimiter
+from src.usecase.vectorstore import CorpusIndex
+
+logger: Final = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+
+class SearchController:
+    """The controller class for searching the chunks of summarized papers.
+
+    Args:
+        corpus_indices (dict[str, CorpusIndex]): indices of the chunks of all
+            papers by embedding backend
+        rate_limiter (OpenAIRateLimiter | None, optional): rate limiter of the
+            calls to OpenAI shared with the summarization. Defaults to None.
+
+    """
+
+    def __init__(
+        self,
+        corpus_indices: dict[str, CorpusIndex],
+        rate_limiter: OpenAIRateLimiter | None = None,
+    ) -> None:
+        self.corpus_indices = corpus_indices
+        self.rate_limiter = rate_limiter
+
+    async def search(
+        self,
+        query: str,
+        k: int = 10,
+        paper_id: str | None = None,
+        embedding_backend: str = "openai",
+        credentials: CredentialsDTO | None = None,
+    ) -> list[ChunkSearchResultDTO]:
+        """Search chunks related to the query.
+
+        Args:
+            query (str): The query text.
+            k (int, optional): The number of chunks to return. Defaults to 10.
+            paper_id (str | None, optional): The ID of the paper to search in.
+                Search all papers if None. Defaults to None.
+            embedding_backend (str, optional): The embedding backend of the papers
+                to search. Defaults to "openai".
+            credentials (CredentialsDTO | None, optional): The credentials of the
+                request. The environment variable is used if None.
+                Defaults to None.
+
+        Returns:
+            list[ChunkSearchResultDTO]: The chunks in the order of relevance.
+        """
+        embeddings, _ = build_embeddings(
+            embedding_backend,
+            self.rate_limiter,
+            get_secret_value((credentials or CredentialsDTO()).openai_api_key),
+        )
+        vector = await asyncio.to_thread(embeddings.embed_query, query)
+        (results,) = await asyncio.to_thread(
+            self.corpus_indices[embedding_backend].search,
+            np.array([vector]),
+            k,
+            paper_id,
+        )
+        return [
+            ChunkSearchResultDTO(
+                paper_id=document.metadata["paper_id"],
+                section=document.metadata.get("section"),
+                text=document.page_content,
+                distance=distance,
+            )
+            for document, distance in results
+        ]
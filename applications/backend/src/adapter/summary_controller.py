@@ -1,63 +1,453 @@
+import asyncio
 import logging
 import pathlib
-from typing import Final
+import time
+from typing import Any, AsyncIterator, Callable, Final
 
 from fastapi import UploadFile
 
 from src.adapter.rdb_repository_gateway import RDBRepositoryGateway
-from src.domain.paper_format_dto import SummaryConfigDTO, SummaryFormat
+from src.domain.credentials_dto import CredentialsDTO
+from src.domain.paper_format_dto import (
+    SummaryConfigDTO,
+    SummaryFormat,
+    SummaryResultDTO,
+)
+from src.domain.parsed_paper_dto import ParsedPaperDTO
+from src.domain.summary_event_dto import SummaryEventDTO
+from src.usecase.completion_cache import CompletionCache
+from src.usecase.embeddings import (
+    EMBEDDING_BACKENDS,
+    EmbeddingCache,
+    QueryEmbeddingCache,
+)
+from src.usecase.embeddings.cached_embeddings import DEFAULT_MAX_ENTRIES
 from src.usecase.mathpix_pdf_parser import MathpixPdfParser
-from src.usecase.paper_io_handler import PaperIOHandler
+from src.usecase.metrics import count_cache_lookups, track_stage
+from src.usecase.paper_io_handler import MAX_PDF_FILE_SIZE, PaperIOHandler
+from src.usecase.rate_limiter import OpenAIRateLimiter
+from src.usecase.single_flight import SingleFlight
 from src.usecase.summarizer.ochiai_format_summarizer import OchiaiFormatSummarizer
 from src.usecase.summary_handler import SummaryHandler
+from src.usecase.vectorstore import CorpusIndex
 
 logger: Final = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
 
+class PaperSummarizationError(RuntimeError):
+    """Raised when some of the papers summarized at once fail."""
+
+
 class SummaryController:
-    """The controller class for summarizing papers."""
+    """The controller class for summarizing papers.
+
+    Papers are processed concurrently. The number of papers in flight and the
+    number of concurrent calls to each external service are bounded separately.
+    Credentials are passed with each request, so papers of requests with different
+    API keys can be processed at once. Parsed papers and summaries are stored in
+    the repositories, so a paper seen before skips Mathpix by an indexed lookup.
+    The same paper in flight in several requests, even in other workers, is
+    parsed and summarized once, and the others wait for and reuse the results.
+
+    Args:
+        paper_repository (RDBRepositoryGateway): repository for papers and their
+            parsed structure
+        summary_repository (RDBRepositoryGateway): repository for summaries
+        static_files_storage_root (pathlib.Path): root directory to store files
+        max_concurrent_papers (int, optional): maximum number of papers processed
+            at once. Defaults to 4.
+        max_concurrent_mathpix (int, optional): maximum number of papers sent to
+            Mathpix at once. Defaults to 4.
+        max_concurrent_openai (int, optional): maximum number of papers summarized
+            with OpenAI at once. Defaults to 2.
+        max_pdf_file_size (int | None, optional): maximum size of an uploaded pdf
+            file in bytes. No limit if None. Defaults to 100 MiB.
+        embedding_cache_max_entries (int, optional): maximum number of embeddings
+            kept in the cache under `static_files_storage_root`.
+            Defaults to 200,000.
+
+    """
 
     def __init__(
         self,
         paper_repository: RDBRepositoryGateway,
         summary_repository: RDBRepositoryGateway,
         static_files_storage_root: pathlib.Path,
+        max_concurrent_papers: int = 4,
+        max_concurrent_mathpix: int = 4,
+        max_concurrent_openai: int = 2,
+        max_pdf_file_size: int | None = MAX_PDF_FILE_SIZE,
+        embedding_cache_max_entries: int = DEFAULT_MAX_ENTRIES,
     ) -> None:
         self.paper_repository = paper_repository
         self.summary_repository = summary_repository
-        self.iohandler = PaperIOHandler(static_files_storage_root)
+        self.iohandler = PaperIOHandler(
+            static_files_storage_root, max_file_size=max_pdf_file_size
+        )
         self.pdf_parser = MathpixPdfParser()
-        self.summary_handler = SummaryHandler(summarizer=OchiaiFormatSummarizer)
+        self.corpus_indices = {
+            backend: CorpusIndex(static_files_storage_root / "corpus_index" / backend)
+            for backend in EMBEDDING_BACKENDS
+        }
+        self.rate_limiter = OpenAIRateLimiter(
+            static_files_storage_root / "rate_limits.sqlite3"
+        )
+        # Locks are files shared by the workers of the storage.
+        self.single_flight = SingleFlight(static_files_storage_root / "locks")
+        self.summary_handler = SummaryHandler(
+            summarizer=OchiaiFormatSummarizer,
+            embedding_cache=EmbeddingCache(
+                static_files_storage_root / "embedding_cache.sqlite3",
+                max_entries=embedding_cache_max_entries,
+            ),
+            query_embedding_cache=QueryEmbeddingCache(
+                static_files_storage_root / "query_embeddings.npz"
+            ),
+            completion_cache=CompletionCache(
+                static_files_storage_root / "completion_cache.sqlite3"
+            ),
+            corpus_indices=self.corpus_indices,
+            rate_limiter=self.rate_limiter,
+            summary_repository=summary_repository,
+            single_flight=self.single_flight,
+        )
+        self.paper_semaphore = asyncio.Semaphore(max_concurrent_papers)
+        self.mathpix_semaphore = asyncio.Semaphore(max_concurrent_mathpix)
+        self.openai_semaphore = asyncio.Semaphore(max_concurrent_openai)
 
-    def summarize(
-        self, pdf_files: list[UploadFile], summary_config: SummaryConfigDTO
+    async def summarize(
+        self,
+        pdf_files: list[UploadFile],
+        summary_config: SummaryConfigDTO,
+        credentials: CredentialsDTO,
     ) -> list[SummaryFormat]:
         """Summarize the given pdf files.
 
         Args:
             pdf_files (list[UploadFile]): The pdf files to summarize.
             summary_config (SummaryConfigDTO): The config for summarizing.
+            credentials (CredentialsDTO): The credentials of the request.
 
         Returns:
-            list[SummaryFormat]: The summary list of the given pdf files.
+            list[SummaryFormat]: The summary list of the given pdf files in the same
+                order as `pdf_files`.
         """
-        summary_list = []
-        for i, pdf_file in enumerate(pdf_files):
-            logger.info(
-                f"[{i+1}/{len(pdf_files)}] Start Processing `{pdf_file.filename}`."
+        # A failure of one paper does not cancel the others, so their summaries
+        # are stored for a retry.
+        results = await asyncio.gather(
+            *[
+                self._save_and_summarize(pdf_file, summary_config, credentials)
+                for pdf_file in pdf_files
+            ]
+        )
+        errors = [
+            f"`{result.filename}`: {result.error}"
+            for result in results
+            if result.summary is None
+        ]
+        if errors:
+            raise PaperSummarizationError(
+                f"Failed to summarize {len(errors)} papers. {' '.join(errors)}"
             )
-            # Save pdf files to the storage
-            pdf_file_path = self.iohandler.save_pdf(pdf_file)
+        return [result.summary for result in results if result.summary is not None]
+
+    async def astream_summaries(
+        self,
+        saved_pdf_files: list[tuple[str, pathlib.Path]],
+        summary_config: SummaryConfigDTO,
+        credentials: CredentialsDTO,
+        stream_tokens: bool = False,
+    ) -> AsyncIterator[SummaryEventDTO]:
+        """Summarize the saved pdf files, yielding events as they happen.
 
-            # parse pdf file and save it to storage
-            pdf_text = self.pdf_parser.load_pdf(pdf_file_path)
-            parsed_pdf = self.pdf_parser.parse_pdf(pdf_text)
+        Each paper yields `stage` events as it enters each stage, `field` events as
+        each field of its summary is generated, and a `result` event at the end.
+        Papers are processed concurrently, so their events are interleaved and
+        results arrive in the order of completion. Results are not kept after
+        they are yielded.
 
-            # Make a summary from the parsed pdf
-            summary = self.summary_handler.make_summary(
-                parsed_pdf, pdf_file_path, summary_config
+        Papers still in progress are cancelled when the consumer stops, e.g. the
+        client disconnects.
+
+        Args:
+            saved_pdf_files (list[tuple[str, pathlib.Path]]): The filenames and
+                the paths of the saved pdf files.
+            summary_config (SummaryConfigDTO): The config for summarizing.
+            credentials (CredentialsDTO): The credentials of the request.
+            stream_tokens (bool, optional): Whether to yield `token` events of each
+                token generated by the LLM. Defaults to False.
+
+        Yields:
+            SummaryEventDTO: The events of the papers.
+        """
+        queue: asyncio.Queue[SummaryEventDTO] = asyncio.Queue()
+
+        async def summarize_and_notify(
+            index: int, filename: str, pdf_file_path: pathlib.Path
+        ) -> None:
+            # Callbacks are called in the event loop, so the queue needs no lock.
+            def notify(**kwargs: Any) -> None:
+                queue.put_nowait(
+                    SummaryEventDTO(index=index, filename=filename, **kwargs)
+                )
+
+            def on_token(chain: str, text: str) -> None:
+                notify(event="token", chain=chain, text=text)
+
+            result = await self.summarize_pdf(
+                pdf_file_path,
+                filename,
+                summary_config,
+                credentials,
+                on_stage=lambda stage: notify(event="stage", stage=stage),
+                on_field=lambda field, text: notify(
+                    event="field", field=field, text=text
+                ),
+                on_token=on_token if stream_tokens else None,
+            )
+            notify(event="result", result=result)
+
+        tasks = [
+            asyncio.create_task(summarize_and_notify(index, filename, pdf_file_path))
+            for index, (filename, pdf_file_path) in enumerate(saved_pdf_files)
+        ]
+        try:
+            num_remaining = len(tasks)
+            while num_remaining > 0:
+                event = await queue.get()
+                if event.event == "result":
+                    num_remaining -= 1
+                yield event
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def save_pdf(self, pdf_file: UploadFile) -> pathlib.Path:
+        """Save the given pdf file to the storage in a worker thread.
+
+        Args:
+            pdf_file (UploadFile): The pdf file to save.
+
+        Returns:
+            pathlib.Path: The path to the saved pdf file.
+        """
+        with track_stage("upload"):
+            return await asyncio.to_thread(self.iohandler.save_pdf, pdf_file)
+
+    async def summarize_pdf(
+        self,
+        pdf_file_path: pathlib.Path,
+        filename: str,
+        summary_config: SummaryConfigDTO,
+        credentials: CredentialsDTO,
+        on_stage: Callable[[str], None] | None = None,
+        on_field: Callable[[str, str], None] | None = None,
+        on_token: Callable[[str, str], None] | None = None,
+    ) -> SummaryResultDTO:
+        """Run the pipeline after saving for a single paper.
+
+        Args:
+            pdf_file_path (pathlib.Path): The path to the saved pdf file.
+            filename (str): The filename of the uploaded paper.
+            summary_config (SummaryConfigDTO): The config for summarizing.
+            credentials (CredentialsDTO): The credentials of the request.
+            on_stage (Callable[[str], None] | None, optional): Callback called with
+                the name of each stage when it starts. Defaults to None.
+            on_field (Callable[[str, str], None] | None, optional): Callback called
+                with the name and the text of each field of the summary when it
+                is generated. Defaults to None.
+            on_token (Callable[[str, str], None] | None, optional): Callback called
+                with the name of the chain and each token generated by the LLM.
+                Defaults to None.
+
+        Returns:
+            SummaryResultDTO: The summary or the error of the paper.
+        """
+        async with self.paper_semaphore:
+            return await self._summarize_saved_pdf(
+                pdf_file_path,
+                filename,
+                summary_config,
+                credentials,
+                on_stage=on_stage,
+                on_field=on_field,
+                on_token=on_token,
+            )
+
+    async def _summarize_saved_pdf(
+        self,
+        pdf_file_path: pathlib.Path,
+        filename: str,
+        summary_config: SummaryConfigDTO,
+        credentials: CredentialsDTO,
+        on_stage: Callable[[str], None] | None = None,
+        on_field: Callable[[str, str], None] | None = None,
+        on_token: Callable[[str, str], None] | None = None,
+    ) -> SummaryResultDTO:
+        """Run the pipeline after saving for a single paper in a slot of papers.
+
+        Arguments are the same as `summarize_pdf`.
+
+        Returns:
+            SummaryResultDTO: The summary or the error of the paper.
+        """
+
+        def notify(stage: str) -> None:
+            if on_stage is not None:
+                on_stage(stage)
+
+        logger.info(f"Start Processing `{filename}`.")
+        try:
+            # The same paper in flight, e.g. uploaded by two requests at once,
+            # is sent to Mathpix only once. Papers are stored under the hash of
+            # their content, so it keys the paper.
+            parsed_pdf, _ = await self.single_flight.run(
+                "parse",
+                pdf_file_path.parent.name,
+                lambda: self._aload_or_parse_paper(
+                    pdf_file_path, filename, credentials, notify
+                ),
             )
-            summary_list.append(summary)
 
-        return summary_list
+            # Make a summary from the parsed pdf
+            with track_stage("openai_queue"):
+                await self.openai_semaphore.acquire()
+            try:
+                notify("summarizing")
+                with track_stage("summarize"):
+                    summary = await self.summary_handler.make_summary(
+                        parsed_pdf,
+                        pdf_file_path,
+                        summary_config,
+                        credentials,
+                        on_field=on_field,
+                        on_token=on_token,
+                    )
+            finally:
+                self.openai_semaphore.release()
+        except Exception as e:
+            logger.exception(f"Failed to process `{filename}`.")
+            return SummaryResultDTO(filename=filename, error=f"{type(e).__name__}: {e}")
+
+        logger.info(f"Finished processing `{filename}`.")
+        return SummaryResultDTO(filename=filename, summary=summary)
+
+    async def _aload_or_parse_paper(
+        self,
+        pdf_file_path: pathlib.Path,
+        filename: str,
+        credentials: CredentialsDTO,
+        notify: Callable[[str], None],
+    ) -> ParsedPaperDTO:
+        """Load the parsed paper from the repository, or parse it by Mathpix.
+
+        Args:
+            pdf_file_path (pathlib.Path): The path to the saved pdf file.
+            filename (str): The filename of the uploaded paper.
+            credentials (CredentialsDTO): The credentials of the request.
+            notify (Callable[[str], None]): Callback called with the name of each
+                stage when it starts.
+
+        Returns:
+            ParsedPaperDTO: The parsed paper.
+        """
+        # Looked up under the lock of the paper, so a paper parsed by another
+        # worker while waiting for it is reused.
+        parsed_pdf = await asyncio.to_thread(self._load_parsed_paper, pdf_file_path)
+        if parsed_pdf is not None:
+            return parsed_pdf
+
+        # parse pdf file and save it to storage
+        with track_stage("mathpix_queue"):
+            await self.mathpix_semaphore.acquire()
+        try:
+            notify("mathpix")
+            with track_stage("mathpix"):
+                pdf_text = await self.pdf_parser.aload_pdf(pdf_file_path, credentials)
+        finally:
+            self.mathpix_semaphore.release()
+        notify("parsing")
+        with track_stage("parse_pdf"):
+            parsed_pdf = await asyncio.to_thread(self.pdf_parser.parse_pdf, pdf_text)
+        await asyncio.to_thread(
+            self._save_parsed_paper, pdf_file_path, filename, parsed_pdf
+        )
+        return parsed_pdf
+
+    def _load_parsed_paper(self, pdf_file_path: pathlib.Path) -> ParsedPaperDTO | None:
+        """Load the parsed structure of the paper from the repository.
+
+        Args:
+            pdf_file_path (pathlib.Path): The path to the saved pdf file.
+
+        Returns:
+            ParsedPaperDTO | None: The parsed paper, or None if it is not parsed
+                with the current options of the parser.
+        """
+        records = self.paper_repository.get(
+            {
+                "paper_id": pdf_file_path.parent.name,
+                "parser_key": self.pdf_parser.cache_key,
+            }
+        )
+        if not records:
+            count_cache_lookups("parsed_paper", hits=0, misses=1)
+            return None
+        count_cache_lookups("parsed_paper", hits=1, misses=0)
+        return ParsedPaperDTO.parse_obj(records[0]["parsed_paper"])
+
+    def _save_parsed_paper(
+        self, pdf_file_path: pathlib.Path, filename: str, parsed_paper: ParsedPaperDTO
+    ) -> None:
+        """Save the paper and its parsed structure to the repository.
+
+        Args:
+            pdf_file_path (pathlib.Path): The path to the saved pdf file.
+            filename (str): The filename of the uploaded paper.
+            parsed_paper (ParsedPaperDTO): The parsed paper.
+        """
+        self.paper_repository.set(
+            [
+                {
+                    # Papers are stored under the hash of their content.
+                    "paper_id": pdf_file_path.parent.name,
+                    "filename": filename,
+                    "pdf_path": str(pdf_file_path),
+                    "parser_key": self.pdf_parser.cache_key,
+                    "parsed_paper": parsed_paper.dict(),
+                    "created_at": time.time(),
+                }
+            ]
+        )
+
+    async def _save_and_summarize(
+        self,
+        pdf_file: UploadFile,
+        summary_config: SummaryConfigDTO,
+        credentials: CredentialsDTO,
+    ) -> SummaryResultDTO:
+        """Save a single paper to the storage and summarize it.
+
+        Args:
+            pdf_file (UploadFile): The pdf file to summarize.
+            summary_config (SummaryConfigDTO): The config for summarizing.
+            credentials (CredentialsDTO): The credentials of the request.
+
+        Returns:
+            SummaryResultDTO: The summary or the error of the paper.
+        """
+        filename = str(pdf_file.filename)
+        # Uploads are saved in the slot of the paper too, so a large batch does not
+        # write all of its files at once.
+        async with self.paper_semaphore:
+            try:
+                pdf_file_path = await self.save_pdf(pdf_file)
+            except Exception as e:
+                logger.exception(f"Failed to save `{filename}`.")
+                return SummaryResultDTO(
+                    filename=filename, error=f"{type(e).__name__}: {e}"
+                )
+            return await self._summarize_saved_pdf(
+                pdf_file_path, filename, summary_config, credentials
+            )
@@ -1,17 +1,45 @@
-from typing import Final
+import asyncio
+import contextlib
+import os
+import sys
+from typing import AsyncIterator, Final
 
 import fastapi
 
 from src import routers
+from src.warmup import warmup
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: fastapi.FastAPI) -> AsyncIterator[None]:
+    """Warm up the worker before it accepts requests, and close the HTTP clients
+    shared by the worker at shutdown."""
+    if os.environ.get("BACKEND_WARMUP", "1") != "0":
+        await asyncio.to_thread(warmup)
+
+        from src.usecase.http_clients import get_async_http_client, get_openai_session
+
+        get_async_http_client()
+        get_openai_session()
+    yield
+
+    if "src.usecase.http_clients" in sys.modules:
+        from src.usecase.http_clients import aclose_http_clients
+
+        await aclose_http_clients()
 
 
 def main() -> fastapi.FastAPI:
     """Create FastAPI application instance.
 
+    The worker is warmed up at startup unless the environment variable
+    `BACKEND_WARMUP` is `0`. Without the warmup, heavy dependencies are imported
+    by the first request which needs them.
+
     Returns:
         fastapi.FastAPI: A FastAPI application instance.
 
     """
-    app: Final = fastapi.FastAPI()
+    app: Final = fastapi.FastAPI(lifespan=lifespan)
     app.include_router(routers.router)
     return app
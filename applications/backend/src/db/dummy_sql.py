@@ -9,12 +9,23 @@ class DummySQL(RDBRepositoryGateway):
     ) -> None:
         pass
 
-    def get(self, element: int | dict[str, Any]) -> list[Any]:
+    def get(
+        self,
+        element: int | dict[str, Any],
+        columns: list[str] | None = None,
+        order_by: str | None = None,
+        descending: bool = False,
+        limit: int | None = None,
+        offset: int = 0,
+    ) -> list[Any]:
         return ["dummy_data"]
 
     def set(self, record: list[Any]) -> bool:
         return True
 
+    def delete(self, element: int | dict[str, Any]) -> int:
+        return 0
+
     def is_exist(self, element: int | dict[str, Any]) -> bool:
         return True
 
@@ -0,0 +1,315 @@
+import contextlib
+import json
+import pathlib
+import queue
+import sqlite3
+import threading
+from typing import Any, Final, Iterator
+
+from src.adapter.rdb_repository_gateway import RDBRepositoryGateway
+
+DEFAULT_MAX_CONNECTIONS: Final = 8
+DEFAULT_BUSY_TIMEOUT_SECONDS: Final = 30.0
+# Columns of this type are stored as JSON texts and decoded when read.
+JSON_COLUMN_TYPE: Final = "JSON"
+
+
+class SQLiteConnectionPool:
+    """Pool of connections to a SQLite database in WAL mode.
+
+    Connections are created on demand up to `max_connections` and reused, so a
+    query does not pay for opening the database. In WAL mode, readers do not
+    block each other nor the writer, so repositories can be queried from many
+    worker threads at once. Writers of other processes are waited for up to the
+    busy timeout.
+
+    Args:
+        database_path (pathlib.Path): path to the SQLite database
+        max_connections (int, optional): maximum number of connections.
+            Defaults to 8.
+        busy_timeout_seconds (float, optional): seconds to wait for the lock of
+            another writer. Defaults to 30.0.
+
+    """
+
+    def __init__(
+        self,
+        database_path: pathlib.Path,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        busy_timeout_seconds: float = DEFAULT_BUSY_TIMEOUT_SECONDS,
+    ) -> None:
+        self.database_path = database_path
+        self.busy_timeout_seconds = busy_timeout_seconds
+        self.idle_connections: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(max_connections)
+        database_path.parent.mkdir(parents=True, exist_ok=True)
+
+    @contextlib.contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection, waiting for one if all are in use.
+
+        Yields:
+            sqlite3.Connection: connection in autocommit mode
+        """
+        self.slots.acquire()
+        try:
+            try:
+                connection = self.idle_connections.get_nowait()
+            except queue.Empty:
+                connection = self._connect()
+            try:
+                yield connection
+            finally:
+                if connection.in_transaction:
+                    connection.rollback()
+                self.idle_connections.put(connection)
+        finally:
+            self.slots.release()
+
+    def close(self) -> None:
+        """Close the idle connections."""
+        while True:
+            try:
+                self.idle_connections.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(
+            str(self.database_path),
+            timeout=self.busy_timeout_seconds,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        # Commits in WAL mode are durable enough without syncing every time.
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA foreign_keys=ON")
+        return connection
+
+
+class SQLiteRDB(RDBRepositoryGateway):
+    """Repository of a table of a SQLite database.
+
+    Records are dicts from column names to values. Values of `JSON` columns are
+    stored as JSON texts, so nested DTOs can be stored by `dict()`. Lookups by a
+    dict of columns are answered by the indices of the primary key and
+    `indices`, and a list of values in the dict looks up all of them in one
+    query.
+
+    Args:
+        pool (SQLiteConnectionPool): pool of connections to the database
+        table_name (str): name of the table
+        columns (dict[str, str]): definitions of the columns by name, e.g.
+            `TEXT NOT NULL`
+        pk (list[str]): columns of the primary key
+        fk (dict[str, dict[str, str]], optional): foreign keys as the column and
+            the referenced `table` and `key`. Defaults to {}.
+        indices (list[list[str]], optional): columns of the secondary indices.
+            Defaults to [].
+
+    """
+
+    def __init__(
+        self,
+        pool: SQLiteConnectionPool,
+        table_name: str,
+        columns: dict[str, str],
+        pk: list[str],
+        fk: dict[str, dict[str, str]] = {},
+        indices: list[list[str]] = [],
+    ) -> None:
+        self.pool = pool
+        self.table_name = table_name
+        self.columns = columns
+        self.pk = pk
+        self.fk = fk
+        self.indices = indices
+        self.json_columns = {
+            name
+            for name, definition in columns.items()
+            if definition.split()[0] == JSON_COLUMN_TYPE
+        }
+        self.initialize_table()
+
+    def get(
+        self,
+        element: int | dict[str, Any],
+        columns: list[str] | None = None,
+        order_by: str | None = None,
+        descending: bool = False,
+        limit: int | None = None,
+        offset: int = 0,
+    ) -> list[dict[str, Any]]:
+        """Get the records of the rowid or matching all columns of the dict.
+
+        Args:
+            element (int | dict[str, Any]): rowid, or values by column. A list of
+                values matches any of them.
+            columns (list[str] | None, optional): columns to get. All columns if
+                None. Defaults to None.
+            order_by (str | None, optional): column to sort the records by.
+                Unordered if None. Defaults to None.
+            descending (bool, optional): whether to sort in descending order.
+                Defaults to False.
+            limit (int | None, optional): maximum number of records. No limit if
+                None. Defaults to None.
+            offset (int, optional): number of records to skip. Defaults to 0.
+
+        Returns:
+            list[dict[str, Any]]: matching records
+        """
+        where, parameters = self._make_where(element)
+        for name in [*(columns or []), *([order_by] if order_by else [])]:
+            self._check_column(name)
+        query = (
+            f"SELECT {', '.join(columns) if columns else '*'} "
+            f"FROM {self.table_name} WHERE {where}"
+        )
+        if order_by is not None:
+            query += f" ORDER BY {order_by} {'DESC' if descending else 'ASC'}"
+        if limit is not None or offset > 0:
+            # A negative limit means no limit in SQLite.
+            query += " LIMIT ? OFFSET ?"
+            parameters = [*parameters, -1 if limit is None else limit, offset]
+        with self.pool.connection() as connection:
+            rows = connection.execute(query, parameters).fetchall()
+        return [self._decode(row) for row in rows]
+
+    def set(self, record: list[dict[str, Any]]) -> bool:
+        """Insert the records in one transaction, updating those of the same
+        primary key.
+
+        Args:
+            record (list[dict[str, Any]]): records to insert
+
+        Returns:
+            bool: True if the records are inserted
+        """
+        if not record:
+            return True
+        column_names = list(record[0])
+        placeholders = ", ".join("?" for _ in column_names)
+        # Upsert instead of `INSERT OR REPLACE`, which deletes the old record and
+        # so violates the foreign keys referencing it.
+        updates = ", ".join(
+            f"{name} = excluded.{name}" for name in column_names if name not in self.pk
+        )
+        conflict_action = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+        with self.pool.connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany(
+                f"INSERT INTO {self.table_name} "
+                f"({', '.join(column_names)}) VALUES ({placeholders}) "
+                f"ON CONFLICT ({', '.join(self.pk)}) {conflict_action}",
+                [
+                    [self._encode(name, each[name]) for name in column_names]
+                    for each in record
+                ],
+            )
+            connection.execute("COMMIT")
+        return True
+
+    def delete(self, element: int | dict[str, Any]) -> int:
+        """Delete the records of the rowid or matching all columns of the dict.
+
+        Args:
+            element (int | dict[str, Any]): rowid, or values by column. A list of
+                values matches any of them.
+
+        Returns:
+            int: number of deleted records
+        """
+        where, parameters = self._make_where(element)
+        with self.pool.connection() as connection:
+            cursor = connection.execute(
+                f"DELETE FROM {self.table_name} WHERE {where}", parameters
+            )
+        return int(cursor.rowcount)
+
+    def is_exist(self, element: int | dict[str, Any]) -> bool:
+        """Check whether a record of the rowid or matching the dict exists.
+
+        Args:
+            element (int | dict[str, Any]): rowid, or values by column
+
+        Returns:
+            bool: True if exists
+        """
+        where, parameters = self._make_where(element)
+        with self.pool.connection() as connection:
+            row = connection.execute(
+                f"SELECT 1 FROM {self.table_name} WHERE {where} LIMIT 1", parameters
+            ).fetchone()
+        return row is not None
+
+    def get_new_id(self) -> int:
+        """Get the rowid next to the largest one."""
+        with self.pool.connection() as connection:
+            row = connection.execute(
+                f"SELECT COALESCE(MAX(rowid), 0) + 1 FROM {self.table_name}"
+            ).fetchone()
+        return int(row[0])
+
+    def initialize_table(self) -> None:
+        """Create the table and its indices if they do not exist."""
+        definitions = [
+            f"{name} {definition}" for name, definition in self.columns.items()
+        ]
+        definitions.append(f"PRIMARY KEY ({', '.join(self.pk)})")
+        definitions.extend(
+            f"FOREIGN KEY ({column}) REFERENCES {reference['table']} "
+            f"({reference['key']})"
+            for column, reference in self.fk.items()
+        )
+        with self.pool.connection() as connection:
+            connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table_name} "
+                f"({', '.join(definitions)})"
+            )
+            for index_columns in self.indices:
+                connection.execute(
+                    f"CREATE INDEX IF NOT EXISTS "
+                    f"{self.table_name}_{'_'.join(index_columns)} "
+                    f"ON {self.table_name} ({', '.join(index_columns)})"
+                )
+
+    def _make_where(self, element: int | dict[str, Any]) -> tuple[str, list[Any]]:
+        """Make the WHERE clause and its parameters of the element."""
+        if isinstance(element, int):
+            return "rowid = ?", [element]
+        if not element:
+            return "1", []
+        conditions = []
+        parameters: list[Any] = []
+        for name, value in element.items():
+            self._check_column(name)
+            if isinstance(value, (list, tuple, set)):
+                values = list(value)
+                conditions.append(f"{name} IN ({', '.join('?' for _ in values)})")
+                parameters.extend(self._encode(name, each) for each in values)
+            else:
+                conditions.append(f"{name} = ?")
+                parameters.append(self._encode(name, value))
+        return " AND ".join(conditions), parameters
+
+    def _check_column(self, name: str) -> None:
+        """Raise if the name is not a column, since names are put in queries."""
+        if name not in self.columns:
+            raise KeyError(f"`{name}` is not a column of `{self.table_name}`.")
+
+    def _encode(self, name: str, value: Any) -> Any:
+        if name in self.json_columns and value is not None:
+            return json.dumps(value, ensure_ascii=False)
+        return value
+
+    def _decode(self, row: sqlite3.Row) -> dict[str, Any]:
+        return {
+            name: (
+                json.loads(row[name])
+                if name in self.json_columns and row[name] is not None
+                else row[name]
+            )
+            for name in row.keys()
+        }
@@ -0,0 +1,18 @@
+from pydantic import BaseModel, Field, SecretStr
+
+
+class CredentialsDTO(BaseModel):
+    openai_api_key: SecretStr | None = Field(
+        default=None, description="OpenAI API key for summarization and embeddings"
+    )
+    mathpix_api_key: SecretStr | None = Field(
+        default=None, description="Mathpix API key for OCR"
+    )
+    mathpix_api_id: SecretStr | None = Field(
+        default=None, description="Mathpix API ID for OCR"
+    )
+
+
+def get_secret_value(secret: SecretStr | None) -> str | None:
+    """Get the value of an optional secret."""
+    return secret.get_secret_value() if secret is not None else None
@@ -0,0 +1,24 @@
+from pydantic import BaseModel, Field
+
+
+class HTTPClientConfigDTO(BaseModel):
+    max_connections: int = Field(
+        default=100, description="Maximum number of connections of a pool", gt=0
+    )
+    max_keepalive_connections: int = Field(
+        default=20,
+        description="Maximum number of idle connections kept alive in a pool",
+        ge=0,
+    )
+    keepalive_expiry_seconds: float = Field(
+        default=30.0, description="Seconds to keep an idle connection alive", ge=0
+    )
+    connect_timeout_seconds: float = Field(
+        default=10.0, description="Timeout of establishing a connection", gt=0
+    )
+    timeout_seconds: float = Field(
+        default=60.0, description="Timeout of reading, writing and pooling", gt=0
+    )
+    http2: bool = Field(
+        default=True, description="Whether to use HTTP/2 if the `h2` is installed"
+    )
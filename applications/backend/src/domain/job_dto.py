@@ -0,0 +1,38 @@
+import datetime
+from typing import Literal
+
+from pydantic import BaseModel, Field
+
+from src.domain.paper_format_dto import SummaryResultDTO
+
+
+class PaperProgressDTO(BaseModel):
+    filename: str = Field(description="Filename of the uploaded paper")
+    status: Literal["pending", "running", "succeeded", "failed"] = Field(
+        default="pending", description="Status of the paper"
+    )
+    stage: str | None = Field(
+        default=None, description="Current stage of the paper if it is running"
+    )
+    error: str | None = Field(
+        default=None, description="Error message if the summarization failed"
+    )
+
+
+class JobDTO(BaseModel):
+    job_id: str = Field(description="ID of the job")
+    status: Literal["pending", "running", "completed"] = Field(
+        default="pending", description="Status of the job"
+    )
+    created_at: datetime.datetime = Field(description="Time the job was submitted")
+    finished_at: datetime.datetime | None = Field(
+        default=None, description="Time all papers of the job were processed"
+    )
+    papers: list[PaperProgressDTO] = Field(description="Progress of each paper")
+
+
+class JobResultDTO(BaseModel):
+    job_id: str = Field(description="ID of the job")
+    results: list[SummaryResultDTO] = Field(
+        description="Summary results in the same order as the uploaded papers"
+    )
@@ -9,6 +9,20 @@ class SummaryConfigDTO(BaseModel):
     temperature: float = Field(description="Temperature for sampling")
     chunk_size: int = Field(description="Chunk size for summarization")
     chunk_overlap: int = Field(description="Chunk overlap for summarization")
+    context_token_budget: int = Field(
+        default=1200,
+        description="Maximum number of tokens of the retrieved context of each prompt",
+    )
+    embedding_backend: Literal["openai", "hashing"] = Field(
+        default="openai", description="Backend to embed chunks and queries"
+    )
+    cache_completions: bool | None = Field(
+        default=None,
+        description=(
+            "Whether to reuse the completions of identical prompts. Only if the "
+            "temperature is 0 by default. If False, a summary is sampled again."
+        ),
+    )
 
 
 class FormatOchiaiDTO(BaseModel):
@@ -32,3 +46,13 @@ FORMAT_MAPPING: dict[str, type[SummaryFormat]] = {
     "ochiai": FormatOchiaiDTO,
     "cvpaper": FormatCVPaperDTO,
 }
+
+
+class SummaryResultDTO(BaseModel):
+    filename: str = Field(description="Filename of the uploaded paper")
+    summary: SummaryFormat | None = Field(
+        default=None, description="Summary of the paper if it succeeded"
+    )
+    error: str | None = Field(
+        default=None, description="Error message if the summarization failed"
+    )
@@ -5,6 +5,9 @@ class SubsectionDTO(BaseModel):
     subsection_id: int = Field(description="ID of the subsection")
     subsection_title: str = Field(description="Title of the subsection")
     subsection_text: str = Field(description="Text of the subsection")
+    subsection_list: list["SubsectionDTO"] = Field(
+        default_factory=list, description="List of nested subsections"
+    )
 
 
 class SectionDTO(BaseModel):
@@ -12,6 +15,9 @@ class SectionDTO(BaseModel):
     section_title: str = Field(description="Title of the section")
     section_text: str = Field(description="Text of the section")
     subsection_list: list[SubsectionDTO] = Field(description="List of subsections")
+    is_appendix: bool = Field(
+        default=False, description="Whether the section is in the appendices"
+    )
 
 
 class ParsedPaperDTO(BaseModel):
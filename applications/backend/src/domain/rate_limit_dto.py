@@ -0,0 +1,10 @@
+from pydantic import BaseModel, Field
+
+
+class RateLimitDTO(BaseModel):
+    requests_per_minute: float = Field(
+        description="Maximum number of requests per minute", gt=0
+    )
+    tokens_per_minute: float = Field(
+        description="Maximum number of tokens per minute", gt=0
+    )
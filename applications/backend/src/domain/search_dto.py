@@ -0,0 +1,10 @@
+from pydantic import BaseModel, Field
+
+
+class ChunkSearchResultDTO(BaseModel):
+    paper_id: str = Field(description="ID of the paper which contains the chunk")
+    section: str | None = Field(
+        default=None, description="Section of the paper which contains the chunk"
+    )
+    text: str = Field(description="Text of the chunk")
+    distance: float = Field(description="L2 distance between the chunk and the query")
@@ -0,0 +1,29 @@
+from typing import Literal
+
+from pydantic import BaseModel, Field
+
+from src.domain.paper_format_dto import SummaryResultDTO
+
+
+class SummaryEventDTO(BaseModel):
+    event: Literal["stage", "field", "token", "result"] = Field(
+        description="Kind of the event"
+    )
+    index: int = Field(description="Index of the paper in the uploaded papers")
+    filename: str = Field(description="Filename of the uploaded paper")
+    stage: str | None = Field(
+        default=None, description="Stage the paper entered, for `stage` events"
+    )
+    field: str | None = Field(
+        default=None, description="Field of the summary, for `field` events"
+    )
+    chain: str | None = Field(
+        default=None, description="LLM chain generating the text, for `token` events"
+    )
+    text: str | None = Field(
+        default=None,
+        description="Text of the field for `field` events, or a generated token for `token` events",
+    )
+    result: SummaryResultDTO | None = Field(
+        default=None, description="Summary result of the paper, for `result` events"
+    )
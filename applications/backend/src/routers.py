@@ -1,38 +1,146 @@
+import functools
 import os
 import pathlib
-from typing import Annotated, Final, Literal
+from typing import TYPE_CHECKING, Annotated, AsyncIterator, Final, Literal
 
 import fastapi
-from fastapi import File, Form, UploadFile
-from fastapi.responses import ORJSONResponse
+from fastapi import Depends, File, Form, Header, HTTPException, UploadFile, status
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import SecretStr
 
-from src.adapter.summary_controller import SummaryController
-from src.db.dummy_sql import DummySQL
+from src.adapter.job_controller import JobNotFinishedError, JobNotFoundError
+from src.db.sqlite_rdb import SQLiteConnectionPool, SQLiteRDB
+from src.domain.credentials_dto import CredentialsDTO
 from src.domain.endpoint_dto import Health
+from src.domain.job_dto import JobDTO, JobResultDTO
 from src.domain.paper_format_dto import SummaryConfigDTO, SummaryFormat
+from src.domain.search_dto import ChunkSearchResultDTO
+from src.domain.summary_event_dto import SummaryEventDTO
+from src.usecase.metrics import REGISTRY
+from src.usecase.paper_io_handler import PdfTooLargeError
+
+if TYPE_CHECKING:
+    from src.adapter.job_controller import JobController
+    from src.adapter.search_controller import SearchController
+    from src.adapter.summary_controller import SummaryController
 
 router: Final = fastapi.APIRouter(default_response_class=ORJSONResponse)
 
+# The charset is appended by the response.
+PROMETHEUS_CONTENT_TYPE: Final = "text/plain; version=0.0.4"
+NDJSON_CONTENT_TYPE: Final = "application/x-ndjson"
+SSE_CONTENT_TYPE: Final = "text/event-stream"
 
-@router.get("/health", response_model=Health)
-async def health() -> dict[str, str]:
-    """Endpoint for health check.
 
-    Returns:
+def get_static_files_storage_root() -> pathlib.Path:
+    """Get the root directory to store files shared by the workers."""
+    return pathlib.Path(os.environ.get("BACKEND_STORAGE_ROOT", "./data/papers/"))
 
-    - ORJSONResponse: A response from endpoint.
 
+@functools.lru_cache(maxsize=None)
+def get_connection_pool() -> SQLiteConnectionPool:
+    """Get the pool of connections to the database shared by the workers."""
+    return SQLiteConnectionPool(get_static_files_storage_root() / "papers.sqlite3")
 
-    """
-    return {"health": "ok"}
 
+# Controllers import langchain, FAISS, tiktoken and the OpenAI SDK, which take
+# seconds to import. They are created on first use, or by the warmup at worker
+# start, so that importing this module and serving `/health` stay cheap.
+@functools.lru_cache(maxsize=None)
+def get_summary_controller() -> "SummaryController":
+    """Get the controller for summarizing papers, creating it on first use."""
+    from src.adapter.summary_controller import SummaryController
 
-@router.post("/papers/summarize")
-async def summarize(
-    pdf_files: Annotated[
-        list[UploadFile], File(description="Multiple files as UploadFile")
-    ],
+    pool = get_connection_pool()
+    return SummaryController(
+        # Papers are identified by the hash of their content.
+        paper_repository=SQLiteRDB(
+            pool,
+            table_name="paper",
+            columns={
+                "paper_id": "TEXT NOT NULL",
+                "filename": "TEXT",
+                "pdf_path": "TEXT NOT NULL",
+                "parser_key": "TEXT NOT NULL",
+                "parsed_paper": "JSON NOT NULL",
+                "created_at": "REAL NOT NULL",
+            },
+            pk=["paper_id"],
+        ),
+        summary_repository=SQLiteRDB(
+            pool,
+            table_name="summary",
+            columns={
+                "summary_id": "TEXT NOT NULL",
+                "paper_id": "TEXT NOT NULL",
+                "config_hash": "TEXT NOT NULL",
+                "summary_type": "TEXT NOT NULL",
+                "summary": "JSON NOT NULL",
+                "created_at": "REAL NOT NULL",
+            },
+            pk=["summary_id"],
+            fk={"paper_id": {"table": "paper", "key": "paper_id"}},
+            indices=[["paper_id"], ["config_hash"]],
+        ),
+        static_files_storage_root=get_static_files_storage_root(),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_job_controller() -> "JobController":
+    """Get the controller for summarization jobs, creating it on first use."""
+    from src.adapter.job_controller import JobController
+
+    pool = get_connection_pool()
+    return JobController(
+        summary_controller=get_summary_controller(),
+        job_repository=SQLiteRDB(
+            pool,
+            table_name="job",
+            columns={
+                "job_id": "TEXT NOT NULL",
+                "status": "TEXT NOT NULL",
+                "created_at": "REAL NOT NULL",
+                "finished_at": "REAL",
+            },
+            pk=["job_id"],
+            # Finished jobs are discarded in the order of the finish time.
+            indices=[["status", "finished_at"]],
+        ),
+        # Credentials of jobs are never stored.
+        job_paper_repository=SQLiteRDB(
+            pool,
+            table_name="job_paper",
+            columns={
+                "job_id": "TEXT NOT NULL",
+                "paper_index": "INTEGER NOT NULL",
+                "filename": "TEXT NOT NULL",
+                "status": "TEXT NOT NULL",
+                "stage": "TEXT",
+                "error": "TEXT",
+                "result": "JSON",
+                "worker_id": "TEXT NOT NULL",
+            },
+            pk=["job_id", "paper_index"],
+            fk={"job_id": {"table": "job", "key": "job_id"}},
+        ),
+        lock_dir=get_static_files_storage_root() / "locks",
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_search_controller() -> "SearchController":
+    """Get the controller for searching chunks, creating it on first use."""
+    from src.adapter.search_controller import SearchController
+
+    summary_controller = get_summary_controller()
+    return SearchController(
+        corpus_indices=summary_controller.corpus_indices,
+        rate_limiter=summary_controller.rate_limiter,
+    )
+
+
+def get_credentials(
     openai_api_key: Annotated[
         SecretStr, Form(description="Specify the OpenAI API key for sumamrization")
     ],
@@ -42,6 +150,30 @@ async def summarize(
     mathpix_api_id: Annotated[
         SecretStr, Form(description="Specify the Mathpix API ID for OCR")
     ],
+) -> CredentialsDTO:
+    """Get the credentials of the request from the form.
+
+    Credentials are passed along with the request instead of being set to the
+    environment variables, which are shared by concurrent requests.
+    """
+    return CredentialsDTO(
+        openai_api_key=openai_api_key,
+        mathpix_api_key=mathpix_api_key,
+        mathpix_api_id=mathpix_api_id,
+    )
+
+
+def get_openai_credentials(
+    openai_api_key: Annotated[
+        SecretStr | None,
+        Form(description="Specify the OpenAI API key for the OpenAI embeddings"),
+    ] = None,
+) -> CredentialsDTO:
+    """Get the OpenAI credentials of the request from the form."""
+    return CredentialsDTO(openai_api_key=openai_api_key)
+
+
+def get_summary_config(
     summary_type: Annotated[
         Literal["ochiai", "cvpaper"], Form(description="Choose the summary type")
     ] = "ochiai",
@@ -58,6 +190,119 @@ async def summarize(
     chunk_overlap: Annotated[
         int, Form(description="Specify the chunk overlap for summarization")
     ] = 40,
+    context_token_budget: Annotated[
+        int,
+        Form(
+            description="Specify the maximum number of tokens of the retrieved context of each prompt",
+            ge=1,
+        ),
+    ] = 1200,
+    embedding_backend: Annotated[
+        Literal["openai", "hashing"],
+        Form(
+            description="Choose the backend to embed chunks. `hashing` runs locally without the API."
+        ),
+    ] = "openai",
+    cache_completions: Annotated[
+        bool | None,
+        Form(
+            description="Specify whether to reuse the completions of identical prompts. Only if the temperature is 0 by default. Disable it to sample a new summary."
+        ),
+    ] = None,
+) -> SummaryConfigDTO:
+    """Build summary config from the form."""
+    return SummaryConfigDTO(
+        summary_type=summary_type,
+        llm_model_name=llm_model_name,
+        temperature=temperature,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        context_token_budget=context_token_budget,
+        embedding_backend=embedding_backend,
+        cache_completions=cache_completions,
+    )
+
+
+async def save_pdf_files(pdf_files: list[UploadFile]) -> list[tuple[str, pathlib.Path]]:
+    """Save the uploaded pdf files before the response is returned.
+
+    Uploaded files are closed when the endpoint returns, so papers processed after
+    the response, by a job or a stream, have to be saved beforehand.
+
+    Args:
+        pdf_files (list[UploadFile]): The uploaded pdf files.
+
+    Returns:
+        list[tuple[str, pathlib.Path]]: The filenames and the paths of the saved
+            pdf files.
+    """
+    summary_controller = get_summary_controller()
+    try:
+        return [
+            (str(pdf_file.filename), await summary_controller.save_pdf(pdf_file))
+            for pdf_file in pdf_files
+        ]
+    except PdfTooLargeError as e:
+        raise HTTPException(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+
+
+async def encode_events(
+    events: AsyncIterator[SummaryEventDTO], media_type: str
+) -> AsyncIterator[str]:
+    """Encode the summary events as NDJSON or server-sent events.
+
+    Args:
+        events (AsyncIterator[SummaryEventDTO]): The events to encode.
+        media_type (str): `NDJSON_CONTENT_TYPE` or `SSE_CONTENT_TYPE`.
+
+    Yields:
+        str: The encoded events.
+    """
+    async for event in events:
+        data = event.json(exclude_none=True)
+        if media_type == SSE_CONTENT_TYPE:
+            yield f"event: {event.event}\ndata: {data}\n\n"
+        else:
+            yield f"{data}\n"
+
+
+@router.get("/health", response_model=Health)
+async def health() -> dict[str, str]:
+    """Endpoint for health check.
+
+    Returns:
+
+    - ORJSONResponse: A response from endpoint.
+
+
+    """
+    return {"health": "ok"}
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    """Endpoint for metrics of the summarization pipeline.
+
+    Metrics are kept by each worker process, and include latency histograms and
+    error counts of each stage, latencies and token counts of each LLM chain, and
+    hits and misses of each cache.
+
+    Returns:
+
+    - PlainTextResponse: Metrics in the Prometheus text format.
+
+
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@router.post("/papers/summarize")
+async def summarize(
+    pdf_files: Annotated[
+        list[UploadFile], File(description="Multiple files as UploadFile")
+    ],
+    summary_config: Annotated[SummaryConfigDTO, Depends(get_summary_config)],
+    credentials: Annotated[CredentialsDTO, Depends(get_credentials)],
 ) -> list[SummaryFormat]:
     """Endpoint for summarization.
 
@@ -72,29 +317,197 @@ async def summarize(
     - temperature (float, optional): Specify the temperature for sampling. Defaults to 0.9.
     - chunk_size (int, optional): Specify the chunk size for summarization. Defaults to 200.
     - chunk_overlap (int, optional): Specify the chunk overlap for summarization. Defaults to 40.
+    - context_token_budget (int, optional): Specify the maximum number of tokens of the retrieved context of each prompt. Defaults to 1200.
+    - embedding_backend (Literal["openai", "hashing"], optional): Choose the backend to embed chunks. `hashing` runs locally without the API. Defaults to "openai".
+    - cache_completions (bool | None, optional): Specify whether to reuse the completions of identical prompts. Only if the temperature is 0 by default. Disable it to sample a new summary. Defaults to None.
 
     Returns:
 
-    - ORJSONResponse: A list of summary format in a JSON format.
+    - ORJSONResponse: A list of summary format in a JSON format. Fails with 502
+      and the error of each failed paper in `detail` if any of the papers fails.
+      Use `/papers/summarize/jobs` or `/papers/summarize/stream` to get the
+      summaries of the other papers as well.
 
 
     """
-    os.environ["OPENAI_API_KEY"] = openai_api_key.get_secret_value()
-    os.environ["MATHPIX_API_KEY"] = mathpix_api_key.get_secret_value()
-    os.environ["MATHPIX_API_ID"] = mathpix_api_id.get_secret_value()
-    summary_config = SummaryConfigDTO(
-        summary_type=summary_type,
-        llm_model_name=llm_model_name,
-        temperature=temperature,
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
+    summary_controller = get_summary_controller()
+    # The controller module is imported on first use.
+    from src.adapter.summary_controller import PaperSummarizationError
+
+    try:
+        return await summary_controller.summarize(
+            pdf_files, summary_config, credentials
+        )
+    except PaperSummarizationError as e:
+        # Papers fail by the errors of the OCR or LLM APIs.
+        raise HTTPException(status.HTTP_502_BAD_GATEWAY, detail=str(e))
+
+
+@router.post(
+    "/papers/summarize/stream",
+    response_class=StreamingResponse,
+)
+async def summarize_stream(
+    pdf_files: Annotated[
+        list[UploadFile], File(description="Multiple files as UploadFile")
+    ],
+    summary_config: Annotated[SummaryConfigDTO, Depends(get_summary_config)],
+    credentials: Annotated[CredentialsDTO, Depends(get_credentials)],
+    stream_tokens: Annotated[
+        bool,
+        Form(description="Specify whether to stream each token generated by the LLM"),
+    ] = False,
+    accept: Annotated[str | None, Header()] = None,
+) -> StreamingResponse:
+    """Endpoint for summarization streaming the progress and the results.
+
+    Each event is a JSON object with `event`, `index` and `filename` of the paper:
+
+    - `stage`: The paper entered the `stage`.
+    - `field`: The `field` of the summary was generated with the `text`.
+    - `token`: The LLM `chain` generated the `text`. Only if `stream_tokens`.
+    - `result`: The paper was processed with the `result`, which has either a
+      summary or an error message. Results arrive in the order of completion.
+
+    Events are sent as server-sent events if the `Accept` header includes
+    `text/event-stream`, and as newline-delimited JSON otherwise. Other arguments
+    are the same as `/papers/summarize`.
+
+    Args:
+
+    - stream_tokens (bool, optional): Specify whether to stream each token generated by the LLM. Defaults to False.
+
+    Returns:
+
+    - StreamingResponse: A stream of the events of the papers.
+
+
+    """
+    saved_pdf_files = await save_pdf_files(pdf_files)
+    media_type = (
+        SSE_CONTENT_TYPE
+        if accept is not None and SSE_CONTENT_TYPE in accept
+        else NDJSON_CONTENT_TYPE
+    )
+    events = get_summary_controller().astream_summaries(
+        saved_pdf_files, summary_config, credentials, stream_tokens=stream_tokens
+    )
+    return StreamingResponse(
+        encode_events(events, media_type),
+        media_type=media_type,
+        # Proxies must not buffer the events.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post(
+    "/papers/summarize/jobs",
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def submit_summarize_job(
+    pdf_files: Annotated[
+        list[UploadFile], File(description="Multiple files as UploadFile")
+    ],
+    summary_config: Annotated[SummaryConfigDTO, Depends(get_summary_config)],
+    credentials: Annotated[CredentialsDTO, Depends(get_credentials)],
+) -> JobDTO:
+    """Endpoint for submitting a summarization job.
+
+    The papers are saved and queued, and the response returns immediately. Use
+    `/jobs/{job_id}` to check the progress and `/jobs/{job_id}/result` to get the
+    result. Arguments are the same as `/papers/summarize`.
+
+    Returns:
+
+    - ORJSONResponse: The submitted job in a JSON format.
+
+
+    """
+    saved_pdf_files = await save_pdf_files(pdf_files)
+    return await get_job_controller().submit(
+        saved_pdf_files, summary_config, credentials
+    )
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str) -> JobDTO:
+    """Endpoint for checking the progress of a summarization job.
+
+    Args:
+
+    - job_id (str): The ID of the job.
+
+    Returns:
+
+    - ORJSONResponse: The job with the progress of each paper in a JSON format.
+
+
+    """
+    try:
+        return await get_job_controller().get_job(job_id)
+    except JobNotFoundError:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Job not found.")
+
+
+@router.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str) -> JobResultDTO:
+    """Endpoint for getting the result of a summarization job.
+
+    Args:
+
+    - job_id (str): The ID of the job.
+
+    Returns:
+
+    - ORJSONResponse: A list of summary results in a JSON format. Returns 409 if
+      the job is not completed yet.
+
+
+    """
+    try:
+        return await get_job_controller().get_result(job_id)
+    except JobNotFoundError:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Job not found.")
+    except JobNotFinishedError:
+        raise HTTPException(status.HTTP_409_CONFLICT, detail="Job is not completed.")
+
+
+@router.post("/papers/search")
+async def search_papers(
+    query: Annotated[str, Form(description="Specify the query text")],
+    credentials: Annotated[CredentialsDTO, Depends(get_openai_credentials)],
+    k: Annotated[
+        int, Form(description="Specify the number of chunks to return", ge=1, le=100)
+    ] = 10,
+    paper_id: Annotated[
+        str | None,
+        Form(description="Specify the ID of the paper to search in"),
+    ] = None,
+    embedding_backend: Annotated[
+        Literal["openai", "hashing"],
+        Form(description="Choose the embedding backend of the papers to search"),
+    ] = "openai",
+) -> list[ChunkSearchResultDTO]:
+    """Endpoint for searching chunks of the summarized papers.
+
+    Args:
+
+    - query (str): Specify the query text
+    - openai_api_key (SecretStr, optional): Specify the OpenAI API key for the OpenAI embeddings
+    - k (int, optional): Specify the number of chunks to return. Defaults to 10.
+    - paper_id (str | None, optional): Specify the ID of the paper to search in. Search all papers if not given.
+    - embedding_backend (Literal["openai", "hashing"], optional): Choose the embedding backend of the papers to search. Defaults to "openai".
+
+    Returns:
+
+    - ORJSONResponse: A list of chunks with their paper IDs in the order of relevance.
+
+
+    """
+    return await get_search_controller().search(
+        query,
+        k=k,
+        paper_id=paper_id,
+        embedding_backend=embedding_backend,
+        credentials=credentials,
     )
-    return SummaryController(
-        paper_repository=DummySQL(table_name="paper", pk=["paper_id"], fk={}),
-        summary_repository=DummySQL(
-            table_name="summary",
-            pk=["summary_id"],
-            fk={"paper_id": {"table": "paper", "key": "paper_id"}},
-        ),
-        static_files_storage_root=pathlib.Path("./data/papers/"),
-    ).summarize(pdf_files, summary_config)
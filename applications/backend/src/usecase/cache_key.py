@@ -0,0 +1,19 @@
+import hashlib
+import json
+from typing import Any, Final
+
+CACHE_KEY_LENGTH: Final = 16
+
+
+def make_cache_key(*parts: Any) -> str:
+    """Make a cache key from the values which affect an artifact.
+
+    Args:
+        *parts (Any): JSON serializable values, e.g. upstream cache keys and config
+            fields of the stage.
+
+    Returns:
+        str: hex digest of the values
+    """
+    serialized: Final = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()[:CACHE_KEY_LENGTH]
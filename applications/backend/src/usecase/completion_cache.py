@@ -0,0 +1,260 @@
+import contextlib
+import contextvars
+import hashlib
+import json
+import logging
+import pathlib
+import sqlite3
+import threading
+import time
+from typing import Final, Iterator, Optional
+
+import langchain
+from langchain.cache import RETURN_VAL_TYPE, BaseCache
+from langchain.load.dump import dumps
+from langchain.load.load import loads
+
+from src.usecase.metrics import count_cache_lookups
+
+logger: Final = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+DEFAULT_MAX_ENTRIES: Final = 100_000
+DEFAULT_TTL_SECONDS: Final = 30 * 24 * 60 * 60
+
+# Cache of the LLM calls made in the current context, e.g. the chains of a
+# summarizer.
+_current_completion_cache: Final[
+    contextvars.ContextVar[Optional["CompletionCache"]]
+] = contextvars.ContextVar("current_completion_cache", default=None)
+
+
+class CompletionCache(BaseCache):
+    """Disk-backed cache of LLM completions.
+
+    Entries are keyed by the hash of the model parameters, which include the model
+    name and the temperature, and the rendered prompt. They are stored in SQLite,
+    so retries and repeated papers reuse completions across processes and
+    restarts. Entries older than `ttl_seconds` are ignored, and the least recently
+    used ones are evicted when the number of entries exceeds `max_entries`.
+
+    NOTE: langchain only consults the global `langchain.llm_cache`, so a
+    `ScopedCompletionCache` is installed there, which delegates to the cache of
+    the current context only. Use the cache in a context by
+    `use_completion_cache`, so other LLM calls of the process are not cached.
+
+    Args:
+        cache_path (pathlib.Path): path to the SQLite database
+        max_entries (int, optional): maximum number of entries.
+            Defaults to 100,000.
+        ttl_seconds (float | None, optional): lifetime of an entry in seconds.
+            Entries never expire if None. Defaults to 30 days.
+
+    """
+
+    def __init__(
+        self,
+        cache_path: pathlib.Path,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl_seconds: float | None = DEFAULT_TTL_SECONDS,
+    ) -> None:
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(
+            str(cache_path), check_same_thread=False, isolation_level=None
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, generations TEXT NOT NULL, "
+            "created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS completions_last_used "
+            "ON completions (last_used)"
+        )
+        self._initialize_entry_count()
+        install_scoped_completion_cache()
+
+    def _initialize_entry_count(self) -> None:
+        """Keep the number of entries in a row updated by triggers.
+
+        Inserting then reads the number instead of counting the whole table. The
+        number is counted once if the table was created by an older version.
+        """
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS completions_count ("
+                "id INTEGER PRIMARY KEY CHECK (id = 0), num_entries INTEGER NOT NULL)"
+            )
+            if (
+                self.connection.execute("SELECT 1 FROM completions_count").fetchone()
+                is None
+            ):
+                self.connection.execute(
+                    "INSERT INTO completions_count (id, num_entries) "
+                    "SELECT 0, COUNT(*) FROM completions"
+                )
+            self.connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS completions_insert AFTER INSERT ON "
+                "completions BEGIN "
+                "UPDATE completions_count SET num_entries = num_entries + 1; END"
+            )
+            self.connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS completions_delete AFTER DELETE ON "
+                "completions BEGIN "
+                "UPDATE completions_count SET num_entries = num_entries - 1; END"
+            )
+            self.connection.execute("COMMIT")
+
+    @staticmethod
+    def make_key(prompt: str, llm_string: str) -> str:
+        """Make a cache key of the prompt sent to the model.
+
+        Args:
+            prompt (str): serialized prompt
+            llm_string (str): serialized model parameters
+
+        Returns:
+            str: cache key
+        """
+        return hashlib.sha256(f"{llm_string}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        """Look up the completion of the prompt.
+
+        Args:
+            prompt (str): serialized prompt
+            llm_string (str): serialized model parameters
+
+        Returns:
+            Optional[RETURN_VAL_TYPE]: cached generations if found and not expired
+        """
+        key = self.make_key(prompt, llm_string)
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT generations, created_at FROM completions WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is not None and (
+                self.ttl_seconds is not None and now - row[1] > self.ttl_seconds
+            ):
+                self.connection.execute("DELETE FROM completions WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                count_cache_lookups("completion", hits=0, misses=1)
+                return None
+            self.connection.execute(
+                "UPDATE completions SET last_used = ? WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+
+        count_cache_lookups("completion", hits=1, misses=0)
+        logger.info(f"Completion cache hit (hit rate {self.hit_rate:.1%} since start).")
+        return [loads(generation) for generation in json.loads(row[0])]
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        """Store the completion of the prompt and evict the least recently used
+        entries.
+
+        Args:
+            prompt (str): serialized prompt
+            llm_string (str): serialized model parameters
+            return_val (RETURN_VAL_TYPE): generations of the model
+        """
+        key = self.make_key(prompt, llm_string)
+        generations = json.dumps([dumps(generation) for generation in return_val])
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN")
+            # Upsert instead of `INSERT OR REPLACE`, whose implicit delete does not
+            # fire the trigger which counts entries.
+            self.connection.execute(
+                "INSERT INTO completions "
+                "(key, generations, created_at, last_used) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET generations = excluded.generations, "
+                "created_at = excluded.created_at, last_used = excluded.last_used",
+                (key, generations, now, now),
+            )
+            (num_entries,) = self.connection.execute(
+                "SELECT num_entries FROM completions_count"
+            ).fetchone()
+            if num_entries > self.max_entries:
+                self.connection.execute(
+                    "DELETE FROM completions WHERE key IN ("
+                    "SELECT key FROM completions ORDER BY last_used LIMIT ?)",
+                    (num_entries - self.max_entries,),
+                )
+            self.connection.execute("COMMIT")
+
+    def clear(self, **kwargs: object) -> None:
+        """Remove all entries."""
+        with self.lock:
+            self.connection.execute("DELETE FROM completions")
+
+    @property
+    def hit_rate(self) -> float:
+        """Ratio of hits to lookups since the process started."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class ScopedCompletionCache(BaseCache):
+    """Global cache of langchain which delegates to the cache of the context.
+
+    LLM calls outside `use_completion_cache` are passed to the global cache
+    installed before, if any, as if this were not installed.
+
+    Args:
+        fallback (BaseCache | None, optional): cache used outside the contexts.
+            Defaults to None.
+
+    """
+
+    def __init__(self, fallback: BaseCache | None = None) -> None:
+        self.fallback = fallback
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        """Look up the completion in the cache of the context."""
+        cache = _current_completion_cache.get() or self.fallback
+        return cache.lookup(prompt, llm_string) if cache is not None else None
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        """Store the completion in the cache of the context."""
+        cache = _current_completion_cache.get() or self.fallback
+        if cache is not None:
+            cache.update(prompt, llm_string, return_val)
+
+    def clear(self, **kwargs: object) -> None:
+        """Remove all entries of the fallback cache."""
+        if self.fallback is not None:
+            self.fallback.clear(**kwargs)
+
+
+def install_scoped_completion_cache() -> None:
+    """Install `ScopedCompletionCache` as the global cache of langchain once."""
+    if not isinstance(langchain.llm_cache, ScopedCompletionCache):
+        langchain.llm_cache = ScopedCompletionCache(fallback=langchain.llm_cache)
+
+
+@contextlib.contextmanager
+def use_completion_cache(cache: CompletionCache | None) -> Iterator[None]:
+    """Cache the LLM calls made in the context, including the tasks and the
+    threads started in it.
+
+    Args:
+        cache (CompletionCache | None): cache to use. Not cached if None.
+    """
+    token = _current_completion_cache.set(cache)
+    try:
+        yield
+    finally:
+        _current_completion_cache.reset(token)
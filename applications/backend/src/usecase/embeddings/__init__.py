@@ -0,0 +1,5 @@
+# flake8: noqa
+from .backends import EMBEDDING_BACKENDS, LOCAL_EMBEDDING_BACKENDS, build_embeddings
+from .cached_embeddings import CachedEmbeddings, EmbeddingCache
+from .hashing_embeddings import HashingEmbeddings
+from .query_embedding_cache import QueryEmbeddingCache
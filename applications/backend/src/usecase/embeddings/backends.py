@@ -0,0 +1,47 @@
+from typing import Callable, Final
+
+from langchain.embeddings.base import Embeddings
+from langchain.embeddings.openai import OpenAIEmbeddings
+
+from src.usecase.embeddings.hashing_embeddings import HashingEmbeddings
+from src.usecase.http_clients import apply_pooled_session
+from src.usecase.rate_limiter import OpenAIRateLimiter, apply_rate_limiter
+
+EMBEDDING_BACKENDS: Final[dict[str, Callable[[], Embeddings]]] = {
+    "openai": OpenAIEmbeddings,  # type: ignore
+    "hashing": HashingEmbeddings,
+}
+# Backends computed locally, whose embeddings are cheaper to recompute than to
+# look up in the disk cache.
+LOCAL_EMBEDDING_BACKENDS: Final = {"hashing"}
+
+
+def build_embeddings(
+    backend: str,
+    rate_limiter: OpenAIRateLimiter | None = None,
+    openai_api_key: str | None = None,
+) -> tuple[Embeddings, str]:
+    """Build the embedding model of the backend.
+
+    Args:
+        backend (str): name of the backend in `EMBEDDING_BACKENDS`
+        rate_limiter (OpenAIRateLimiter | None, optional): rate limiter of the
+            calls to OpenAI. Defaults to None.
+        openai_api_key (str | None, optional): OpenAI API key of the OpenAI
+            embeddings. The environment variable `OPENAI_API_KEY` is used if
+            None. Defaults to None.
+
+    Returns:
+        tuple[Embeddings, str]: the embedding model and its name used in cache keys
+    """
+    if backend == "openai" and openai_api_key is not None:
+        embeddings: Embeddings = OpenAIEmbeddings(
+            openai_api_key=openai_api_key
+        )  # type: ignore
+    else:
+        embeddings = EMBEDDING_BACKENDS[backend]()
+    if isinstance(embeddings, OpenAIEmbeddings):
+        apply_pooled_session(embeddings)
+        if rate_limiter is not None:
+            apply_rate_limiter(embeddings, rate_limiter)
+    return embeddings, str(getattr(embeddings, "model"))
@@ -0,0 +1,232 @@
+import hashlib
+import logging
+import pathlib
+import sqlite3
+import threading
+import time
+from typing import Final
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from src.usecase.metrics import count_cache_lookups
+
+logger: Final = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# SQLite limits the number of host parameters of a statement.
+LOOKUP_BATCH_SIZE: Final = 500
+DEFAULT_MAX_ENTRIES: Final = 200_000
+
+
+class EmbeddingCache:
+    """Disk-backed cache of embeddings keyed by the model and the text hash.
+
+    Entries are stored in SQLite, so the cache is shared across processes and
+    survives restarts. When the number of entries exceeds `max_entries`, the least
+    recently used ones are evicted.
+
+    Args:
+        cache_path (pathlib.Path): path to the SQLite database
+        max_entries (int, optional): maximum number of entries.
+            Defaults to 200,000.
+
+    """
+
+    def __init__(
+        self, cache_path: pathlib.Path, max_entries: int = DEFAULT_MAX_ENTRIES
+    ) -> None:
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(
+            str(cache_path), check_same_thread=False, isolation_level=None
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+        self._initialize_entry_count()
+
+    def _initialize_entry_count(self) -> None:
+        """Keep the number of entries in a row updated by triggers.
+
+        Inserting then reads the number instead of counting the whole table. The
+        number is counted once if the table was created by an older version.
+        """
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings_count ("
+                "id INTEGER PRIMARY KEY CHECK (id = 0), num_entries INTEGER NOT NULL)"
+            )
+            if (
+                self.connection.execute("SELECT 1 FROM embeddings_count").fetchone()
+                is None
+            ):
+                self.connection.execute(
+                    "INSERT INTO embeddings_count (id, num_entries) "
+                    "SELECT 0, COUNT(*) FROM embeddings"
+                )
+            self.connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS embeddings_insert AFTER INSERT ON "
+                "embeddings BEGIN "
+                "UPDATE embeddings_count SET num_entries = num_entries + 1; END"
+            )
+            self.connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS embeddings_delete AFTER DELETE ON "
+                "embeddings BEGIN "
+                "UPDATE embeddings_count SET num_entries = num_entries - 1; END"
+            )
+            self.connection.execute("COMMIT")
+
+    @staticmethod
+    def make_key(model_name: str, text: str) -> str:
+        """Make a cache key of the text embedded by the model.
+
+        Args:
+            model_name (str): name of the embedding model
+            text (str): text to embed
+
+        Returns:
+            str: cache key
+        """
+        return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        """Look up embeddings of the keys in batches.
+
+        Args:
+            keys (list[str]): cache keys
+
+        Returns:
+            dict[str, list[float]]: embeddings of the found keys
+        """
+        found: dict[str, list[float]] = dict()
+        with self.lock:
+            for i in range(0, len(keys), LOOKUP_BATCH_SIZE):
+                batch = keys[i : i + LOOKUP_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32).tolist()
+                if rows:
+                    self.connection.execute(
+                        "UPDATE embeddings SET last_used = ? WHERE key IN "
+                        f"({','.join('?' * len(rows))})",
+                        [time.time(), *[key for key, _ in rows]],
+                    )
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+        count_cache_lookups(
+            "embedding", hits=len(found), misses=len(set(keys)) - len(found)
+        )
+        return found
+
+    def set_many(self, items: dict[str, list[float]]) -> None:
+        """Store embeddings and evict the least recently used entries.
+
+        Args:
+            items (dict[str, list[float]]): embeddings by cache key
+        """
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN")
+            # Upsert instead of `INSERT OR REPLACE`, whose implicit delete does not
+            # fire the trigger which counts entries.
+            self.connection.executemany(
+                "INSERT INTO embeddings (key, vector, last_used) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET "
+                "vector = excluded.vector, last_used = excluded.last_used",
+                [
+                    (key, np.asarray(vector, dtype=np.float32).tobytes(), now)
+                    for key, vector in items.items()
+                ],
+            )
+            (num_entries,) = self.connection.execute(
+                "SELECT num_entries FROM embeddings_count"
+            ).fetchone()
+            if num_entries > self.max_entries:
+                self.connection.execute(
+                    "DELETE FROM embeddings WHERE key IN ("
+                    "SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (num_entries - self.max_entries,),
+                )
+            self.connection.execute("COMMIT")
+
+    @property
+    def hit_rate(self) -> float:
+        """Ratio of hits to lookups since the process started."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings which consult the cache before calling the underlying model.
+
+    Args:
+        embeddings (Embeddings): underlying embedding model
+        cache (EmbeddingCache): cache of embeddings
+        model_name (str): name of the underlying model used in cache keys
+
+    """
+
+    def __init__(
+        self, embeddings: Embeddings, cache: EmbeddingCache, model_name: str
+    ) -> None:
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = model_name
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """Embed texts, calling the underlying model only for uncached ones.
+
+        Args:
+            texts (list[str]): texts to embed
+
+        Returns:
+            list[list[float]]: embeddings in the same order as `texts`
+        """
+        keys = [EmbeddingCache.make_key(self.model_name, text) for text in texts]
+        found = self.cache.get_many(keys)
+
+        # Embed each missing text only once even if it appears many times.
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.cache.set_many(computed)
+            found.update(computed)
+
+        logger.info(
+            f"Embedded {len(texts)} texts with {len(missing)} cache misses "
+            f"(hit rate {self.cache.hit_rate:.1%} since start)."
+        )
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> list[float]:
+        """Embed a query text.
+
+        Args:
+            text (str): text to embed
+
+        Returns:
+            list[float]: embedding
+        """
+        key = EmbeddingCache.make_key(f"{self.model_name}/query", text)
+        found = self.cache.get_many([key])
+        if key in found:
+            return found[key]
+        vector = self.embeddings.embed_query(text)
+        self.cache.set_many({key: vector})
+        return vector
@@ -0,0 +1,72 @@
+import re
+import zlib
+from typing import Final, cast
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+TOKEN_PATTERN: Final = re.compile(r"\w+")
+SIGN_BIT: Final = 1 << 31
+
+
+class HashingEmbeddings(Embeddings):
+    """Local embeddings by the hashing trick over word unigrams and bigrams.
+
+    Each feature is hashed into one of `n_features` dimensions with a sign, and
+    the counts are log-scaled and L2-normalized. It needs no model nor network
+    and embeds all texts in one vectorized batch, in exchange for lower retrieval
+    quality than neural embeddings. Embeddings are stateless, so queries and
+    documents embedded separately are comparable.
+
+    Args:
+        n_features (int, optional): number of dimensions. Defaults to 1024.
+
+    """
+
+    def __init__(self, n_features: int = 1024) -> None:
+        self.n_features = n_features
+        self.model = f"hashing-{n_features}"
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """Embed texts.
+
+        Args:
+            texts (list[str]): texts to embed
+
+        Returns:
+            list[list[float]]: embeddings in the same order as `texts`
+        """
+        return cast(list[list[float]], self._embed(texts).tolist())
+
+    def embed_query(self, text: str) -> list[float]:
+        """Embed a query text.
+
+        Args:
+            text (str): text to embed
+
+        Returns:
+            list[float]: embedding
+        """
+        return cast(list[float], self._embed([text])[0].tolist())
+
+    def _embed(self, texts: list[str]) -> np.ndarray:
+        rows: list[int] = []
+        hashes: list[int] = []
+        for row, text in enumerate(texts):
+            tokens = TOKEN_PATTERN.findall(text.lower())
+            features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            rows.extend([row] * len(features))
+            hashes.extend(zlib.crc32(feature.encode("utf-8")) for feature in features)
+
+        hash_array = np.array(hashes, dtype=np.int64)
+        signs = np.where(hash_array & SIGN_BIT, -1.0, 1.0).astype(np.float32)
+        matrix = np.zeros((len(texts), self.n_features), dtype=np.float32)
+        np.add.at(
+            matrix,
+            (np.array(rows, dtype=np.int64), hash_array % self.n_features),
+            signs,
+        )
+
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return cast(np.ndarray, matrix / np.where(norms == 0, 1, norms))
@@ -0,0 +1,85 @@
+import logging
+import pathlib
+import threading
+from typing import Final
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from src.usecase.embeddings.cached_embeddings import EmbeddingCache
+from src.usecase.metrics import count_cache_lookups
+from src.usecase.vectorstore.mapped_docstore import atomic_write
+
+logger: Final = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+
+class QueryEmbeddingCache:
+    """In-process cache of the embeddings of retrieval queries.
+
+    The queries used by summarizers are constant, so they are embedded once per
+    process. If `precomputed_path` is given, the embeddings are loaded from the
+    file at startup and new ones are written back to it.
+
+    Args:
+        precomputed_path (pathlib.Path | None, optional): path to the `.npz` file
+            of precomputed embeddings. Defaults to None.
+
+    """
+
+    def __init__(self, precomputed_path: pathlib.Path | None = None) -> None:
+        self.precomputed_path = precomputed_path
+        self.lock = threading.Lock()
+        self.vectors: dict[str, np.ndarray] = dict()
+        if precomputed_path is not None and precomputed_path.exists():
+            with np.load(precomputed_path) as precomputed:
+                self.vectors = {key: precomputed[key] for key in precomputed.files}
+            logger.info(
+                f"Loaded {len(self.vectors)} query embeddings from `{precomputed_path}`."
+            )
+
+    def embed_queries(
+        self, embeddings: Embeddings, model_name: str, queries: list[str]
+    ) -> np.ndarray:
+        """Embed queries by `embed_query`, as the summarizers do without the cache.
+
+        Backends may embed queries and documents differently, so the keys are
+        those of queries, as in `CachedEmbeddings.embed_query`.
+
+        Args:
+            embeddings (Embeddings): embedding model
+            model_name (str): name of the embedding model used in cache keys
+            queries (list[str]): queries to embed
+
+        Returns:
+            np.ndarray: embeddings of shape (len(queries), dim)
+        """
+        keys = [
+            EmbeddingCache.make_key(f"{model_name}/query", query) for query in queries
+        ]
+        with self.lock:
+            missing = {
+                key: query
+                for key, query in zip(keys, queries)
+                if key not in self.vectors
+            }
+        count_cache_lookups(
+            "query_embedding", hits=len(keys) - len(missing), misses=len(missing)
+        )
+        if missing:
+            computed = [embeddings.embed_query(query) for query in missing.values()]
+            with self.lock:
+                for key, vector in zip(missing.keys(), computed):
+                    self.vectors[key] = np.asarray(vector, dtype=np.float32)
+                if self.precomputed_path is not None:
+                    self._save(self.precomputed_path)
+        return np.stack([self.vectors[key] for key in keys])
+
+    def _save(self, path: pathlib.Path) -> None:
+        """Save the embeddings to the `.npz` file atomically.
+
+        Each save writes its own temporary file, so workers saving at once never
+        rename a file being written by another.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(path, lambda f: np.savez(f, **self.vectors))
@@ -0,0 +1,161 @@
+import asyncio
+import functools
+import importlib.util
+import logging
+import os
+import weakref
+from typing import Any, Final
+
+import aiohttp
+import httpx
+import openai
+
+from src.domain.http_client_config_dto import HTTPClientConfigDTO
+from src.usecase.rate_limiter import OpenAIModel
+
+logger: Final = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Fields of `HTTPClientConfigDTO` are overridden by the environment variables of
+# this prefix, e.g. `BACKEND_HTTP_MAX_CONNECTIONS`.
+HTTP_CONFIG_ENV_PREFIX: Final = "BACKEND_HTTP_"
+
+# Connections of async clients belong to an event loop, so the clients are kept
+# per loop.
+_async_clients: Final[
+    weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]
+] = weakref.WeakKeyDictionary()
+_openai_sessions: Final[
+    weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]
+] = weakref.WeakKeyDictionary()
+
+
+@functools.lru_cache(maxsize=None)
+def get_http_client_config() -> HTTPClientConfigDTO:
+    """Get the config of the HTTP clients from the environment variables.
+
+    Returns:
+        HTTPClientConfigDTO: config of the HTTP clients
+    """
+    overrides = {
+        name: os.environ[HTTP_CONFIG_ENV_PREFIX + name.upper()]
+        for name in HTTPClientConfigDTO.model_fields
+        if HTTP_CONFIG_ENV_PREFIX + name.upper() in os.environ
+    }
+    return HTTPClientConfigDTO.parse_obj(overrides)
+
+
+def _httpx_options(config: HTTPClientConfigDTO) -> dict[str, Any]:
+    """Make the options shared by the sync and the async httpx clients."""
+    http2 = config.http2 and importlib.util.find_spec("h2") is not None
+    return {
+        "limits": httpx.Limits(
+            max_connections=config.max_connections,
+            max_keepalive_connections=config.max_keepalive_connections,
+            keepalive_expiry=config.keepalive_expiry_seconds,
+        ),
+        "timeout": httpx.Timeout(
+            config.timeout_seconds, connect=config.connect_timeout_seconds
+        ),
+        "http2": http2,
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def get_http_client() -> httpx.Client:
+    """Get the HTTP client shared by the process.
+
+    Returns:
+        httpx.Client: client with a pool of keep-alive connections
+    """
+    return httpx.Client(**_httpx_options(get_http_client_config()))
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """Get the async HTTP client shared by the running event loop.
+
+    Returns:
+        httpx.AsyncClient: client with a pool of keep-alive connections
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _async_clients:
+        _async_clients[loop] = httpx.AsyncClient(
+            **_httpx_options(get_http_client_config())
+        )
+    return _async_clients[loop]
+
+
+def get_openai_session() -> aiohttp.ClientSession:
+    """Get the aiohttp session of OpenAI shared by the running event loop.
+
+    The openai package opens a new session, hence new connections, for each async
+    call unless a session is given.
+
+    Returns:
+        aiohttp.ClientSession: session with a pool of keep-alive connections
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _openai_sessions or _openai_sessions[loop].closed:
+        config = get_http_client_config()
+        _openai_sessions[loop] = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=config.max_connections,
+                keepalive_timeout=config.keepalive_expiry_seconds,
+            ),
+            timeout=aiohttp.ClientTimeout(
+                total=None, connect=config.connect_timeout_seconds
+            ),
+        )
+    return _openai_sessions[loop]
+
+
+async def aclose_http_clients() -> None:
+    """Close the HTTP clients of the running event loop and the process."""
+    loop = asyncio.get_running_loop()
+    if loop in _async_clients:
+        await _async_clients.pop(loop).aclose()
+    if loop in _openai_sessions:
+        await _openai_sessions.pop(loop).close()
+    if get_http_client.cache_info().currsize:
+        get_http_client().close()
+        get_http_client.cache_clear()
+
+
+class PooledOpenAIClient:
+    """Client of an OpenAI API resource which sends async calls through the
+    session shared by the event loop.
+
+    Sync calls are left as they are, since the openai package already keeps a
+    `requests` session per thread.
+
+    Args:
+        resource (Any): OpenAI API resource, e.g. `openai.ChatCompletion`
+
+    """
+
+    def __init__(self, resource: Any) -> None:
+        self.resource = resource
+
+    def create(self, **kwargs: Any) -> Any:
+        return self.resource.create(**kwargs)
+
+    async def acreate(self, **kwargs: Any) -> Any:
+        token = openai.aiosession.set(get_openai_session())
+        try:
+            return await self.resource.acreate(**kwargs)
+        finally:
+            openai.aiosession.reset(token)
+
+
+def apply_pooled_session(model: OpenAIModel) -> OpenAIModel:
+    """Make the OpenAI model of langchain send async calls through the shared
+    session.
+
+    Args:
+        model (OpenAIModel): chat or embedding model of OpenAI
+
+    Returns:
+        OpenAIModel: the model itself
+    """
+    model.client = PooledOpenAIClient(model.client)
+    return model
@@ -1,47 +1,82 @@
+import asyncio
+import heapq
 import logging
 import pathlib
 import re
-from typing import Final, cast
+from typing import Any, Final, cast
 
+from src.domain.credentials_dto import CredentialsDTO, get_secret_value
 from src.domain.parsed_paper_dto import ParsedPaperDTO
+from src.usecase.cache_key import make_cache_key
+from src.usecase.metrics import count_cache_lookups
 from src.usecase.pdf_loader import CustomMathpixLoader
 
 logger: Final = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
 
+MATHPIX_FILE_FORMATS: Final = ["mmd", "tex.zip"]
+MATHPIX_REQUEST_PARAMETERS: Final = {
+    "math_inline_delimiters": ["$", "$"],
+    "math_display_delimiters": ["$$", "$$"],
+}
+
+
+HEADING_DEPTH: Final = {"section": 1, "subsection": 2, "subsubsection": 3}
+# Each pattern starts with a literal so that the regex engine can skip quickly to
+# its candidates. Matches of all patterns are merged in the order of position.
+HEADING_PATTERN: Final = re.compile(
+    r"\\(?P<level>section|subsection|subsubsection)\*?{(?P<title>[^\n]*?)}\n"
+)
+APPENDIX_PATTERN: Final = re.compile(r"\\appendix\b")
+TABLE_PATTERN: Final = re.compile(r"\\begin{tabular}.*?\\end{tabular}", re.DOTALL)
+# The link of a figure does not span lines, so a malformed one does not consume
+# the headings after it.
+FIGURE_PATTERN: Final = re.compile(r"!\[\]\([^)\n]*\)\n")
+FIGURE_TABLE_PATTERN: Final = re.compile(
+    f"{TABLE_PATTERN.pattern}|{FIGURE_PATTERN.pattern}", re.DOTALL
+)
+SECTION_PATTERN: Final = re.compile(r"\\section\*?{")
+ABSTRACT_PATTERN: Final = re.compile(r"abstract", re.IGNORECASE)
+APPENDIX_TITLE_PATTERN: Final = re.compile(
+    r"(appendix|appendices|supplementary)", re.IGNORECASE
+)
+
+
 class MathpixPdfParser:
-    def load_pdf(self, pdf_file_path: pathlib.Path) -> str:
+    def __init__(self) -> None:
+        # Mathpix outputs depend only on the pdf and the request options.
+        self.cache_key = make_cache_key(
+            MATHPIX_FILE_FORMATS, MATHPIX_REQUEST_PARAMETERS
+        )
+
+    def load_pdf(
+        self, pdf_file_path: pathlib.Path, credentials: CredentialsDTO | None = None
+    ) -> str:
         """Parse pdf file to latex form and save it to storage.
 
         Args:
             pdf_file_path pathlib.Path: path to pdf file
+            credentials (CredentialsDTO | None, optional): credentials of Mathpix.
+                The environment variables are used if None. Defaults to None.
 
         Returns:
             str: latex format text
         """
-        stem = str(pdf_file_path.stem)
-        mathpix_file_path = pdf_file_path.parent / (stem + "_mathpix.txt")
+        mathpix_file_path = pdf_file_path.parent / f"mathpix_{self.cache_key}.txt"
 
         # If mathpix file already exists, continue loop.
         if mathpix_file_path.exists():
+            count_cache_lookups("mathpix", hits=1, misses=0)
             logger.info(f"`{str(mathpix_file_path)}` already exists.")
             with mathpix_file_path.open() as f:
                 latex_text = f.read()
 
         # If else, Send request to Mathpix.
         else:
-            logger.info(f"`{stem}` is sent to Mathpix API.")
-            latex_text = CustomMathpixLoader(
-                file_path=str(pdf_file_path),
-                output_path_for_tex=pdf_file_path.parent,
-                processed_file_format=["mmd", "tex.zip"],
-                other_request_parameters={
-                    "math_inline_delimiters": ["$", "$"],
-                    "math_display_delimiters": ["$$", "$$"],
-                },
-                output_langchain_document=False,
-            ).load()[
+            count_cache_lookups("mathpix", hits=0, misses=1)
+            logger.info(f"`{str(pdf_file_path)}` is sent to Mathpix API.")
+            latex_text = self._make_loader(pdf_file_path, credentials).load()[
                 "mmd"
             ]  # type: ignore
 
@@ -51,84 +86,141 @@ class MathpixPdfParser:
 
         return latex_text
 
+    async def aload_pdf(
+        self, pdf_file_path: pathlib.Path, credentials: CredentialsDTO | None = None
+    ) -> str:
+        """Parse pdf file to latex form and save it to storage asynchronously.
+
+        Args:
+            pdf_file_path pathlib.Path: path to pdf file
+            credentials (CredentialsDTO | None, optional): credentials of Mathpix.
+                The environment variables are used if None. Defaults to None.
+
+        Returns:
+            str: latex format text
+        """
+        mathpix_file_path = pdf_file_path.parent / f"mathpix_{self.cache_key}.txt"
+
+        # If mathpix file already exists, continue loop.
+        if mathpix_file_path.exists():
+            count_cache_lookups("mathpix", hits=1, misses=0)
+            logger.info(f"`{str(mathpix_file_path)}` already exists.")
+            return await asyncio.to_thread(mathpix_file_path.read_text)
+
+        # If else, Send request to Mathpix.
+        count_cache_lookups("mathpix", hits=0, misses=1)
+        logger.info(f"`{str(pdf_file_path)}` is sent to Mathpix API.")
+        contents = await self._make_loader(pdf_file_path, credentials).aload()
+        latex_text = cast(str, contents["mmd"])
+
+        # Save latex format text.
+        await asyncio.to_thread(mathpix_file_path.write_text, latex_text)
+        return latex_text
+
+    def _make_loader(
+        self, pdf_file_path: pathlib.Path, credentials: CredentialsDTO | None = None
+    ) -> CustomMathpixLoader:
+        """Make Mathpix loader for the pdf file.
+
+        Args:
+            pdf_file_path pathlib.Path: path to pdf file
+            credentials (CredentialsDTO | None, optional): credentials of Mathpix.
+                The environment variables are used if None. Defaults to None.
+
+        Returns:
+            CustomMathpixLoader: loader for the pdf file
+        """
+        credentials = credentials or CredentialsDTO()
+        return CustomMathpixLoader(
+            file_path=str(pdf_file_path),
+            output_path_for_tex=pdf_file_path.parent / f"tex_{self.cache_key}",
+            processed_file_format=MATHPIX_FILE_FORMATS,
+            other_request_parameters=MATHPIX_REQUEST_PARAMETERS,
+            output_langchain_document=False,
+            # The loader falls back to the environment variables if None.
+            mathpix_api_key=get_secret_value(credentials.mathpix_api_key),
+            mathpix_api_id=get_secret_value(credentials.mathpix_api_id),
+        )
+
     def parse_pdf(self, pdf_text: str) -> ParsedPaperDTO:
         """Parse pdf text to structured data.
 
+        The text after the abstract is scanned once. Headings open nodes of the
+        section tree at their depth, and tables and figures are skipped in the same
+        scan, so the time is linear in the length of the text.
+
         Args:
             pdf_text (str): pdf text
 
         Returns:
             ParsedPaperDTO: parsed paper data
         """
-        if "\\begin{abstract}" in pdf_text:
-            # Remove metadata contents before abstract
-            _, contents = pdf_text.split("\\begin{abstract}", 1)
+        abstract, body_start = self._extract_abstract(pdf_text)
 
-            # Extract abstract
-            abstract, contents_wo_abstract = contents.split("\n\\end{abstract}", 1)
-        else:
-            pattern = re.compile(r"abstract", re.IGNORECASE)
-
-            # Remove metadata contents before abstract
-            _, contents = re.split(pattern, pdf_text, 1)
-
-            # Extract abstract
-            abstract, contents_wo_abstract = contents[1:].split("\\section{", 1)
-            abstract = abstract.strip("\n")
-            contents_wo_abstract = "\\section{" + contents_wo_abstract
-
-        # Split sections
-        raw_section_list = contents_wo_abstract.lstrip("\n").split("\\section{")
-        section_list = []
-        section_id = 1
-        for i, each_section in enumerate(raw_section_list):
-            if i == 0:
+        section_list: list[dict[str, Any]] = []
+        # Stack of the open nodes from the section to the deepest subsection.
+        open_nodes: list[dict[str, Any]] = []
+        text_key: str | None = None
+        text_pieces: list[str] = []
+        is_appendix = False
+        position = body_start
+        tokens = heapq.merge(
+            *[
+                pattern.finditer(pdf_text, body_start)
+                for pattern in (
+                    HEADING_PATTERN,
+                    APPENDIX_PATTERN,
+                    TABLE_PATTERN,
+                    FIGURE_PATTERN,
+                )
+            ],
+            key=lambda match: match.start(),
+        )
+        for match in tokens:
+            # Skip tokens inside the one already consumed, e.g. in a table.
+            if match.start() < position:
                 continue
-            section_title, raw_section_text = each_section.split("}\n", 1)
-            section_text = raw_section_text.lstrip("\n")
-            section_text = self.simple_figure_table_remover(section_text)
-            section_dict = {
-                "section_id": section_id,
-                "section_title": section_title,
-                "section_text": section_text,
-            }
-            section_list.append(section_dict)
-            section_id += 1
-
-        # Split subsections
-        for each_section_dict in section_list:
-            raw_subsection_list = cast(str, each_section_dict["section_text"]).split(
-                "\\subsection{"
-            )
-            # Go into next section if there is no subsection
-            if len(raw_subsection_list) == 1:
-                each_section_dict["subsection_list"] = []
+            text_pieces.append(pdf_text[position : match.start()])
+            position = match.end()
+            if match.re is not HEADING_PATTERN:
+                # Drop tables and figures, and enter appendices at `\appendix`.
+                is_appendix = is_appendix or match.re is APPENDIX_PATTERN
                 continue
-            subsection_list = []
-            subsection_id = 0
-            for each_subsection in raw_subsection_list:
-                # If there is no text between \section{} and \subsection{}, skip it
-                if len(each_subsection) == 0:
-                    subsection_id += 1
-                    each_section_dict["section_text"] = ""
-                    continue
-                # If there is text between \section{} and \subsection{}, update section_text
-                if subsection_id == 0 and len(each_subsection) != 0:
-                    each_section_dict["section_text"] = each_subsection
-                    subsection_id += 1
-                    continue
-
-                subsection_title, raw_subsection_text = each_subsection.split("}\n", 1)
-                subsection_text = raw_subsection_text.lstrip("\n")
-                subsection_dict = {
-                    "subsection_id": subsection_id,
-                    "subsection_title": subsection_title,
-                    "subsection_text": subsection_text,
+
+            # Close the text of the previous node.
+            if text_key is not None:
+                open_nodes[-1][text_key] = "".join(text_pieces).lstrip("\n")
+            text_pieces = []
+
+            depth = min(HEADING_DEPTH[match.group("level")], len(open_nodes) + 1)
+            del open_nodes[depth - 1 :]
+            title = match.group("title")
+            if depth == 1:
+                is_appendix = is_appendix or bool(APPENDIX_TITLE_PATTERN.match(title))
+                node: dict[str, Any] = {
+                    "section_id": len(section_list) + 1,
+                    "section_title": title,
+                    "section_text": "",
+                    "subsection_list": [],
+                    "is_appendix": is_appendix,
+                }
+                section_list.append(node)
+                text_key = "section_text"
+            else:
+                siblings = open_nodes[-1]["subsection_list"]
+                node = {
+                    "subsection_id": len(siblings) + 1,
+                    "subsection_title": title,
+                    "subsection_text": "",
+                    "subsection_list": [],
                 }
-                subsection_list.append(subsection_dict)
-                subsection_id += 1
+                siblings.append(node)
+                text_key = "subsection_text"
+            open_nodes.append(node)
 
-            each_section_dict["subsection_list"] = subsection_list
+        if text_key is not None:
+            text_pieces.append(pdf_text[position:])
+            open_nodes[-1][text_key] = "".join(text_pieces).lstrip("\n")
 
         parsed_pdf = {
             "abstract": abstract,
@@ -137,6 +229,37 @@ class MathpixPdfParser:
 
         return ParsedPaperDTO.parse_obj(parsed_pdf)
 
+    def _extract_abstract(self, pdf_text: str) -> tuple[str, int]:
+        """Extract abstract without copying the rest of the text.
+
+        Args:
+            pdf_text (str): pdf text
+
+        Returns:
+            tuple[str, int]: abstract and the position where the body starts
+        """
+        begin = pdf_text.find("\\begin{abstract}")
+        if begin != -1:
+            # Remove metadata contents before abstract
+            start = begin + len("\\begin{abstract}")
+            end = pdf_text.index("\n\\end{abstract}", start)
+            return pdf_text[start:end], end + len("\n\\end{abstract}")
+
+        # Remove metadata contents before abstract
+        abstract_match = ABSTRACT_PATTERN.search(pdf_text)
+        if abstract_match is None:
+            raise ValueError("Abstract is not found in the pdf text.")
+        start = abstract_match.end() + 1
+
+        # Abstract continues until the first section
+        section_match = SECTION_PATTERN.search(pdf_text, start)
+        if section_match is None:
+            raise ValueError("Section is not found in the pdf text.")
+        return (
+            pdf_text[start : section_match.start()].strip("\n"),
+            section_match.start(),
+        )
+
     def simple_figure_table_remover(self, text: str) -> str:
         """Remove figures and tables from text.
 
@@ -146,10 +269,4 @@ class MathpixPdfParser:
         Returns:
             str: text without figures and tables
         """
-        wo_table_text = re.sub(
-            r"\\begin{tabular}(.*?)\\end{tabular}", "", text, flags=re.DOTALL
-        )
-        wo_fig_table_text = re.sub(
-            r"!\[\]\((.*?)\)\n", "", wo_table_text, flags=re.DOTALL
-        )
-        return wo_fig_table_text
+        return FIGURE_TABLE_PATTERN.sub("", text)
@@ -0,0 +1,304 @@
+import bisect
+import contextlib
+import math
+import threading
+import time
+from typing import Final, Iterator
+
+# Stages range from milliseconds of parsing to minutes of waiting for Mathpix.
+DEFAULT_BUCKETS: Final = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+    300.0,
+    600.0,
+)
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    """Format labels as in the Prometheus text format."""
+    if not labels:
+        return ""
+    formatted = ",".join(
+        '{}="{}"'.format(
+            name,
+            value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'),
+        )
+        for name, value in labels.items()
+    )
+    return f"{{{formatted}}}"
+
+
+def _format_value(value: float) -> str:
+    """Format a sample value as in the Prometheus text format."""
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Counter:
+    """Counter which only goes up, e.g. the number of errors.
+
+    Args:
+        name (str): name of the metric
+        documentation (str): description of the metric
+        labelnames (tuple[str, ...], optional): names of the labels.
+            Defaults to ().
+
+    """
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: tuple[str, ...] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values: dict[tuple[str, ...], float] = dict()
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        """Increase the counter of the labels.
+
+        Args:
+            amount (float, optional): amount to add. Defaults to 1.0.
+            **labels (str): values of the labels
+        """
+        key = tuple(labels[name] for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def get(self, **labels: str) -> float:
+        """Get the value of the counter of the labels."""
+        key = tuple(labels[name] for name in self.labelnames)
+        return self.values.get(key, 0.0)
+
+    def render(self) -> list[str]:
+        """Render the counter in the Prometheus text format."""
+        with self.lock:
+            values = list(self.values.items())
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        for key, value in sorted(values):
+            labels = _format_labels(dict(zip(self.labelnames, key)))
+            lines.append(f"{self.name}{labels} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Histogram of observed values, e.g. latencies.
+
+    Observations are counted in the bucket of their upper bound, and accumulated
+    only when rendered, so an observation costs a binary search and an addition.
+
+    Args:
+        name (str): name of the metric
+        documentation (str): description of the metric
+        labelnames (tuple[str, ...], optional): names of the labels.
+            Defaults to ().
+        buckets (tuple[float, ...], optional): upper bounds of the buckets in
+            ascending order. Defaults to `DEFAULT_BUCKETS`.
+
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = (*buckets, math.inf)
+        self.bucket_counts: dict[tuple[str, ...], list[int]] = dict()
+        self.sums: dict[tuple[str, ...], float] = dict()
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        """Observe a value of the labels.
+
+        Args:
+            value (float): value to observe
+            **labels (str): values of the labels
+        """
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            if key not in self.bucket_counts:
+                self.bucket_counts[key] = [0] * len(self.buckets)
+                self.sums[key] = 0.0
+            self.bucket_counts[key][index] += 1
+            self.sums[key] += value
+
+    def count(self, **labels: str) -> int:
+        """Get the number of observations of the labels."""
+        key = tuple(labels[name] for name in self.labelnames)
+        return sum(self.bucket_counts.get(key, []))
+
+    def render(self) -> list[str]:
+        """Render the histogram in the Prometheus text format."""
+        with self.lock:
+            values = [
+                (key, list(counts), self.sums[key])
+                for key, counts in self.bucket_counts.items()
+            ]
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for key, counts, total in sorted(values):
+            labels = dict(zip(self.labelnames, key))
+            cumulative_count = 0
+            for upper_bound, count in zip(self.buckets, counts):
+                cumulative_count += count
+                bucket_labels = _format_labels(
+                    {**labels, "le": _format_value(upper_bound)}
+                )
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative_count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total!r}")
+            lines.append(
+                f"{self.name}_count{_format_labels(labels)} {cumulative_count}"
+            )
+        return lines
+
+
+class MetricsRegistry:
+    """Registry of the metrics of the process.
+
+    NOTE: Metrics are kept in memory of each process, so each gunicorn worker
+    exposes its own metrics. Prometheus should scrape the workers with the
+    `instance` label, or aggregate with `sum` across the workers.
+
+    """
+
+    def __init__(self) -> None:
+        self.metrics: list[Counter | Histogram] = []
+
+    def counter(
+        self, name: str, documentation: str, labelnames: tuple[str, ...] = ()
+    ) -> Counter:
+        """Create and register a counter."""
+        counter = Counter(name, documentation, labelnames)
+        self.metrics.append(counter)
+        return counter
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """Create and register a histogram."""
+        histogram = Histogram(name, documentation, labelnames, buckets)
+        self.metrics.append(histogram)
+        return histogram
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text format.
+
+        Returns:
+            str: metrics in the Prometheus text format of version 0.0.4
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY: Final = MetricsRegistry()
+
+STAGE_DURATION: Final = REGISTRY.histogram(
+    "crux_stage_duration_seconds",
+    "Duration of each stage of the summarization pipeline.",
+    ("stage",),
+)
+STAGE_ERRORS: Final = REGISTRY.counter(
+    "crux_stage_errors_total",
+    "Number of errors raised in each stage of the summarization pipeline.",
+    ("stage",),
+)
+LLM_CHAIN_DURATION: Final = REGISTRY.histogram(
+    "crux_llm_chain_duration_seconds",
+    "Duration of each LLM chain, named after its prompt template.",
+    ("chain",),
+)
+LLM_CHAIN_ERRORS: Final = REGISTRY.counter(
+    "crux_llm_chain_errors_total",
+    "Number of errors raised in each LLM chain.",
+    ("chain",),
+)
+LLM_TOKENS: Final = REGISTRY.counter(
+    "crux_llm_tokens_total",
+    "Number of tokens sent to and generated by the LLM, excluding cached ones.",
+    ("model", "chain", "kind"),
+)
+CACHE_LOOKUPS: Final = REGISTRY.counter(
+    "crux_cache_lookups_total",
+    "Number of lookups of each cache by the result.",
+    ("cache", "result"),
+)
+SINGLE_FLIGHT_CALLS: Final = REGISTRY.counter(
+    "crux_single_flight_calls_total",
+    "Number of calls of each kind coalesced by the role, leader or follower.",
+    ("flight", "role"),
+)
+
+
+@contextlib.contextmanager
+def track(duration: Histogram, errors: Counter, **labels: str) -> Iterator[None]:
+    """Observe the duration of the block and count the error raised in it.
+
+    Args:
+        duration (Histogram): histogram to observe the duration in seconds
+        errors (Counter): counter of errors
+        **labels (str): values of the labels of both metrics
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        errors.inc(1.0, **labels)
+        raise
+    finally:
+        duration.observe(time.perf_counter() - start, **labels)
+
+
+def track_stage(stage: str) -> contextlib.AbstractContextManager[None]:
+    """Track the duration and the errors of a stage of the pipeline.
+
+    Args:
+        stage (str): name of the stage
+
+    Returns:
+        contextlib.AbstractContextManager[None]: context of the stage
+    """
+    return track(STAGE_DURATION, STAGE_ERRORS, stage=stage)
+
+
+def count_cache_lookups(cache: str, hits: int, misses: int) -> None:
+    """Count the hits and the misses of lookups of a cache.
+
+    Args:
+        cache (str): name of the cache
+        hits (int): number of hits
+        misses (int): number of misses
+    """
+    if hits:
+        CACHE_LOOKUPS.inc(hits, cache=cache, result="hit")
+    if misses:
+        CACHE_LOOKUPS.inc(misses, cache=cache, result="miss")
@@ -1,5 +1,8 @@
+import hashlib
 import logging
+import os
 import pathlib
+import tempfile
 from typing import Final
 
 from fastapi import UploadFile
@@ -7,32 +10,114 @@ from fastapi import UploadFile
 logger: Final = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+PDF_FILENAME: Final = "paper.pdf"
+TMP_DIRNAME: Final = "tmp"
+MAX_PDF_FILE_SIZE: Final = 100 * 1024 * 1024
+READ_CHUNK_SIZE: Final = 1024 * 1024
+
+
+class PdfTooLargeError(ValueError):
+    """Raised when the uploaded pdf file exceeds the maximum size."""
+
 
 class PaperIOHandler:
-    def __init__(self, root_path: pathlib.Path) -> None:
+    """Handler for saving papers to the storage.
+
+    Args:
+        root_path (pathlib.Path): root directory of the storage
+        max_file_size (int | None, optional): maximum size of a pdf file in bytes.
+            No limit if None. Defaults to 100 MiB.
+        read_chunk_size (int, optional): size of chunks to stream the upload in
+            bytes. Defaults to 1 MiB.
+
+    """
+
+    def __init__(
+        self,
+        root_path: pathlib.Path,
+        max_file_size: int | None = MAX_PDF_FILE_SIZE,
+        read_chunk_size: int = READ_CHUNK_SIZE,
+    ) -> None:
         self.root_path = root_path
+        self.max_file_size = max_file_size
+        self.read_chunk_size = read_chunk_size
 
     def save_pdf(self, pdf_file: UploadFile) -> pathlib.Path:
         """Save pdf file to the storage.
 
+        The pdf file is stored under the directory named after the SHA-256 hash of
+        its content, so the same paper uploaded under another filename shares all
+        artifacts derived from it. The upload is streamed into a temporary file
+        while hashing and then renamed atomically, so a half-written pdf is never
+        visible.
+
         Args:
             pdf_file UploadFile: pdf file to save
 
         Returns:
             pathlib.Path: the path to the saved pdf file
         """
-        directory_path = self.root_path / str(pdf_file.filename).removesuffix(".pdf")
-        file_path = directory_path / str(pdf_file.filename)
+        if self.max_file_size is not None and (pdf_file.size or 0) > self.max_file_size:
+            raise PdfTooLargeError(
+                f"`{pdf_file.filename}` exceeds the maximum size of {self.max_file_size} bytes."
+            )
+
+        tmp_directory_path = self.root_path / TMP_DIRNAME
+        tmp_directory_path.mkdir(parents=True, exist_ok=True)
+        tmp_file_path, content_hash = self._stream_to_tmp_file(
+            pdf_file, tmp_directory_path
+        )
+        directory_path = self.root_path / content_hash
+        file_path = directory_path / PDF_FILENAME
 
-        # If directory already exists, skip it.
-        if directory_path.exists():
-            logger.info(f"`{str(directory_path)}` already exists.")
+        # If the same paper already exists, skip it. Uploads of the same paper at
+        # once may both move their files, which is safe since the contents are the
+        # same and the rename is atomic. Processing them is coalesced afterwards.
+        if file_path.exists():
+            logger.info(f"`{pdf_file.filename}` already exists as `{content_hash}`.")
+            tmp_file_path.unlink()
 
-        # If else, create directory to save PDF.
+        # If else, move the temporary file to the directory.
         else:
-            logger.info(f"Saving paper `{pdf_file.filename}`.")
-            directory_path.mkdir(parents=True)
-            with open(file_path, "wb") as f:
-                f.write(pdf_file.file.read())
+            logger.info(f"Saving paper `{pdf_file.filename}` as `{content_hash}`.")
+            directory_path.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp_file_path, file_path)
 
         return file_path
+
+    def _stream_to_tmp_file(
+        self, pdf_file: UploadFile, tmp_directory_path: pathlib.Path
+    ) -> tuple[pathlib.Path, str]:
+        """Write the upload into a temporary file chunk by chunk while hashing.
+
+        Args:
+            pdf_file (UploadFile): pdf file to save
+            tmp_directory_path (pathlib.Path): directory for the temporary file
+
+        Returns:
+            tuple[pathlib.Path, str]: the path to the temporary file and the
+                SHA-256 hash of the content
+        """
+        hasher = hashlib.sha256()
+        file_size = 0
+        with tempfile.NamedTemporaryFile(
+            dir=tmp_directory_path, suffix=".pdf", delete=False
+        ) as f:
+            tmp_file_path = pathlib.Path(f.name)
+            try:
+                while chunk := pdf_file.file.read(self.read_chunk_size):
+                    file_size += len(chunk)
+                    if self.max_file_size is not None and (
+                        file_size > self.max_file_size
+                    ):
+                        raise PdfTooLargeError(
+                            f"`{pdf_file.filename}` exceeds the maximum size of {self.max_file_size} bytes."
+                        )
+                    hasher.update(chunk)
+                    f.write(chunk)
+            except BaseException:
+                f.close()
+                tmp_file_path.unlink(missing_ok=True)
+                raise
+
+        return tmp_file_path, hasher.hexdigest()
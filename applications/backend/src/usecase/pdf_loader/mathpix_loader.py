@@ -1,25 +1,40 @@
 from __future__ import annotations
 
+import asyncio
 import io
 import json
 import logging
+import os
 import pathlib
+import random
+import tempfile
+import time
 import zipfile
 from typing import Any, Final
 
-import requests
+import httpx
 from langchain.docstore.document import Document
 from langchain.document_loaders import MathpixPDFLoader
 
+from src.usecase.http_clients import get_async_http_client, get_http_client
+
 logger: Final = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+DOWNLOAD_CHUNK_SIZE: Final = 1024 * 1024
+DEFAULT_MATHPIX_API_URL: Final = "https://api.mathpix.com/v3/pdf"
+
 
 class CustomMathpixLoader(MathpixPDFLoader):
     """Loader for mathpix.
 
     NOTE: This class extends `MathpixPDFLoader` class implemented in
-    langchain to support request paramters.
+    langchain to support request paramters. It also supports asynchronous
+    loading by `aload`, which polls the status with exponential backoff and
+    downloads the processed formats concurrently. The endpoint can be replaced by
+    `api_url` or the environment variable `MATHPIX_API_URL`, e.g. for benchmarks.
+    Requests are sent by the HTTP clients shared by the process unless `client` or
+    `async_client` is given, so connections to Mathpix are reused across papers.
 
     """
 
@@ -32,11 +47,23 @@ class CustomMathpixLoader(MathpixPDFLoader):
         should_clean_pdf: bool = False,
         output_langchain_document: bool = True,
         other_request_parameters: dict = {},
+        initial_poll_interval_seconds: float = 1.0,
+        max_poll_interval_seconds: float = 30.0,
+        api_url: str | None = None,
+        client: httpx.Client | None = None,
+        async_client: httpx.AsyncClient | None = None,
         **kwargs: Any,
     ) -> None:
+        self.api_url = api_url or os.environ.get(
+            "MATHPIX_API_URL", DEFAULT_MATHPIX_API_URL
+        )
         self.output_langchain_document = output_langchain_document
         self.other_request_parameters = other_request_parameters
         self.output_path_for_tex = output_path_for_tex
+        self.initial_poll_interval_seconds = initial_poll_interval_seconds
+        self.max_poll_interval_seconds = max_poll_interval_seconds
+        self.client = client
+        self.async_client = async_client
         super().__init__(
             file_path,
             processed_file_format,  # type: ignore
@@ -45,6 +72,10 @@ class CustomMathpixLoader(MathpixPDFLoader):
             **kwargs,
         )
 
+    @property
+    def url(self) -> str:
+        return self.api_url
+
     @property
     def data(self) -> dict:
         conversion_formats = {f: True for f in self.processed_file_format if f != "mmd"}
@@ -57,6 +88,17 @@ class CustomMathpixLoader(MathpixPDFLoader):
     def load(self) -> dict[str, Document | str] | dict[str, str]:  # type: ignore
         pdf_id = self.send_pdf()
         contents = self.get_processed_pdf(pdf_id)
+        return self._postprocess(contents)
+
+    async def aload(self) -> dict[str, Document | str] | dict[str, str]:
+        client = self.async_client or get_async_http_client()
+        pdf_id = await self.asend_pdf(client)
+        contents = await self.aget_processed_pdf(client, pdf_id)
+        return self._postprocess(contents)
+
+    def _postprocess(
+        self, contents: dict[str, str]
+    ) -> dict[str, Document | str] | dict[str, str]:
         if self.should_clean_pdf:
             if "mmd" not in contents:
                 logger.warning(
@@ -74,12 +116,50 @@ class CustomMathpixLoader(MathpixPDFLoader):
                 contents["mmd"] = Document(page_content=contents["mmd"], metadata=metadata)  # type: ignore
         return contents
 
+    def send_pdf(self) -> str:
+        client = self.client or get_http_client()
+        with open(self.file_path, "rb") as f:
+            response = client.post(
+                self.url, headers=self.headers, files={"file": f}, data=self.data
+            )
+        response_data = response.json()
+        if "pdf_id" in response_data:
+            return str(response_data["pdf_id"])
+        else:
+            raise ValueError("Unable to send PDF to Mathpix.")
+
+    def wait_for_processing(self, pdf_id: str) -> None:
+        """Wait for processing to complete with exponential backoff and jitter.
+
+        Args:
+            pdf_id (str): a PDF id
+        """
+        client = self.client or get_http_client()
+        url = f"{self.url}/{pdf_id}"
+        deadline = time.monotonic() + self.max_wait_time_seconds
+        poll_interval = self.initial_poll_interval_seconds
+        while time.monotonic() < deadline:
+            response = client.get(url, headers=self.headers)
+            status = response.json().get("status", None)
+
+            if status == "completed":
+                return
+            elif status == "error":
+                raise ValueError("Unable to retrieve PDF from Mathpix")
+
+            logger.info(f"Status: {status}, waiting for processing to complete")
+            time.sleep(random.uniform(poll_interval / 2, poll_interval))
+            poll_interval = min(poll_interval * 2, self.max_poll_interval_seconds)
+        raise TimeoutError
+
     def get_processed_pdf(self, pdf_id: str) -> dict[str, str]:  # type: ignore
         self.wait_for_processing(pdf_id)
+        client = self.client or get_http_client()
         responses = dict()
         for conversion_format in self.processed_file_format:
             url = f"{self.url}/{pdf_id}.{conversion_format}"
-            response = requests.get(url, headers=self.headers)
+            response = client.get(url, headers=self.headers)
+            response.raise_for_status()
             if conversion_format == "tex.zip":
                 with zipfile.ZipFile(io.BytesIO(response.content)) as z:
                     z.extractall(self.output_path_for_tex)
@@ -87,3 +167,87 @@ class CustomMathpixLoader(MathpixPDFLoader):
             else:
                 responses[conversion_format] = response.content.decode("utf-8")
         return responses
+
+    async def asend_pdf(self, client: httpx.AsyncClient) -> str:
+        with open(self.file_path, "rb") as f:
+            response = await client.post(
+                self.url, headers=self.headers, files={"file": f}, data=self.data
+            )
+        response_data = response.json()
+        if "pdf_id" in response_data:
+            return str(response_data["pdf_id"])
+        else:
+            raise ValueError("Unable to send PDF to Mathpix.")
+
+    async def await_for_processing(
+        self, client: httpx.AsyncClient, pdf_id: str
+    ) -> None:
+        """Wait for processing to complete with exponential backoff and jitter.
+
+        Args:
+            client (httpx.AsyncClient): client to send requests
+            pdf_id (str): a PDF id
+        """
+        url = f"{self.url}/{pdf_id}"
+        deadline = time.monotonic() + self.max_wait_time_seconds
+        poll_interval = self.initial_poll_interval_seconds
+        while time.monotonic() < deadline:
+            response = await client.get(url, headers=self.headers)
+            status = response.json().get("status", None)
+
+            if status == "completed":
+                return
+            elif status == "error":
+                raise ValueError("Unable to retrieve PDF from Mathpix")
+
+            logger.info(f"Status: {status}, waiting for processing to complete")
+            await asyncio.sleep(random.uniform(poll_interval / 2, poll_interval))
+            poll_interval = min(poll_interval * 2, self.max_poll_interval_seconds)
+        raise TimeoutError
+
+    async def aget_processed_pdf(
+        self, client: httpx.AsyncClient, pdf_id: str
+    ) -> dict[str, str]:
+        await self.await_for_processing(client, pdf_id)
+        contents = await asyncio.gather(
+            *[
+                self._adownload(client, pdf_id, conversion_format)
+                for conversion_format in self.processed_file_format
+            ]
+        )
+        return dict(zip(self.processed_file_format, contents))
+
+    async def _adownload(
+        self, client: httpx.AsyncClient, pdf_id: str, conversion_format: str
+    ) -> str:
+        """Download a processed format.
+
+        The zip file is streamed to a temporary file and extracted, so it is never
+        fully buffered in memory.
+
+        Args:
+            client (httpx.AsyncClient): client to send requests
+            pdf_id (str): a PDF id
+            conversion_format (str): format to download
+
+        Returns:
+            str: text of the format, or the output directory for `tex.zip`
+        """
+        url = f"{self.url}/{pdf_id}.{conversion_format}"
+        if conversion_format != "tex.zip":
+            response = await client.get(url, headers=self.headers)
+            response.raise_for_status()
+            return response.content.decode("utf-8")
+
+        with tempfile.TemporaryFile() as f:
+            async with client.stream("GET", url, headers=self.headers) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+            await asyncio.to_thread(self._extract_zip, f)
+        return str(self.output_path_for_tex)
+
+    def _extract_zip(self, f: Any) -> None:
+        f.seek(0)
+        with zipfile.ZipFile(f) as z:
+            z.extractall(self.output_path_for_tex)
@@ -0,0 +1,418 @@
+import asyncio
+import hashlib
+import itertools
+import logging
+import pathlib
+import random
+import sqlite3
+import threading
+import time
+import weakref
+from collections import defaultdict
+from typing import Any, Callable, Final, TypeVar
+
+import openai
+from langchain.chat_models import ChatOpenAI
+from langchain.embeddings.openai import OpenAIEmbeddings
+
+from src.domain.rate_limit_dto import RateLimitDTO
+
+logger: Final = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Limits of the lowest paid tier of OpenAI. Raise them for higher tiers.
+DEFAULT_RATE_LIMITS: Final = {
+    "gpt-3.5-turbo": RateLimitDTO(requests_per_minute=3500, tokens_per_minute=60_000),
+    "gpt-4": RateLimitDTO(requests_per_minute=500, tokens_per_minute=10_000),
+    "text-embedding-ada-002": RateLimitDTO(
+        requests_per_minute=3000, tokens_per_minute=1_000_000
+    ),
+}
+FALLBACK_RATE_LIMIT: Final = RateLimitDTO(
+    requests_per_minute=500, tokens_per_minute=10_000
+)
+# OpenAI estimates the tokens of a request from its characters before counting
+# them, so do we.
+CHARS_PER_TOKEN: Final = 4
+DEFAULT_COMPLETION_TOKENS: Final = 256
+
+OpenAIModel = TypeVar("OpenAIModel", ChatOpenAI, OpenAIEmbeddings)
+
+
+class OpenAIRateLimiter:
+    """Token-bucket rate limiter of OpenAI API calls, shared across processes.
+
+    Each pair of an API key and a model has a bucket of requests and a bucket of
+    tokens, which are refilled continuously up to the limits per minute. A call
+    takes a request and its estimated tokens from the buckets, or waits until they
+    are refilled. The buckets are stored in SQLite, so all gunicorn workers share
+    the budgets of an API key. Calls of an API key in a process wait in the order
+    of arrival, so a burst of one request cannot starve the others.
+
+    When the API returns 429 anyway, e.g. the key is also used elsewhere, the
+    bucket is blocked for all processes until the `Retry-After`, instead of every
+    waiting call retrying on its own.
+
+    Args:
+        database_path (pathlib.Path): path to the SQLite database of the buckets
+        rate_limits (dict[str, RateLimitDTO] | None, optional): limits by model.
+            Defaults to `DEFAULT_RATE_LIMITS`.
+        fallback_rate_limit (RateLimitDTO, optional): limit of the other models.
+            Defaults to `FALLBACK_RATE_LIMIT`.
+
+    """
+
+    def __init__(
+        self,
+        database_path: pathlib.Path,
+        rate_limits: dict[str, RateLimitDTO] | None = None,
+        fallback_rate_limit: RateLimitDTO = FALLBACK_RATE_LIMIT,
+    ) -> None:
+        self.rate_limits = (
+            rate_limits if rate_limits is not None else DEFAULT_RATE_LIMITS
+        )
+        self.fallback_rate_limit = fallback_rate_limit
+        self.lock = threading.Lock()
+        self.thread_locks: defaultdict[str, threading.Lock] = defaultdict(
+            threading.Lock
+        )
+        # Async locks belong to an event loop, e.g. a new one of each
+        # `asyncio.run`, so they are kept per loop.
+        self.async_locks: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, defaultdict[str, asyncio.Lock]
+        ] = weakref.WeakKeyDictionary()
+        database_path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(
+            str(database_path),
+            check_same_thread=False,
+            isolation_level=None,
+            timeout=30.0,
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "key TEXT PRIMARY KEY, requests REAL NOT NULL, tokens REAL NOT NULL, "
+            "updated_at REAL NOT NULL, blocked_until REAL NOT NULL)"
+        )
+
+    def get_rate_limit(self, model_name: str) -> RateLimitDTO:
+        """Get the limit of the model.
+
+        Snapshot names such as `gpt-4-0613` share the limit of their base model.
+        """
+        for name in sorted(self.rate_limits, key=len, reverse=True):
+            if model_name.startswith(name):
+                return self.rate_limits[name]
+        return self.fallback_rate_limit
+
+    @staticmethod
+    def make_key(api_key: str | None, model_name: str) -> str:
+        """Make the key of the bucket without storing the API key itself."""
+        digest = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+        return f"{digest}:{model_name}"
+
+    def acquire(self, api_key: str | None, model_name: str, num_tokens: int) -> None:
+        """Wait until the call can be sent.
+
+        Args:
+            api_key (str | None): API key of the call
+            model_name (str): model of the call
+            num_tokens (int): estimated number of tokens of the call
+        """
+        key = self.make_key(api_key, model_name)
+        with self.thread_locks[key]:
+            while (wait_seconds := self._try_acquire(key, model_name, num_tokens)) > 0:
+                time.sleep(wait_seconds)
+
+    async def aacquire(
+        self, api_key: str | None, model_name: str, num_tokens: int
+    ) -> None:
+        """Wait until the call can be sent without blocking the event loop.
+
+        Args:
+            api_key (str | None): API key of the call
+            model_name (str): model of the call
+            num_tokens (int): estimated number of tokens of the call
+        """
+        key = self.make_key(api_key, model_name)
+        loop = asyncio.get_running_loop()
+        if loop not in self.async_locks:
+            self.async_locks[loop] = defaultdict(asyncio.Lock)
+        async with self.async_locks[loop][key]:
+            while (
+                wait_seconds := await asyncio.to_thread(
+                    self._try_acquire, key, model_name, num_tokens
+                )
+            ) > 0:
+                await asyncio.sleep(wait_seconds)
+
+    def refund(self, api_key: str | None, model_name: str, num_tokens: int) -> None:
+        """Return the tokens overestimated by a call, or take the underestimated
+        ones if negative.
+
+        Args:
+            api_key (str | None): API key of the call
+            model_name (str): model of the call
+            num_tokens (int): estimated minus actual number of tokens
+        """
+        key = self.make_key(api_key, model_name)
+        self._update(
+            key, model_name, lambda requests, tokens: (requests, tokens + num_tokens)
+        )
+
+    def block(self, api_key: str | None, model_name: str, seconds: float) -> None:
+        """Block the calls of the bucket in all processes.
+
+        Args:
+            api_key (str | None): API key of the calls
+            model_name (str): model of the calls
+            seconds (float): seconds to block
+        """
+        key = self.make_key(api_key, model_name)
+        logger.warning(f"Rate limited by OpenAI. Blocking `{key}` for {seconds:.1f} s.")
+        self._update(
+            key,
+            model_name,
+            lambda requests, tokens: (requests, tokens),
+            time.time() + seconds,
+        )
+
+    def _try_acquire(self, key: str, model_name: str, num_tokens: int) -> float:
+        """Take a request and tokens from the buckets if available.
+
+        Returns:
+            float: 0 if taken, or seconds to wait before trying again
+        """
+        rate_limit = self.get_rate_limit(model_name)
+        # A call larger than the bucket would wait forever, so it waits for a
+        # full bucket instead.
+        num_tokens = min(num_tokens, int(rate_limit.tokens_per_minute))
+        wait_seconds = 0.0
+
+        def take(requests: float, tokens: float) -> tuple[float, float]:
+            nonlocal wait_seconds
+            if requests >= 1 and tokens >= num_tokens:
+                return requests - 1, tokens - num_tokens
+            wait_seconds = max(
+                (1 - requests) * 60 / rate_limit.requests_per_minute,
+                (num_tokens - tokens) * 60 / rate_limit.tokens_per_minute,
+            )
+            return requests, tokens
+
+        blocked_seconds = self._update(key, model_name, take)
+        return blocked_seconds if blocked_seconds > 0 else wait_seconds
+
+    def _update(
+        self,
+        key: str,
+        model_name: str,
+        update: Callable[[float, float], tuple[float, float]],
+        blocked_until: float | None = None,
+    ) -> float:
+        """Refill the buckets and update them atomically across processes.
+
+        Args:
+            key (str): key of the bucket
+            model_name (str): model of the bucket
+            update (Callable[[float, float], tuple[float, float]]): function from
+                the available requests and tokens to the updated ones. It is not
+                called while the bucket is blocked.
+            blocked_until (float | None, optional): time until which the bucket is
+                blocked. Defaults to None.
+
+        Returns:
+            float: seconds until the bucket is unblocked, or 0 if not blocked
+        """
+        rate_limit = self.get_rate_limit(model_name)
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self.connection.execute(
+                    "SELECT requests, tokens, updated_at, blocked_until "
+                    "FROM buckets WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if row is None:
+                    row = (
+                        rate_limit.requests_per_minute,
+                        rate_limit.tokens_per_minute,
+                        now,
+                        0.0,
+                    )
+                requests, tokens, updated_at, current_blocked_until = row
+                elapsed_minutes = max(0.0, now - updated_at) / 60
+                requests = min(
+                    rate_limit.requests_per_minute,
+                    requests + elapsed_minutes * rate_limit.requests_per_minute,
+                )
+                tokens = min(
+                    rate_limit.tokens_per_minute,
+                    tokens + elapsed_minutes * rate_limit.tokens_per_minute,
+                )
+                if blocked_until is not None:
+                    current_blocked_until = max(current_blocked_until, blocked_until)
+                if now >= current_blocked_until:
+                    requests, tokens = update(requests, tokens)
+                    tokens = min(rate_limit.tokens_per_minute, tokens)
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO buckets "
+                    "(key, requests, tokens, updated_at, blocked_until) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, requests, tokens, now, current_blocked_until),
+                )
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        return max(0.0, float(current_blocked_until) - now)
+
+
+class RateLimitedOpenAIClient:
+    """Client of an OpenAI API resource which waits for the rate limiter and
+    retries failed calls with exponential backoff and jitter.
+
+    It replaces `openai.ChatCompletion` or `openai.Embedding` as the `client` of
+    langchain models, whose own retries should be disabled by `max_retries=1`.
+
+    Args:
+        resource (Any): OpenAI API resource, e.g. `openai.ChatCompletion`
+        rate_limiter (OpenAIRateLimiter): rate limiter shared by the clients
+        max_retries (int, optional): maximum number of retries. Defaults to 6.
+        initial_backoff_seconds (float, optional): first backoff.
+            Defaults to 1.0.
+        max_backoff_seconds (float, optional): maximum backoff. Defaults to 60.0.
+
+    """
+
+    def __init__(
+        self,
+        resource: Any,
+        rate_limiter: OpenAIRateLimiter,
+        max_retries: int = 6,
+        initial_backoff_seconds: float = 1.0,
+        max_backoff_seconds: float = 60.0,
+    ) -> None:
+        self.resource = resource
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.initial_backoff_seconds = initial_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+
+    def create(self, **kwargs: Any) -> Any:
+        """Call the API after waiting for the rate limiter, retrying failures."""
+        api_key, model_name, num_tokens = self._describe(kwargs)
+        for attempt in itertools.count():
+            self.rate_limiter.acquire(api_key, model_name, num_tokens)
+            try:
+                response = self.resource.create(**kwargs)
+            except Exception as e:
+                time.sleep(self._handle_error(e, attempt, api_key, model_name))
+                continue
+            self._refund(response, api_key, model_name, num_tokens)
+            return response
+
+    async def acreate(self, **kwargs: Any) -> Any:
+        """Call the API asynchronously after waiting for the rate limiter,
+        retrying failures."""
+        api_key, model_name, num_tokens = self._describe(kwargs)
+        for attempt in itertools.count():
+            await self.rate_limiter.aacquire(api_key, model_name, num_tokens)
+            try:
+                response = await self.resource.acreate(**kwargs)
+            except Exception as e:
+                # Blocking the bucket writes to the database, so it runs in a thread
+                # as well as acquiring.
+                await asyncio.sleep(
+                    await asyncio.to_thread(
+                        self._handle_error, e, attempt, api_key, model_name
+                    )
+                )
+                continue
+            await asyncio.to_thread(
+                self._refund, response, api_key, model_name, num_tokens
+            )
+            return response
+
+    def _describe(self, kwargs: dict[str, Any]) -> tuple[str | None, str, int]:
+        """Get the API key, the model and the estimated tokens of the call."""
+        api_key = kwargs.get("api_key") or openai.api_key
+        model_name = str(kwargs.get("model") or kwargs.get("engine") or "")
+        if "messages" in kwargs:
+            num_chars = sum(
+                len(str(message.get("content") or "")) for message in kwargs["messages"]
+            )
+            num_tokens = num_chars // CHARS_PER_TOKEN + (
+                kwargs.get("max_tokens") or DEFAULT_COMPLETION_TOKENS
+            )
+        else:
+            # Inputs of embeddings are texts or token ids.
+            inputs = kwargs.get("input", [])
+            if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+                inputs = [inputs]
+            num_tokens = sum(
+                len(each) // CHARS_PER_TOKEN if isinstance(each, str) else len(each)
+                for each in inputs
+            )
+        return api_key, model_name, num_tokens
+
+    def _refund(
+        self, response: Any, api_key: str | None, model_name: str, num_tokens: int
+    ) -> None:
+        """Correct the estimated tokens by the actual usage of the response."""
+        usage = response.get("usage") if hasattr(response, "get") else None
+        if usage is not None and "total_tokens" in usage:
+            self.rate_limiter.refund(
+                api_key, model_name, num_tokens - int(usage["total_tokens"])
+            )
+
+    def _handle_error(
+        self, error: Exception, attempt: int, api_key: str | None, model_name: str
+    ) -> float:
+        """Raise the error if it is not retryable, or get the seconds to wait.
+
+        Rate limit errors block the bucket in all processes until the
+        `Retry-After` of the response.
+        """
+        retryable_errors = (
+            openai.error.RateLimitError,
+            openai.error.Timeout,
+            openai.error.APIConnectionError,
+            openai.error.ServiceUnavailableError,
+            openai.error.APIError,
+        )
+        if not isinstance(error, retryable_errors) or attempt >= self.max_retries:
+            raise error
+
+        backoff_seconds = min(
+            self.max_backoff_seconds, self.initial_backoff_seconds * 2**attempt
+        )
+        backoff_seconds = random.uniform(backoff_seconds / 2, backoff_seconds)
+        if isinstance(error, openai.error.RateLimitError):
+            retry_after = (getattr(error, "headers", None) or dict()).get("retry-after")
+            if retry_after is not None:
+                backoff_seconds = max(backoff_seconds, float(retry_after))
+            self.rate_limiter.block(api_key, model_name, backoff_seconds)
+        logger.warning(
+            f"OpenAI call failed with `{type(error).__name__}`. Retrying in "
+            f"{backoff_seconds:.1f} s ({attempt + 1}/{self.max_retries})."
+        )
+        return backoff_seconds
+
+
+def apply_rate_limiter(
+    model: OpenAIModel, rate_limiter: OpenAIRateLimiter
+) -> OpenAIModel:
+    """Make the OpenAI model of langchain call the API through the rate limiter.
+
+    Args:
+        model (OpenAIModel): chat or embedding model of OpenAI
+        rate_limiter (OpenAIRateLimiter): rate limiter shared by the models
+
+    Returns:
+        OpenAIModel: the model itself
+    """
+    model.client = RateLimitedOpenAIClient(model.client, rate_limiter)
+    # The client retries on its own, so the retries of langchain are disabled.
+    model.max_retries = 1
+    return model
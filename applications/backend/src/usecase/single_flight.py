@@ -0,0 +1,128 @@
+import asyncio
+import contextlib
+import fcntl
+import logging
+import os
+import pathlib
+import random
+from typing import AsyncIterator, Awaitable, Callable, Final, TypeVar
+
+from src.usecase.metrics import SINGLE_FLIGHT_CALLS
+
+logger: Final = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+DEFAULT_INITIAL_POLL_INTERVAL_SECONDS: Final = 0.05
+DEFAULT_MAX_POLL_INTERVAL_SECONDS: Final = 1.0
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Coalescer of duplicate calls of the same key in flight.
+
+    Within a process, the first call of a key becomes the leader and runs the
+    function, and calls of the key made while it is in flight wait for and share
+    its result. Across processes, e.g. gunicorn workers, leaders of the same key
+    take turns by an exclusive lock of a file under `lock_dir`. The function
+    should look up its result in a shared storage first, so a leader which waited
+    for another process reuses the stored result.
+
+    Only results are shared. If the leader fails or is cancelled, e.g. by the
+    invalid API key of its request, the waiting calls retry by themselves.
+
+    Args:
+        lock_dir (pathlib.Path | None, optional): directory of the lock files to
+            coalesce calls across processes. Only within the process if None.
+            Defaults to None.
+        initial_poll_interval_seconds (float, optional): first interval to poll
+            the lock file held by another process. Defaults to 0.05.
+        max_poll_interval_seconds (float, optional): maximum interval to poll the
+            lock file. The interval doubles up to it. Defaults to 1.0.
+
+    """
+
+    def __init__(
+        self,
+        lock_dir: pathlib.Path | None = None,
+        initial_poll_interval_seconds: float = DEFAULT_INITIAL_POLL_INTERVAL_SECONDS,
+        max_poll_interval_seconds: float = DEFAULT_MAX_POLL_INTERVAL_SECONDS,
+    ) -> None:
+        self.lock_dir = lock_dir
+        self.initial_poll_interval_seconds = initial_poll_interval_seconds
+        self.max_poll_interval_seconds = max_poll_interval_seconds
+        self.in_flight: dict[str, asyncio.Future] = dict()
+        if lock_dir is not None:
+            lock_dir.mkdir(parents=True, exist_ok=True)
+
+    async def run(
+        self, name: str, key: str, function: Callable[[], Awaitable[T]]
+    ) -> tuple[T, bool]:
+        """Run the function unless a call of the same key is in flight.
+
+        Args:
+            name (str): name of the kind of calls, e.g. `parse`
+            key (str): key of the call, e.g. the content hash of the paper. It
+                must be usable as a filename.
+            function (Callable[[], Awaitable[T]]): function to run
+
+        Returns:
+            tuple[T, bool]: the result, and whether it is shared by another call
+        """
+        flight_key = f"{name}_{key}"
+        while (leader := self.in_flight.get(flight_key)) is not None:
+            SINGLE_FLIGHT_CALLS.inc(1.0, flight=name, role="follower")
+            logger.info(f"Waiting for `{flight_key}` in flight.")
+            # Unlike awaiting the future, waiting does not raise if it is cancelled.
+            await asyncio.wait([leader])
+            if not leader.cancelled():
+                return leader.result(), True
+
+        SINGLE_FLIGHT_CALLS.inc(1.0, flight=name, role="leader")
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[flight_key] = future
+        try:
+            async with self._alock_file(flight_key):
+                result = await function()
+        except BaseException:
+            # Cancel instead of setting the exception, so the waiting calls retry
+            # and no exception is left unretrieved when nobody waits.
+            future.cancel()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self.in_flight[flight_key]
+
+    @contextlib.asynccontextmanager
+    async def _alock_file(self, flight_key: str) -> AsyncIterator[None]:
+        """Hold the exclusive lock of the file of the key.
+
+        The lock is polled instead of blocking a worker thread, since the holder
+        may run for minutes. It is released when the file is closed, even if the
+        process dies.
+
+        Args:
+            flight_key (str): key of the call with its name
+        """
+        if self.lock_dir is None:
+            yield
+            return
+
+        # Lock files are left, since removing one races with its other holders.
+        fd = os.open(self.lock_dir / f"{flight_key}.lock", os.O_RDWR | os.O_CREAT)
+        try:
+            poll_interval = self.initial_poll_interval_seconds
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    await asyncio.sleep(random.uniform(0.5, 1.0) * poll_interval)
+                    poll_interval = min(
+                        2 * poll_interval, self.max_poll_interval_seconds
+                    )
+            yield
+        finally:
+            os.close(fd)
@@ -1,3 +1,4 @@
 # flake8: noqa
 from .base_summarizer import BaseSummarizer
+from .context_packer import ContextPacker
 from .ochiai_format_summarizer import OchiaiFormatSummarizer
@@ -1,11 +1,97 @@
+import asyncio
+import functools
 import pathlib
 from abc import ABC
+from typing import Any, Awaitable, Callable, Final, cast
 
+import numpy as np
 from jinja2 import Environment, FileSystemLoader
 from langchain.base_language import BaseLanguageModel
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.chains.base import Chain
+from langchain.docstore.document import Document
+from langchain.schema import LLMResult
 from langchain.vectorstores.base import VectorStore
 
 from src.domain.paper_format_dto import SummaryFormat
+from src.usecase.completion_cache import CompletionCache, use_completion_cache
+from src.usecase.metrics import LLM_CHAIN_DURATION, LLM_CHAIN_ERRORS, LLM_TOKENS, track
+from src.usecase.summarizer.context_packer import ContextPacker
+
+PROMPT_TEMPLATE_DIR_PATH: Final = pathlib.Path("./src/domain/prompts")
+
+
+@functools.lru_cache(maxsize=None)
+def get_template_env(prompt_template_dir_path: pathlib.Path) -> Environment:
+    """Get the jinja2 environment of the prompt templates, shared in the process.
+
+    The environment keeps compiled templates, so each template is compiled once
+    instead of once per summarizer.
+
+    Args:
+        prompt_template_dir_path (pathlib.Path): path to prompt template directory
+
+    Returns:
+        Environment: environment which loads templates from the directory
+    """
+    return Environment(loader=FileSystemLoader(str(prompt_template_dir_path)))
+
+
+class TokenUsageCallbackHandler(BaseCallbackHandler):
+    """Callback handler which counts tokens used by the LLM calls of a chain.
+
+    Cached completions have no token usage, so only tokens actually sent to the
+    API are counted.
+
+    Args:
+        chain_name (str): name of the chain used as the label of the metrics
+
+    """
+
+    # Counting is cheap, so it does not need an executor in async chains.
+    run_inline = True
+
+    def __init__(self, chain_name: str) -> None:
+        self.chain_name = chain_name
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        """Count the tokens of the response."""
+        llm_output = response.llm_output or dict()
+        token_usage = llm_output.get("token_usage", dict())
+        model_name = str(llm_output.get("model_name", "unknown"))
+        for kind in ("prompt", "completion"):
+            num_tokens = token_usage.get(f"{kind}_tokens", 0)
+            if num_tokens:
+                LLM_TOKENS.inc(
+                    num_tokens, model=model_name, chain=self.chain_name, kind=kind
+                )
+
+
+class TokenStreamCallbackHandler(BaseCallbackHandler):
+    """Callback handler which passes tokens generated by the LLM calls of a chain
+    to a callback as they are generated.
+
+    The LLM must be created with `streaming=True`. Cached completions are not
+    generated, so they have no tokens.
+
+    Args:
+        chain_name (str): name of the chain passed to the callback
+        on_token (Callable[[str, str], None]): callback called with the name of
+            the chain and each token
+
+    """
+
+    # Tokens are passed to the callback in order, and in the event loop of async
+    # chains.
+    run_inline = True
+
+    def __init__(self, chain_name: str, on_token: Callable[[str, str], None]) -> None:
+        self.chain_name = chain_name
+        self.on_token = on_token
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        """Pass the token to the callback."""
+        self.on_token(self.chain_name, token)
 
 
 class BaseSummarizer(ABC):
@@ -13,22 +99,136 @@ class BaseSummarizer(ABC):
 
     Args:
         llm_model (BaseLanguageModel): language model to use
-        vectorstore (dict[str, VectorStore]): vectorstore to use
+        vectorstore (VectorStore): vectorstore to use
         prompt_template_dir_path (pathlib.Path): path to prompt template directory
+        query_embedder (Callable[[list[str]], np.ndarray] | None, optional):
+            function to embed retrieval queries at once. If None, each query is
+            embedded by the embedding function of the vectorstore.
+            Defaults to None.
+        completion_cache (CompletionCache | None, optional): cache of completions
+            of the language model. Completions are not cached if None.
+            Defaults to None.
+        context_packer (ContextPacker | None, optional): packer of retrieved
+            documents into the token budget of each prompt. Documents are stuffed
+            as they are if None. Defaults to None.
+        on_field (Callable[[str, str], None] | None, optional): callback called
+            with the name and the text of each field of the summary when it is
+            generated. Defaults to None.
+        on_token (Callable[[str, str], None] | None, optional): callback called
+            with the name of the chain and each token generated by the LLM, which
+            must be created with `streaming=True`. Defaults to None.
 
     """
 
     def __init__(
         self,
         llm_model: BaseLanguageModel,
-        vectorstore: dict[str, VectorStore],
+        vectorstore: VectorStore,
         prompt_template_dir_path: pathlib.Path,
+        query_embedder: Callable[[list[str]], np.ndarray] | None = None,
+        completion_cache: CompletionCache | None = None,
+        context_packer: ContextPacker | None = None,
+        on_field: Callable[[str, str], None] | None = None,
+        on_token: Callable[[str, str], None] | None = None,
     ) -> None:
         self.llm_model = llm_model
         self.vectorstore = vectorstore
-        self.template_env = Environment(
-            loader=FileSystemLoader(str(prompt_template_dir_path))
-        )
+        self.query_embedder = query_embedder
+        self.context_packer = context_packer
+        self.on_field = on_field
+        self.on_token = on_token
+        self.completion_cache = completion_cache
+        self.template_env = get_template_env(prompt_template_dir_path)
+
+        # The cache is used only in the runs of the chains of the summarizer.
+        if hasattr(self.llm_model, "cache"):
+            self.llm_model.cache = completion_cache is not None
 
     def summarize(self) -> SummaryFormat:
+        """Summarize paper.
+
+        `asummarize` is run in a new event loop, so this must not be called in a
+        running event loop.
+
+        Returns:
+            SummaryFormat: summarized paper
+        """
+        return asyncio.run(self.asummarize())
+
+    async def asummarize(self) -> SummaryFormat:
+        """Summarize paper asynchronously.
+
+        Subclasses implement this to run independent chains concurrently.
+
+        Returns:
+            SummaryFormat: summarized paper
+        """
         raise NotImplementedError
+
+    def _embed_queries(self, queries: list[str]) -> np.ndarray:
+        """Embed retrieval queries.
+
+        Args:
+            queries (list[str]): queries to embed
+
+        Returns:
+            np.ndarray: embeddings of the queries in shape (len(queries), dim)
+        """
+        if self.query_embedder is not None:
+            return self.query_embedder(queries)
+        embedding_function = getattr(self.vectorstore, "embedding_function")
+        return np.array([embedding_function(query) for query in queries])
+
+    async def _arun_chain(self, chain_name: str, chain: Chain, inputs: Any) -> str:
+        """Run the chain asynchronously and record its metrics.
+
+        Args:
+            chain_name (str): name of the chain used as the label of the metrics
+            chain (Chain): chain to run
+            inputs (Any): inputs of the chain
+
+        Returns:
+            str: output of the chain
+        """
+        with track(
+            LLM_CHAIN_DURATION, LLM_CHAIN_ERRORS, chain=chain_name
+        ), use_completion_cache(self.completion_cache):
+            return cast(
+                str,
+                await chain.arun(inputs, callbacks=self._make_callbacks(chain_name)),
+            )
+
+    def _make_callbacks(self, chain_name: str) -> list[BaseCallbackHandler]:
+        """Make the callback handlers of a run of the chain."""
+        callbacks: list[BaseCallbackHandler] = [TokenUsageCallbackHandler(chain_name)]
+        if self.on_token is not None:
+            callbacks.append(TokenStreamCallbackHandler(chain_name, self.on_token))
+        return callbacks
+
+    async def _anotify_field(self, field: str, text: Awaitable[str]) -> str:
+        """Wait for the text of a field and pass it to `on_field`.
+
+        Args:
+            field (str): name of the field of the summary
+            text (Awaitable[str]): coroutine which generates the text
+
+        Returns:
+            str: text of the field
+        """
+        result = await text
+        if self.on_field is not None:
+            self.on_field(field, result)
+        return result
+
+    def _pack_documents(self, documents: list[Document]) -> list[Document]:
+        """Pack retrieved documents into the token budget of a prompt.
+
+        Args:
+            documents (list[Document]): documents in the order of relevance
+
+        Returns:
+            list[Document]: documents to stuff into the prompt
+        """
+        if self.context_packer is None:
+            return documents
+        return self.context_packer.pack(documents)
@@ -0,0 +1,129 @@
+import logging
+from typing import Final
+
+from langchain.docstore.document import Document
+
+from src.usecase.text_chunker import get_encoding
+
+logger: Final = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+DEFAULT_TOKEN_BUDGET: Final = 1200
+# Shorter overlaps are likely to be coincidences.
+MIN_OVERLAP_LENGTH: Final = 8
+
+
+class ContextPacker:
+    """Packer of retrieved documents into a token budget.
+
+    Retrieved chunks often duplicate or overlap each other, since neighboring
+    chunks of a section share `chunk_overlap` tokens. The packer drops duplicates,
+    merges chunks of the same section with consecutive `chunk_id` in the metadata,
+    i.e. indices in the vectorstore, into one passage without repeating the
+    overlap, and keeps passages in the order of relevance while they fit in
+    the budget, so the prompt never overflows the context window.
+
+    Args:
+        model_name (str): name of the model to count tokens for
+        token_budget (int, optional): maximum number of tokens of the packed
+            documents for each prompt. Defaults to 1200.
+
+    """
+
+    def __init__(self, model_name: str, token_budget: int = DEFAULT_TOKEN_BUDGET):
+        self.encoding = get_encoding(model_name)
+        self.token_budget = token_budget
+
+    def pack(self, documents: list[Document]) -> list[Document]:
+        """Pack documents into the token budget.
+
+        Args:
+            documents (list[Document]): documents in the order of relevance
+
+        Returns:
+            list[Document]: packed documents in the order of relevance
+        """
+        passages = self._merge_adjacent(self._deduplicate(documents))
+
+        packed = []
+        num_tokens = 0
+        for passage in passages:
+            tokens = self.encoding.encode_ordinary(passage.page_content)
+            if num_tokens + len(tokens) <= self.token_budget:
+                packed.append(passage)
+                num_tokens += len(tokens)
+            elif not packed:
+                # Truncate the most relevant passage rather than return nothing.
+                packed.append(
+                    Document(
+                        page_content=self.encoding.decode(tokens[: self.token_budget]),
+                        metadata=passage.metadata,
+                    )
+                )
+                num_tokens = self.token_budget
+
+        logger.info(
+            f"Packed {len(documents)} documents into {len(packed)} passages of "
+            f"{num_tokens} tokens."
+        )
+        return packed
+
+    def _deduplicate(self, documents: list[Document]) -> list[Document]:
+        """Drop documents whose text is contained in a more relevant one."""
+        unique: list[Document] = []
+        for document in documents:
+            if not any(document.page_content in each.page_content for each in unique):
+                unique.append(document)
+        return unique
+
+    def _merge_adjacent(self, documents: list[Document]) -> list[Document]:
+        """Merge documents of consecutive chunks in the same section.
+
+        A merged passage takes the position of its most relevant chunk.
+        """
+        positions: dict[tuple[str, int], int] = dict()
+        for i, document in enumerate(documents):
+            chunk_id = document.metadata.get("chunk_id")
+            if chunk_id is not None:
+                positions[(document.metadata.get("section_id", ""), chunk_id)] = i
+
+        merged: list[Document] = []
+        visited: set[int] = set()
+        for i, document in enumerate(documents):
+            if i in visited:
+                continue
+            chunk_id = document.metadata.get("chunk_id")
+            if chunk_id is None:
+                merged.append(document)
+                continue
+
+            # Extend the run of consecutive chunks in both directions.
+            section_id = document.metadata.get("section_id", "")
+            first = last = chunk_id
+            while (section_id, first - 1) in positions:
+                first -= 1
+            while (section_id, last + 1) in positions:
+                last += 1
+            run = [positions[(section_id, j)] for j in range(first, last + 1)]
+            visited.update(run)
+
+            text = documents[run[0]].page_content
+            for j in run[1:]:
+                text = _concatenate_overlapping(text, documents[j].page_content)
+            merged.append(
+                Document(
+                    page_content=text,
+                    metadata={**documents[run[0]].metadata, "num_chunks": len(run)},
+                )
+            )
+        return merged
+
+
+def _concatenate_overlapping(former: str, latter: str) -> str:
+    """Concatenate texts, removing the longest suffix of `former` which is also a
+    prefix of `latter`."""
+    for length in range(min(len(former), len(latter)), MIN_OVERLAP_LENGTH - 1, -1):
+        if former.endswith(latter[:length]):
+            return former + latter[length:]
+    # Chunks split without overlap are contiguous.
+    return former + latter
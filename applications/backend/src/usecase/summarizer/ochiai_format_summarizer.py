@@ -1,7 +1,9 @@
+import asyncio
 import logging
 import pathlib
-from typing import Dict, Final, cast
+from typing import Any, Callable, Final
 
+import numpy as np
 from langchain.base_language import BaseLanguageModel
 from langchain.chains import LLMChain
 from langchain.chains.combine_documents.stuff import StuffDocumentsChain
@@ -10,36 +12,80 @@ from langchain.prompts import PromptTemplate
 from langchain.vectorstores.base import VectorStore
 
 from src.domain.paper_format_dto import FormatOchiaiDTO
-from src.usecase.summarizer import BaseSummarizer
+from src.usecase.completion_cache import CompletionCache
+from src.usecase.metrics import track_stage
+from src.usecase.summarizer.base_summarizer import BaseSummarizer
+from src.usecase.summarizer.context_packer import ContextPacker
+from src.usecase.vectorstore import PaperVectorStore
 
 logger: Final = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+OUTLINE_QUERIES: Final = ["Proposed method", "Experiments", "Results"]
+CONTRIBUTION_QUERY: Final = "The contribution of this study"
+PROBLEM_QUERY: Final = "The problems with previous studies"
+METHOD_QUERY: Final = "The proposed method and dataset in this study"
+EVALUATION_QUERY: Final = "The experiments conducted in this study and their evaluation"
+DISCUSSION_QUERY: Final = "The authors' analysis and future prospects based on the results of the evaluation of this study"
+SECTION_QUERIES: Final = [
+    CONTRIBUTION_QUERY,
+    PROBLEM_QUERY,
+    METHOD_QUERY,
+    EVALUATION_QUERY,
+    DISCUSSION_QUERY,
+]
+
 
 class OchiaiFormatSummarizer(BaseSummarizer):
     """Summarizer for Ochiai format.
 
     Args:
         llm_model (BaseLanguageModel): language model to use
-        vectorstore (dict[str, VectorStore]): vectorstore to use
+        vectorstore (VectorStore): vectorstore to use
         prompt_template_dir_path (pathlib.Path): path to prompt template directory
+        query_embedder (Callable[[list[str]], np.ndarray] | None, optional):
+            function to embed retrieval queries. Defaults to None.
+        completion_cache (CompletionCache | None, optional): cache of completions
+            of the language model. Defaults to None.
+        context_packer (ContextPacker | None, optional): packer of retrieved
+            documents into the token budget of each prompt. Defaults to None.
+        on_field (Callable[[str, str], None] | None, optional): callback called
+            with the name and the text of each field when it is generated.
+            Defaults to None.
+        on_token (Callable[[str, str], None] | None, optional): callback called
+            with the name of the chain and each generated token. Defaults to None.
 
     """
 
     def __init__(
         self,
         llm_model: BaseLanguageModel,
-        vectorstore: dict[str, VectorStore],
+        vectorstore: VectorStore,
         prompt_template_dir_path: pathlib.Path,
+        query_embedder: Callable[[list[str]], np.ndarray] | None = None,
+        completion_cache: CompletionCache | None = None,
+        context_packer: ContextPacker | None = None,
+        on_field: Callable[[str, str], None] | None = None,
+        on_token: Callable[[str, str], None] | None = None,
     ) -> None:
         super().__init__(
             llm_model=llm_model,
             vectorstore=vectorstore,
             prompt_template_dir_path=prompt_template_dir_path,
+            query_embedder=query_embedder,
+            completion_cache=completion_cache,
+            context_packer=context_packer,
+            on_field=on_field,
+            on_token=on_token,
         )
 
-    def summarize(self, verbose: bool = True) -> FormatOchiaiDTO:
-        """Summarize paper in Ochiai format.
+    async def asummarize(self, verbose: bool = True) -> FormatOchiaiDTO:
+        """Summarize paper in Ochiai format concurrently.
+
+        All chains are independent except the combination chain of the
+        contribution, which waits for the contribution and problem chains. So the
+        latency is about two LLM calls instead of seven. Each field is passed to
+        `on_field` as soon as it is generated.
 
         Args:
             verbose (bool, optional): whether to print logs. Defaults to True.
@@ -48,11 +94,25 @@ class OchiaiFormatSummarizer(BaseSummarizer):
             FormatOchiaiDTO: summarized paper in Ochiai format
 
         """
-        outline = self._summarize_outline(verbose=verbose)
-        contribution = self._summarize_contribution(verbose=verbose)
-        method = self._summarize_method(verbose=verbose)
-        evaluation = self._summarize_evaluation(verbose=verbose)
-        discussion = self._summarize_discussion(verbose=verbose)
+        documents = await asyncio.to_thread(self._retrieve_documents)
+        outline, contribution, method, evaluation, discussion = await asyncio.gather(
+            self._anotify_field(
+                "outline", self._asummarize_outline(documents, verbose=verbose)
+            ),
+            self._anotify_field(
+                "contribution",
+                self._asummarize_contribution(documents, verbose=verbose),
+            ),
+            self._anotify_field(
+                "method", self._asummarize_method(documents, verbose=verbose)
+            ),
+            self._anotify_field(
+                "evaluation", self._asummarize_evaluation(documents, verbose=verbose)
+            ),
+            self._anotify_field(
+                "discussion", self._asummarize_discussion(documents, verbose=verbose)
+            ),
+        )
         return FormatOchiaiDTO(
             outline=outline,
             contribution=contribution,
@@ -61,133 +121,158 @@ class OchiaiFormatSummarizer(BaseSummarizer):
             discussion=discussion,
         )
 
-    def _summarize_outline(self, verbose: bool = True) -> str:
+    def _retrieve_documents(self) -> dict[str, list[Document]]:
+        """Retrieve documents for all queries by a single batched search.
+
+        Returns:
+            dict[str, list[Document]]: retrieved documents by query
+        """
+        if not isinstance(self.vectorstore, PaperVectorStore):
+            raise NotImplementedError(
+                "Implement the logic to retrieve documents for other vectorstores."
+            )
+
+        queries: Final = [*OUTLINE_QUERIES, *SECTION_QUERIES]
+        with track_stage("retrieval"):
+            results: Final = self.vectorstore.similarity_search_by_vectors(
+                self._embed_queries(queries),
+                k=[1] * len(OUTLINE_QUERIES) + [5] * len(SECTION_QUERIES),
+                filters=[_is_not_abstract] * len(OUTLINE_QUERIES)
+                + [None] * len(SECTION_QUERIES),
+            )
+        return dict(zip(queries, results))
+
+    async def _asummarize_outline(
+        self, documents: dict[str, list[Document]], verbose: bool = True
+    ) -> str:
         """`どんなもの？`"""
-        prompt_template: Final = self.template_env.get_template(
-            "outline_ja.jinja2"
-        ).render()
-        outline_prompt = PromptTemplate(
-            template=prompt_template, input_variables=["text"]
-        )
-        outline_chain = LLMChain(
-            llm=self.llm_model, prompt=outline_prompt, verbose=verbose
-        )
-        combine_document_chain = StuffDocumentsChain(
-            llm_chain=outline_chain,
-            document_variable_name="text",
+        combine_document_chain = self._build_combine_document_chain(
+            prompt_template_filename="outline_ja.jinja2",
+            prompt_input_variable="text",
             verbose=verbose,
         )
-
-        retriever = self.vectorstore["wo_abstract"].as_retriever(
-            serch_type="similarity",
-            search_kwargs={"k": 1},
+        return await self._arun_chain(
+            "outline_ja",
+            combine_document_chain,
+            self._select_outline_documents(documents),
         )
 
-        selected_documents = []
-        # Get top-k relevant documents
-        proposed_method: Final = retriever.get_relevant_documents("Proposed method")
-        experiments: Final = retriever.get_relevant_documents("Experiments")
-        resutls: Final = retriever.get_relevant_documents("Results")
-
-        abstract_document = self._get_abstract_from_vectorstore()
-        selected_documents.append(abstract_document)
-        selected_documents.extend(proposed_method)
-        selected_documents.extend(experiments)
-        selected_documents.extend(resutls)
-        return cast(str, combine_document_chain.run(selected_documents))
+    def _select_outline_documents(
+        self, documents: dict[str, list[Document]]
+    ) -> list[Document]:
+        """Select the abstract and the top-1 documents of the outline queries."""
+        selected_documents = [self._get_abstract_from_vectorstore()]
+        for query in OUTLINE_QUERIES:
+            selected_documents.extend(documents[query])
+        return self._pack_documents(selected_documents)
 
-    def _summarize_contribution(self, verbose: bool = True) -> str:
+    async def _asummarize_contribution(
+        self, documents: dict[str, list[Document]], verbose: bool = True
+    ) -> str:
         """`先行研究と比べてどこがすごい？`"""
-        contribution_query: Final = "The contribution of this study"
-        problem_query: Final = "The problems with previous studies"
-        contribution = self._run_combine_document_chain(
-            query=contribution_query,
-            prompt_template_filename="contribution_ja.jinja2",
-            prompt_input_variable="contribution_text",
-            verbose=verbose,
-        )
-        problem = self._run_combine_document_chain(
-            query=problem_query,
-            prompt_template_filename="problem_ja.jinja2",
-            prompt_input_variable="problem_text",
-            verbose=verbose,
+        contribution, problem = await asyncio.gather(
+            self._arun_combine_document_chain(
+                documents=documents[CONTRIBUTION_QUERY],
+                prompt_template_filename="contribution_ja.jinja2",
+                prompt_input_variable="contribution_text",
+                verbose=verbose,
+            ),
+            self._arun_combine_document_chain(
+                documents=documents[PROBLEM_QUERY],
+                prompt_template_filename="problem_ja.jinja2",
+                prompt_input_variable="problem_text",
+                verbose=verbose,
+            ),
         )
 
-        combine_template: Final = self.template_env.get_template(
-            "combination_ja.jinja2"
-        ).render()
-        overall_prompt = PromptTemplate(
-            input_variables=["contribution", "problem"],
-            template=combine_template,
-        )
-        overall_chain = LLMChain(
-            llm=self.llm_model, prompt=overall_prompt, verbose=verbose
-        )
-        return cast(
-            str,
-            overall_chain.run(
-                {
-                    "contribution": contribution,
-                    "problem": problem,
-                }
-            ),
+        overall_chain = self._build_combination_chain(verbose=verbose)
+        return await self._arun_chain(
+            "combination_ja",
+            overall_chain,
+            {
+                "contribution": contribution,
+                "problem": problem,
+            },
         )
 
-    def _summarize_method(self, verbose: bool = True) -> str:
+    async def _asummarize_method(
+        self, documents: dict[str, list[Document]], verbose: bool = True
+    ) -> str:
         """`技術や手法のキモはどこ？`"""
-        query: Final = "The proposed method and dataset in this study"
-
-        return self._run_combine_document_chain(
-            query=query,
+        return await self._arun_combine_document_chain(
+            documents=documents[METHOD_QUERY],
             prompt_template_filename="method_ja.jinja2",
             prompt_input_variable="text",
             verbose=verbose,
         )
 
-    def _summarize_evaluation(self, verbose: bool = True) -> str:
+    async def _asummarize_evaluation(
+        self, documents: dict[str, list[Document]], verbose: bool = True
+    ) -> str:
         """`どうやって有効だと検証した？`"""
-        query: Final = "The experiments conducted in this study and their evaluation"
-
-        return self._run_combine_document_chain(
-            query=query,
+        return await self._arun_combine_document_chain(
+            documents=documents[EVALUATION_QUERY],
             prompt_template_filename="evaluation_ja.jinja2",
             prompt_input_variable="text",
             verbose=verbose,
         )
 
-    def _summarize_discussion(self, verbose: bool = True) -> str:
+    async def _asummarize_discussion(
+        self, documents: dict[str, list[Document]], verbose: bool = True
+    ) -> str:
         """`議論はある？`"""
-        query: Final = "The authors' analysis and future prospects based on the results of the evaluation of this study"
-
-        return self._run_combine_document_chain(
-            query=query,
+        return await self._arun_combine_document_chain(
+            documents=documents[DISCUSSION_QUERY],
             prompt_template_filename="discussion_ja.jinja2",
             prompt_input_variable="text",
             verbose=verbose,
         )
 
-    def _run_combine_document_chain(
+    async def _arun_combine_document_chain(
         self,
-        query: str,
+        documents: list[Document],
         prompt_template_filename: str,
         prompt_input_variable: str,
-        search_type: str = "similarity",
-        search_kwargs: Dict = {"k": 5},
         verbose: bool = True,
     ) -> str:
-        """Run combine document chain.
+        """Run combine document chain asynchronously.
 
         Args:
-            query (str): query for vectorstore
+            documents (list[Document]): retrieved documents to stuff
             prompt_template_filename (str): template filename for prompt
             prompt_input_variable (str): input variable name for prompt
-            search_type (str, optional): search type for vectorstore. Defaults to "similarity".
-            search_kwargs (Dict, optional): search kwargs for vectorstore. Defaults to {"k": 5}.
             verbose (bool, optional): verbose. Defaults to True.
 
         Returns:
             str: summarized text
         """
+        combine_document_chain: Final = self._build_combine_document_chain(
+            prompt_template_filename=prompt_template_filename,
+            prompt_input_variable=prompt_input_variable,
+            verbose=verbose,
+        )
+        return await self._arun_chain(
+            pathlib.Path(prompt_template_filename).stem,
+            combine_document_chain,
+            self._pack_documents(documents),
+        )
+
+    def _build_combine_document_chain(
+        self,
+        prompt_template_filename: str,
+        prompt_input_variable: str,
+        verbose: bool = True,
+    ) -> StuffDocumentsChain:
+        """Build combine document chain.
+
+        Args:
+            prompt_template_filename (str): template filename for prompt
+            prompt_input_variable (str): input variable name for prompt
+            verbose (bool, optional): verbose. Defaults to True.
+
+        Returns:
+            StuffDocumentsChain: chain which stuffs documents into the prompt
+        """
         prompt_template: Final = self.template_env.get_template(
             prompt_template_filename
         ).render()
@@ -196,18 +281,29 @@ class OchiaiFormatSummarizer(BaseSummarizer):
         )
 
         chain: Final = LLMChain(llm=self.llm_model, prompt=prompt, verbose=verbose)
-        combine_document_chain: Final = StuffDocumentsChain(
+        return StuffDocumentsChain(
             llm_chain=chain,
             document_variable_name=prompt_input_variable,
             verbose=verbose,
         )
 
-        retriever = self.vectorstore["all"].as_retriever(
-            serch_type=search_type,
-            search_kwargs=search_kwargs,
+    def _build_combination_chain(self, verbose: bool = True) -> LLMChain:
+        """Build chain which combines the contribution and the problem.
+
+        Args:
+            verbose (bool, optional): verbose. Defaults to True.
+
+        Returns:
+            LLMChain: chain which combines the contribution and the problem
+        """
+        combine_template: Final = self.template_env.get_template(
+            "combination_ja.jinja2"
+        ).render()
+        overall_prompt = PromptTemplate(
+            input_variables=["contribution", "problem"],
+            template=combine_template,
         )
-        result: Final = retriever.get_relevant_documents(query)
-        return cast(str, combine_document_chain.run(result))
+        return LLMChain(llm=self.llm_model, prompt=overall_prompt, verbose=verbose)
 
     def _get_abstract_from_vectorstore(self) -> Document:
         """Get abstract from vectorstore.
@@ -215,11 +311,17 @@ class OchiaiFormatSummarizer(BaseSummarizer):
         Returns:
             Document: abstract document
         """
-        if self.vectorstore["all"].__class__.__name__ == "FAISS":
-            abstract_docstore_id = self.vectorstore["all"].index_to_docstore_id[0]  # type: ignore
-            abstract_document = self.vectorstore["all"].docstore.search(abstract_docstore_id)  # type: ignore
+        if isinstance(self.vectorstore, PaperVectorStore):
+            abstract_documents = self.vectorstore.get_documents_by_metadata(
+                {"section": "abstract"}
+            )
         else:
             raise NotImplementedError(
                 "Implement the logic to get abstract texts for other vectorstores."
             )
-        return abstract_document  # type: ignore
+        return abstract_documents[0]
+
+
+def _is_not_abstract(metadata: dict[str, Any]) -> bool:
+    """Filter for vectorstore to exclude the abstract."""
+    return bool(metadata.get("section") != "abstract")
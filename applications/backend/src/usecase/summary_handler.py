@@ -1,120 +1,414 @@
+import asyncio
+import functools
 import json
 import logging
 import pathlib
-from typing import Final, cast
+import time
+from typing import Callable, Final, cast
 
 from langchain.chat_models import ChatOpenAI
 from langchain.docstore.document import Document
-from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.text_splitter import TextSplitter, TokenTextSplitter
-from langchain.vectorstores import FAISS
+from langchain.embeddings.base import Embeddings
 
+from src.adapter.rdb_repository_gateway import RDBRepositoryGateway
+from src.domain.credentials_dto import CredentialsDTO, get_secret_value
 from src.domain.paper_format_dto import FORMAT_MAPPING, SummaryConfigDTO, SummaryFormat
-from src.domain.parsed_paper_dto import ParsedPaperDTO
-from src.usecase.summarizer import BaseSummarizer
+from src.domain.parsed_paper_dto import ParsedPaperDTO, SubsectionDTO
+from src.usecase.cache_key import make_cache_key
+from src.usecase.completion_cache import CompletionCache
+from src.usecase.embeddings import (
+    LOCAL_EMBEDDING_BACKENDS,
+    CachedEmbeddings,
+    EmbeddingCache,
+    QueryEmbeddingCache,
+    build_embeddings,
+)
+from src.usecase.http_clients import apply_pooled_session
+from src.usecase.metrics import count_cache_lookups, track_stage
+from src.usecase.rate_limiter import OpenAIRateLimiter, apply_rate_limiter
+from src.usecase.single_flight import SingleFlight
+from src.usecase.summarizer import BaseSummarizer, ContextPacker
+from src.usecase.summarizer.base_summarizer import PROMPT_TEMPLATE_DIR_PATH
+from src.usecase.text_chunker import TokenChunker
+from src.usecase.vectorstore import CorpusIndex, PaperVectorStore
 
 logger: Final = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
 
 class SummaryHandler:
-    """Handler for summarization."""
+    """Handler for summarization.
 
-    def __init__(self, summarizer: type[BaseSummarizer]) -> None:
+    Args:
+        summarizer (type[BaseSummarizer]): summarizer class to use
+        embedding_cache (EmbeddingCache | None, optional): cache consulted before
+            calling remote embedding backends. Defaults to None.
+        query_embedding_cache (QueryEmbeddingCache | None, optional): cache of the
+            embeddings of the retrieval queries of summarizers. Defaults to None.
+        completion_cache (CompletionCache | None, optional): cache of completions
+            of the language model, used if `cache_completions` of the config is
+            enabled, or by default if the temperature is 0. Defaults to None.
+        corpus_indices (dict[str, CorpusIndex] | None, optional): indices of the
+            chunks of all papers by embedding backend, to which the chunks of each
+            paper are added. Defaults to None.
+        rate_limiter (OpenAIRateLimiter | None, optional): rate limiter of the
+            calls to OpenAI shared by all requests. Defaults to None.
+        summary_repository (RDBRepositoryGateway | None, optional): repository
+            of summaries looked up by their key. Summaries are stored as JSON
+            files next to the pdf if None. Defaults to None.
+        single_flight (SingleFlight | None, optional): coalescer of the
+            summaries of the same key generated at once. Defaults to None.
+
+    """
+
+    def __init__(
+        self,
+        summarizer: type[BaseSummarizer],
+        embedding_cache: EmbeddingCache | None = None,
+        query_embedding_cache: QueryEmbeddingCache | None = None,
+        completion_cache: CompletionCache | None = None,
+        corpus_indices: dict[str, CorpusIndex] | None = None,
+        rate_limiter: OpenAIRateLimiter | None = None,
+        summary_repository: RDBRepositoryGateway | None = None,
+        single_flight: SingleFlight | None = None,
+    ) -> None:
         self.summarizer = summarizer
+        self.embedding_cache = embedding_cache
+        self.query_embedding_cache = query_embedding_cache
+        self.completion_cache = completion_cache
+        self.corpus_indices = corpus_indices
+        self.rate_limiter = rate_limiter
+        self.summary_repository = summary_repository
+        self.single_flight = single_flight
 
-    def make_summary(
+    async def make_summary(
         self,
         parsed_paper: ParsedPaperDTO,
         pdf_file_path: pathlib.Path,
         summary_config: SummaryConfigDTO,
+        credentials: CredentialsDTO | None = None,
+        on_field: Callable[[str, str], None] | None = None,
+        on_token: Callable[[str, str], None] | None = None,
     ) -> SummaryFormat:
         """Make a summary from the parsed pdf.
 
+        Blocking steps such as embedding run in worker threads and the chains of
+        the summarizer run concurrently, so the event loop is never blocked.
+
         Args:
             parsed_paper (ParsedPaperDTO): Parsed paper.
             pdf_file_path (pathlib.Path): Path to the pdf file.
             summary_config (SummaryConfigDTO): Summary configuration.
+            credentials (CredentialsDTO | None, optional): Credentials of OpenAI.
+                The environment variable is used if None. Defaults to None.
+            on_field (Callable[[str, str], None] | None, optional): Callback called
+                with the name and the text of each field of the summary when it
+                is generated, or loaded from the cache. Defaults to None.
+            on_token (Callable[[str, str], None] | None, optional): Callback called
+                with the name of the chain and each token generated by the LLM.
+                Completions are streamed from OpenAI if given. Defaults to None.
 
         Returns:
             SummaryFormat: Summary of the paper in the specific format.
         """
-        stem = str(pdf_file_path.stem)
-        summary_file_path = pdf_file_path.parent / (stem + "_summary.json")
+        # Artifacts are keyed by their inputs, so a config change only recomputes
+        # the stages it affects.
+        openai_api_key = get_secret_value(
+            (credentials or CredentialsDTO()).openai_api_key
+        )
+        embeddings, embedding_model_name = build_embeddings(
+            summary_config.embedding_backend, self.rate_limiter, openai_api_key
+        )
+        index_key = make_cache_key(
+            parsed_paper.dict(),
+            summary_config.llm_model_name,
+            summary_config.chunk_size,
+            summary_config.chunk_overlap,
+            embedding_model_name,
+        )
+        # Key of the config alone, to find the summaries of papers by a config.
+        config_key = make_cache_key(
+            summary_config.summary_type,
+            summary_config.llm_model_name,
+            summary_config.temperature,
+            summary_config.context_token_budget,
+            summary_config.chunk_size,
+            summary_config.chunk_overlap,
+            embedding_model_name,
+        )
+        summary_key = make_cache_key(
+            index_key,
+            summary_config.summary_type,
+            summary_config.llm_model_name,
+            summary_config.temperature,
+            summary_config.context_token_budget,
+        )
+        summary_file_path = pdf_file_path.parent / f"summary_{summary_key}.json"
 
-        # If summary already exists, continue the loop.
-        if summary_file_path.exists():
-            logger.info(
-                f"`{str(summary_file_path)}` already exists. Continue the loop."
-            )
-            with summary_file_path.open("r", encoding="utf-8") as f:
-                summary = json.load(f)
-            summary_format = FORMAT_MAPPING[summary_config.summary_type]
-            summary = summary_format.parse_obj(summary)
-
-        else:
-            # Convert text into to structured documents
-            text_splitter = TokenTextSplitter.from_tiktoken_encoder(
-                model_name=summary_config.llm_model_name,
-                chunk_size=summary_config.chunk_size,
-                chunk_overlap=summary_config.chunk_overlap,
-            )
-            documents = self.structure_latex_documents(
-                parsed_paper,
-                text_splitter,
+        async def aload_or_generate() -> SummaryFormat:
+            # The summary is looked up again by a call which waited for another
+            # worker, so it reuses the summary generated meanwhile. It is
+            # regenerated when cached completions are disabled to sample a new one.
+            cached_summary = (
+                await asyncio.to_thread(
+                    self._load_summary,
+                    summary_key,
+                    summary_file_path,
+                    summary_config,
+                    config_key,
+                )
+                if summary_config.cache_completions is not False
+                else None
             )
+            if cached_summary is not None:
+                count_cache_lookups("summary", hits=1, misses=0)
+                logger.info(f"Summary `{summary_key}` already exists. Skip it.")
+                if on_field is not None:
+                    for field, text in cached_summary.dict().items():
+                        on_field(field, text)
+                return cached_summary
 
-            # Embed documents and store into vector database.
-            embeddings = OpenAIEmbeddings()  # type: ignore
-            vectorstore = FAISS.from_documents(
-                documents=documents,
-                embedding=embeddings,
-            )
-            vectorstore_wo_abstract = FAISS.from_documents(
-                documents=[
-                    document
-                    for document in documents
-                    if document.metadata["section"] != "abstract"
-                ],
-                embedding=embeddings,
-            )
+            count_cache_lookups("summary", hits=0, misses=1)
+
+            # Load the index of the paper if it was built with the same inputs, so
+            # resummarizing with new prompts skips embedding entirely.
+            index_path = pdf_file_path.parent / f"index_{index_key}"
+            if PaperVectorStore.exists_compact(index_path):
+                count_cache_lookups("paper_index", hits=1, misses=0)
+                logger.info(f"Loading `{str(index_path)}`.")
+                with track_stage("index_load"):
+                    vectorstore = await asyncio.to_thread(
+                        PaperVectorStore.load_compact, index_path, embeddings
+                    )
+            else:
+                count_cache_lookups("paper_index", hits=0, misses=1)
+                vectorstore = await self._build_vectorstore(
+                    parsed_paper, summary_config, embeddings, embedding_model_name
+                )
+                with track_stage("index_save"):
+                    await asyncio.to_thread(vectorstore.save_compact, index_path)
 
-            # Save vector database.
-            vectorstore.save_local(str(pdf_file_path.parent / "index"))
-            vectorstore.save_local(str(pdf_file_path.parent / "index_wo_abstract"))
+            # Add the chunks to the corpus for the search across papers.
+            paper_id = pdf_file_path.parent.name
+            corpus_index = (self.corpus_indices or dict()).get(
+                summary_config.embedding_backend
+            )
+            if corpus_index is not None and not corpus_index.has_paper(
+                paper_id, index_key
+            ):
+                with track_stage("corpus_index"):
+                    await asyncio.to_thread(
+                        corpus_index.add_paper,
+                        paper_id,
+                        index_key,
+                        vectorstore.get_documents(),
+                        vectorstore.get_vectors(),
+                    )
 
-            # Generate summary.
+            # Generate summary. The model is cheap to build, and calls of all
+            # models share the connections of the event loop.
             llm_model = ChatOpenAI(
                 model_name=summary_config.llm_model_name,
                 temperature=summary_config.temperature,
+                streaming=on_token is not None,
+                # The environment variable is used if None.
+                openai_api_key=openai_api_key,
             )  # type: ignore
+            apply_pooled_session(llm_model)
+            if self.rate_limiter is not None:
+                apply_rate_limiter(llm_model, self.rate_limiter)
             summarizer = self.summarizer(
                 llm_model=llm_model,
-                vectorstore={
-                    "all": vectorstore,
-                    "wo_abstract": vectorstore_wo_abstract,
-                },
-                prompt_template_dir_path=pathlib.Path("./src/domain/prompts"),
+                vectorstore=vectorstore,
+                prompt_template_dir_path=PROMPT_TEMPLATE_DIR_PATH,
+                query_embedder=(
+                    functools.partial(
+                        self.query_embedding_cache.embed_queries,
+                        embeddings,
+                        embedding_model_name,
+                    )
+                    if self.query_embedding_cache is not None
+                    else None
+                ),
+                completion_cache=(
+                    self.completion_cache
+                    if _uses_completion_cache(summary_config)
+                    else None
+                ),
+                context_packer=ContextPacker(
+                    summary_config.llm_model_name, summary_config.context_token_budget
+                ),
+                on_field=on_field,
+                on_token=on_token,
             )
-            summary = summarizer.summarize()
+            summary = await summarizer.asummarize()
 
             # Save summary.
+            await asyncio.to_thread(
+                self._save_summary,
+                summary_key,
+                summary_file_path,
+                summary_config,
+                config_key,
+                summary,
+            )
+            return cast(SummaryFormat, summary)
+
+        # The same paper summarized by concurrent requests, e.g. a pdf on a shared
+        # reading list, waits for and shares one summary. Fresh samples requested
+        # by disabling cached completions are never shared.
+        if self.single_flight is None or summary_config.cache_completions is False:
+            return await aload_or_generate()
+        summary, is_shared = await self.single_flight.run(
+            "summary", summary_key, aload_or_generate
+        )
+        if is_shared and on_field is not None:
+            for field, text in summary.dict().items():
+                on_field(field, text)
+        return summary
+
+    def _load_summary(
+        self,
+        summary_key: str,
+        summary_file_path: pathlib.Path,
+        summary_config: SummaryConfigDTO,
+        config_key: str,
+    ) -> SummaryFormat | None:
+        """Load the summary of the key from the repository or the file.
+
+        A summary saved as a file before the repository is used is moved into the
+        repository, so it is looked up by an indexed query from the next time.
+
+        Args:
+            summary_key (str): key of the summary
+            summary_file_path (pathlib.Path): path to the JSON file of the summary
+            summary_config (SummaryConfigDTO): Summary configuration.
+            config_key (str): key of the summary configuration
+
+        Returns:
+            SummaryFormat | None: the summary, or None if not found
+        """
+        summary_format = FORMAT_MAPPING[summary_config.summary_type]
+        if self.summary_repository is not None:
+            records = self.summary_repository.get({"summary_id": summary_key})
+            if records:
+                return summary_format.parse_obj(records[0]["summary"])
+
+        if not summary_file_path.exists():
+            return None
+        with summary_file_path.open("r", encoding="utf-8") as f:
+            summary = summary_format.parse_obj(json.load(f))
+        if self.summary_repository is not None:
+            self._save_summary(
+                summary_key,
+                summary_file_path,
+                summary_config,
+                config_key,
+                summary,
+            )
+        return summary
+
+    def _save_summary(
+        self,
+        summary_key: str,
+        summary_file_path: pathlib.Path,
+        summary_config: SummaryConfigDTO,
+        config_key: str,
+        summary: SummaryFormat,
+    ) -> None:
+        """Save the summary to the repository, or to the file if not given.
+
+        Args:
+            summary_key (str): key of the summary
+            summary_file_path (pathlib.Path): path to the JSON file of the summary
+            summary_config (SummaryConfigDTO): Summary configuration.
+            config_key (str): key of the summary configuration
+            summary (SummaryFormat): the summary
+        """
+        if self.summary_repository is None:
             with summary_file_path.open("w", encoding="utf-8") as f:
                 json.dump(summary.dict(), f, indent=4, ensure_ascii=False)
+            return
 
-        return cast(SummaryFormat, summary)
+        self.summary_repository.set(
+            [
+                {
+                    "summary_id": summary_key,
+                    "paper_id": summary_file_path.parent.name,
+                    "config_hash": config_key,
+                    "summary_type": summary_config.summary_type,
+                    "summary": summary.dict(),
+                    "created_at": time.time(),
+                }
+            ]
+        )
+
+    async def _build_vectorstore(
+        self,
+        parsed_paper: ParsedPaperDTO,
+        summary_config: SummaryConfigDTO,
+        embeddings: Embeddings,
+        embedding_model_name: str,
+    ) -> PaperVectorStore:
+        """Split the parsed paper into chunks and embed them.
+
+        Args:
+            parsed_paper (ParsedPaperDTO): Parsed paper.
+            summary_config (SummaryConfigDTO): Summary configuration.
+            embeddings (Embeddings): Embedding model.
+            embedding_model_name (str): Name of the embedding model.
+
+        Returns:
+            PaperVectorStore: Vectorstore of the chunks.
+        """
+        # Convert text into to structured documents
+        chunker = TokenChunker(
+            model_name=summary_config.llm_model_name,
+            chunk_size=summary_config.chunk_size,
+            chunk_overlap=summary_config.chunk_overlap,
+        )
+        with track_stage("chunking"):
+            documents = await asyncio.to_thread(
+                self.structure_latex_documents,
+                parsed_paper,
+                chunker,
+            )
+
+        # Embed documents once and store into a single vector database. The
+        # abstract is excluded by a metadata filter where it is unnecessary.
+        with track_stage("embedding"):
+            return cast(
+                PaperVectorStore,
+                await asyncio.to_thread(
+                    PaperVectorStore.from_documents,
+                    documents=documents,
+                    embedding=(
+                        CachedEmbeddings(
+                            embeddings, self.embedding_cache, embedding_model_name
+                        )
+                        if self.embedding_cache is not None
+                        and summary_config.embedding_backend
+                        not in LOCAL_EMBEDDING_BACKENDS
+                        else embeddings
+                    ),
+                ),
+            )
 
     def structure_latex_documents(
         self,
         parsed_paper: ParsedPaperDTO,
-        text_splitter: TextSplitter,
+        chunker: TokenChunker,
         abstract_text: str | None = None,
     ) -> list[Document]:
         """Convert parsed paper into structured documents.
 
+        The texts of all sections are chunked in a single batch. The chunks of a
+        section share its metadata object, and the position of a chunk is its index
+        in the vectorstore instead of a metadata field.
+
         Args:
             parsed_paper (ParsedPaperDTO): Parsed paper.
-            text_splitter (TextSplitter): Text splitter.
+            chunker (TokenChunker): Chunker of texts.
             abstract_text (str | None, optional): Full abstract text. Defaults to None.
 
         Returns:
@@ -128,7 +422,9 @@ class SummaryHandler:
             )
         ]
 
-        # Loop over section.
+        # Collect texts of sections and subsections in order.
+        texts: list[str] = []
+        metadata_list: list[dict[str, str]] = []
         for each_section in parsed_paper.section:
             section_title = each_section.section_title
             if section_title == "References" or section_title == "REFERENCES":
@@ -137,27 +433,67 @@ class SummaryHandler:
             section_id = each_section.section_id
             section_text = each_section.section_text
             if section_text:
-                metadata = {
-                    "section_id": f"{section_id}",
-                    "section": f"{section_title}",
-                }
-                for each_section_text in text_splitter.split_text(section_text):
-                    documents.append(
-                        Document(page_content=each_section_text, metadata=metadata)
-                    )
+                texts.append(section_text)
+                metadata_list.append(
+                    {"section_id": f"{section_id}", "section": f"{section_title}"}
+                )
 
             # Loop over subsection.
-            for each_subsection in each_section.subsection_list:
-                subsection_title = each_subsection.subsection_title
-                subsection_id = each_subsection.subsection_id
-                subsection_text = each_subsection.subsection_text
-                metadata = {
-                    "section_id": f"{section_id}.{subsection_id}",
-                    "section": f"{section_title}/{subsection_title}",
-                }
-                for each_subsection_text in text_splitter.split_text(subsection_text):
-                    documents.append(
-                        Document(page_content=each_subsection_text, metadata=metadata)
-                    )
+            self._collect_subsections(
+                each_section.subsection_list,
+                f"{section_id}",
+                f"{section_title}",
+                texts,
+                metadata_list,
+            )
+
+        for metadata, chunks in zip(metadata_list, chunker.split_texts(texts)):
+            documents.extend(
+                Document(page_content=chunk, metadata=metadata) for chunk in chunks
+            )
 
         return documents
+
+    def _collect_subsections(
+        self,
+        subsection_list: list[SubsectionDTO],
+        parent_id: str,
+        parent_title: str,
+        texts: list[str],
+        metadata_list: list[dict[str, str]],
+    ) -> None:
+        """Collect texts of nested subsections recursively.
+
+        Args:
+            subsection_list (list[SubsectionDTO]): Subsections to collect.
+            parent_id (str): Section ID of the parent, e.g. "2.1".
+            parent_title (str): Section title of the parent, e.g. "Method/Model".
+            texts (list[str]): Texts to append to.
+            metadata_list (list[dict[str, str]]): Metadata of the texts to append to.
+        """
+        for each_subsection in subsection_list:
+            subsection_id = f"{parent_id}.{each_subsection.subsection_id}"
+            subsection_title = f"{parent_title}/{each_subsection.subsection_title}"
+            texts.append(each_subsection.subsection_text)
+            metadata_list.append(
+                {"section_id": subsection_id, "section": subsection_title}
+            )
+
+            self._collect_subsections(
+                each_subsection.subsection_list,
+                subsection_id,
+                subsection_title,
+                texts,
+                metadata_list,
+            )
+
+
+def _uses_completion_cache(summary_config: SummaryConfigDTO) -> bool:
+    """Whether to cache completions by the config.
+
+    Completions sampled at a positive temperature are not reused by default, so
+    that a new summary is sampled unless asked otherwise.
+    """
+    if summary_config.cache_completions is None:
+        return summary_config.temperature == 0
+    return summary_config.cache_completions
@@ -0,0 +1,65 @@
+import functools
+
+import tiktoken
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model_name: str) -> tiktoken.Encoding:
+    """Get the tiktoken encoder of the model, shared in the process.
+
+    Args:
+        model_name (str): name of the model
+
+    Returns:
+        tiktoken.Encoding: encoder of the model
+    """
+    return tiktoken.encoding_for_model(model_name)
+
+
+class TokenChunker:
+    """Chunker which splits texts into chunks of tokens in a batch.
+
+    Chunks are the same as `TokenTextSplitter` of langchain, i.e. windows of
+    `chunk_size` tokens which overlap by `chunk_overlap` tokens. The encoder of the
+    model is shared in the process, each text is encoded once without the scan
+    for special tokens, and chunks are sliced from the tokens by offsets.
+
+    Args:
+        model_name (str): name of the model whose tokenizer is used
+        chunk_size (int): number of tokens of a chunk
+        chunk_overlap (int): number of tokens shared by neighboring chunks
+
+    """
+
+    def __init__(self, model_name: str, chunk_size: int, chunk_overlap: int) -> None:
+        if chunk_overlap >= chunk_size:
+            raise ValueError(
+                f"Got a larger chunk overlap ({chunk_overlap}) than chunk size "
+                f"({chunk_size}), should be smaller."
+            )
+        self.encoding = get_encoding(model_name)
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    def split_texts(self, texts: list[str]) -> list[list[str]]:
+        """Split texts into chunks.
+
+        Args:
+            texts (list[str]): texts to split
+
+        Returns:
+            list[list[str]]: chunks of each text
+        """
+        stride = self.chunk_size - self.chunk_overlap
+        split_chunks = []
+        for text in texts:
+            tokens = self.encoding.encode_ordinary(text)
+            split_chunks.append(
+                [
+                    self.encoding.decode_bytes(
+                        tokens[start : start + self.chunk_size]
+                    ).decode("utf-8", errors="replace")
+                    for start in range(0, len(tokens), stride)
+                ]
+            )
+        return split_chunks
@@ -0,0 +1,5 @@
+# flake8: noqa
+from .corpus_index import CorpusIndex
+from .mapped_docstore import MappedDocstore
+from .mapped_flat_index import MappedFlatIndex
+from .paper_vectorstore import PaperVectorStore
@@ -0,0 +1,496 @@
+import fcntl
+import json
+import logging
+import math
+import os
+import pathlib
+import sqlite3
+import sys
+import threading
+from typing import Any, Final, Iterator
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.vectorstores.faiss import dependable_faiss_import
+
+from src.usecase.vectorstore.mapped_docstore import atomic_write
+
+logger: Final = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# The index is saved with its version, so that a process never reads an index
+# which does not match the saved state.
+INDEX_FILENAME_FORMAT: Final = "index.{version}.faiss"
+RETRAINING_LOCK_FILENAME: Final = "retraining.lock"
+DATABASE_FILENAME: Final = "chunks.sqlite3"
+# FAISS recommends at least 39 training vectors per cluster.
+TRAINING_VECTORS_PER_LIST: Final = 64
+READ_BATCH_SIZE: Final = 10_000
+
+
+class CorpusIndex:
+    """Persistent vector index of the chunks of all papers.
+
+    Chunks are stored in SQLite with their vectors and `paper_id`/`section`
+    metadata, which is the source of truth. A paper is added once for each
+    `index_key`, the key of the parsed paper and the settings of chunking and
+    embedding, so that chunks of other settings are added as well. The ANN index is built from it:
+    papers are added incrementally, and the index starts as an exact flat index
+    and is re-trained as IVF in a background thread when the corpus has grown
+    enough, so it is never rebuilt on the request path.
+
+    The directory may be shared by several processes, each of which keeps its
+    own in-memory index. Before each search, a process adds the chunks added by
+    the others since it last looked, and loads the index saved by the others if
+    it is newer. Only the process holding the file lock of retraining re-trains
+    and saves the index.
+
+    Args:
+        root_path (pathlib.Path): directory to store the index
+        encoding (str, optional): FAISS encoding of the IVF index, e.g. "Flat",
+            "SQ8" for scalar quantization or "PQ32" for product quantization.
+            Defaults to "SQ8".
+        min_training_size (int, optional): number of chunks to train the first
+            IVF index. Defaults to 10,000.
+        retraining_growth (float, optional): the index is re-trained when the
+            number of chunks grows by this factor since the last training.
+            Defaults to 2.0.
+        nprobe (int, optional): number of IVF lists to visit in a search.
+            Defaults to 16.
+
+    """
+
+    def __init__(
+        self,
+        root_path: pathlib.Path,
+        encoding: str = "SQ8",
+        min_training_size: int = 10_000,
+        retraining_growth: float = 2.0,
+        nprobe: int = 16,
+    ) -> None:
+        self.root_path = root_path
+        self.encoding = encoding
+        self.min_training_size = min_training_size
+        self.retraining_growth = retraining_growth
+        self.nprobe = nprobe
+        self.faiss = dependable_faiss_import()
+        self.lock = threading.Lock()
+        self.retraining_thread: threading.Thread | None = None
+        self.index: Any = None
+        self.trained_size = 0
+        # Version of the saved index the in-memory index is based on.
+        self.version = 0
+        # All chunks up to this ID are in the in-memory index.
+        self.last_loaded_id = 0
+
+        self.root_path.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(
+            str(root_path / DATABASE_FILENAME),
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "id INTEGER PRIMARY KEY, paper_id TEXT NOT NULL, "
+            "index_key TEXT NOT NULL DEFAULT '', section TEXT, "
+            "page_content TEXT NOT NULL, metadata TEXT NOT NULL, vector BLOB NOT NULL)"
+        )
+        # Chunks of an older index were added without the key.
+        column_names = {
+            name for _, name, *_ in self.connection.execute("PRAGMA table_info(chunks)")
+        }
+        if "index_key" not in column_names:
+            self.connection.execute(
+                "ALTER TABLE chunks ADD COLUMN index_key TEXT NOT NULL DEFAULT ''"
+            )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS chunks_paper_id_index_key "
+            "ON chunks (paper_id, index_key)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value INTEGER)"
+        )
+        self._sync()
+
+    def __len__(self) -> int:
+        with self.lock:
+            (num_chunks,) = self.connection.execute(
+                "SELECT COUNT(*) FROM chunks"
+            ).fetchone()
+        return int(num_chunks)
+
+    def has_paper(self, paper_id: str, index_key: str) -> bool:
+        """Whether the chunks of the paper by the settings are in the index.
+
+        Args:
+            paper_id (str): ID of the paper
+            index_key (str): key of the parsed paper and the settings of chunking
+                and embedding
+
+        Returns:
+            bool: True if the chunks are in the index
+        """
+        with self.lock:
+            return self._has_paper(paper_id, index_key)
+
+    def add_paper(
+        self,
+        paper_id: str,
+        index_key: str,
+        documents: list[Document],
+        vectors: np.ndarray,
+    ) -> None:
+        """Add the chunks of a paper unless they are already in the index.
+
+        Args:
+            paper_id (str): ID of the paper
+            index_key (str): key of the parsed paper and the settings of chunking
+                and embedding
+            documents (list[Document]): chunks of the paper
+            vectors (np.ndarray): embeddings of the chunks
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self.lock:
+            # The write lock is taken before the check, so that other processes
+            # never add the same chunks in the meantime.
+            self.connection.execute("BEGIN IMMEDIATE")
+            if self._has_paper(paper_id, index_key):
+                self.connection.execute("ROLLBACK")
+                return
+
+            ids = []
+            for document, vector in zip(documents, vectors):
+                cursor = self.connection.execute(
+                    "INSERT INTO chunks (paper_id, index_key, section, page_content, "
+                    "metadata, vector) VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        paper_id,
+                        index_key,
+                        document.metadata.get("section"),
+                        document.page_content,
+                        json.dumps(document.metadata, ensure_ascii=False),
+                        vector.tobytes(),
+                    ),
+                )
+                ids.append(cursor.lastrowid)
+            self.connection.execute("COMMIT")
+
+            # Chunks added by other processes in the meantime are added as well.
+            self._add_new_chunks()
+            num_chunks = self.index.ntotal
+        logger.info(f"Added {len(ids)} chunks of `{paper_id}` to the corpus index.")
+
+        if num_chunks >= max(
+            self.min_training_size, self.trained_size * self.retraining_growth
+        ):
+            self._start_retraining()
+
+    def _has_paper(self, paper_id: str, index_key: str) -> bool:
+        """Whether the chunks are in the index. The lock must be held."""
+        row = self.connection.execute(
+            "SELECT 1 FROM chunks WHERE paper_id = ? AND index_key = ? LIMIT 1",
+            (paper_id, index_key),
+        ).fetchone()
+        return row is not None
+
+    def search(
+        self, vectors: np.ndarray, k: int = 10, paper_id: str | None = None
+    ) -> list[list[tuple[Document, float]]]:
+        """Search chunks similar to each vector.
+
+        The search over the whole corpus is approximate. The search scoped to a
+        paper is exact over the chunks of the paper, as approximate search with a
+        filter may miss chunks of small papers.
+
+        Args:
+            vectors (np.ndarray): query embeddings of shape (n_queries, dim)
+            k (int, optional): number of chunks to return for each query.
+                Defaults to 10.
+            paper_id (str | None, optional): ID of the paper to search in. Search
+                the whole corpus if None. Defaults to None.
+
+        Returns:
+            list[list[tuple[Document, float]]]: chunks and their L2 distances for
+                each query. `paper_id` is set in the metadata of the chunks.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if paper_id is not None:
+            distances, ids = self._search_paper(vectors, k, paper_id)
+        else:
+            self._sync()
+            with self.lock:
+                if self.index is None:
+                    return [[] for _ in vectors]
+                distances, ids = self.index.search(vectors, k)
+
+        documents = self._get_documents([int(i) for i in ids.flatten() if i != -1])
+        return [
+            [
+                (documents[int(i)], float(distance))
+                for i, distance in zip(row_ids, row_distances)
+                if int(i) in documents
+            ]
+            for row_ids, row_distances in zip(ids, distances)
+        ]
+
+    def _search_paper(
+        self, vectors: np.ndarray, k: int, paper_id: str
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Search exactly among the chunks of the paper."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id, vector FROM chunks WHERE paper_id = ?", (paper_id,)
+            ).fetchall()
+        if not rows:
+            return np.zeros((len(vectors), 0)), np.zeros((len(vectors), 0), np.int64)
+        ids = np.array([id_ for id_, _ in rows], dtype=np.int64)
+        matrix = np.stack(
+            [np.frombuffer(vector, dtype=np.float32) for _, vector in rows]
+        )
+        distances = (
+            (vectors**2).sum(axis=1, keepdims=True)
+            - 2 * vectors @ matrix.T
+            + (matrix**2).sum(axis=1)
+        )
+        order = np.argsort(distances, axis=1)[:, :k]
+        return np.take_along_axis(distances, order, axis=1), ids[order]
+
+    def _get_documents(self, ids: list[int]) -> dict[int, Document]:
+        """Get the chunks by their IDs."""
+        documents: dict[int, Document] = dict()
+        unique_ids = list(set(ids))
+        with self.lock:
+            for i in range(0, len(unique_ids), 500):
+                batch = unique_ids[i : i + 500]
+                rows = self.connection.execute(
+                    "SELECT id, paper_id, page_content, metadata FROM chunks "
+                    f"WHERE id IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for id_, paper_id, page_content, metadata in rows:
+                    documents[id_] = Document(
+                        page_content=page_content,
+                        metadata={**json.loads(metadata), "paper_id": paper_id},
+                    )
+        return documents
+
+    def _build_flat_index(self, dim: int) -> Any:
+        return self.faiss.IndexIDMap2(self.faiss.IndexFlatL2(dim))
+
+    def _get_index_path(self, version: int) -> pathlib.Path:
+        return self.root_path / INDEX_FILENAME_FORMAT.format(version=version)
+
+    def _sync(self) -> None:
+        """Catch up with the index saved and the chunks added by other processes.
+
+        The saved index is read without holding the lock, so that searches are
+        not blocked while it is read.
+        """
+        with self.lock:
+            state = dict(self.connection.execute("SELECT key, value FROM state"))
+        version = state.get("version", 0)
+        if version > self.version:
+            try:
+                index = self.faiss.read_index(str(self._get_index_path(version)))
+            except RuntimeError:
+                # The index was replaced by a newer one after the state was read,
+                # which is loaded next time.
+                logger.info(f"The corpus index of version {version} was replaced.")
+            else:
+                self._set_nprobe(index)
+                self._swap_index(
+                    index, version, state["last_id"], state["trained_size"]
+                )
+        with self.lock:
+            self._add_new_chunks()
+
+    def _swap_index(
+        self, index: Any, version: int, last_id: int, trained_size: int
+    ) -> None:
+        """Replace the in-memory index unless it is based on a newer version.
+
+        Args:
+            index (Any): the new index
+            version (int): version of the saved index
+            last_id (int): all chunks up to this ID are in the index
+            trained_size (int): number of chunks the index was trained on
+        """
+        with self.lock:
+            if version <= self.version:
+                return
+            self.index = index
+            self.version = version
+            self.last_loaded_id = last_id
+            self.trained_size = trained_size
+            self._add_new_chunks()
+
+    def _add_new_chunks(self) -> None:
+        """Add the chunks which are not in the in-memory index yet.
+
+        IDs are assigned in the order of commits, since SQLite serializes writes,
+        so the chunks after `last_loaded_id` are exactly the ones to add. The lock
+        must be held.
+        """
+        while True:
+            batch = self._read_vectors(self.last_loaded_id, limit=READ_BATCH_SIZE)
+            if batch is None:
+                return
+            ids, vectors = batch
+            if self.index is None:
+                self.index = self._build_flat_index(vectors.shape[1])
+            self.index.add_with_ids(vectors, ids)
+            self.last_loaded_id = int(ids[-1])
+
+    def _iter_vectors(
+        self, after_id: int = 0, until_id: int = sys.maxsize
+    ) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+        """Yield IDs and vectors of the chunks in batches, in the order of IDs.
+
+        The lock is held only while reading each batch.
+        """
+        while True:
+            with self.lock:
+                batch = self._read_vectors(after_id, until_id, READ_BATCH_SIZE)
+            if batch is None:
+                return
+            yield batch
+            after_id = int(batch[0][-1])
+
+    def _read_vectors(
+        self, after_id: int, until_id: int = sys.maxsize, limit: int = -1
+    ) -> tuple[np.ndarray, np.ndarray] | None:
+        """Read IDs and vectors of the chunks in the range of IDs.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray] | None: IDs and vectors, or None if there
+                are no chunks in the range
+        """
+        rows = self.connection.execute(
+            "SELECT id, vector FROM chunks WHERE id > ? AND id <= ? "
+            "ORDER BY id LIMIT ?",
+            (after_id, until_id, limit),
+        ).fetchall()
+        if not rows:
+            return None
+        return (
+            np.array([id_ for id_, _ in rows], dtype=np.int64),
+            np.stack([np.frombuffer(vector, dtype=np.float32) for _, vector in rows]),
+        )
+
+    def _start_retraining(self) -> None:
+        """Re-train the index in a background thread unless it is running."""
+        with self.lock:
+            if self.retraining_thread is not None and self.retraining_thread.is_alive():
+                return
+            self.retraining_thread = threading.Thread(
+                target=self._retrain, name="corpus-index-retraining", daemon=True
+            )
+            self.retraining_thread.start()
+
+    def _retrain(self) -> None:
+        """Train a new IVF index on all chunks, save it and swap it in.
+
+        Only the process holding the file lock re-trains, and it checks again
+        whether the index saved by another process is already large enough. The
+        index keeps serving searches and adds while training and saving. Chunks
+        added in the meantime are added to the new index when it is swapped in.
+        """
+        # The lock is released when the file is closed, even if the process dies.
+        fd = os.open(self.root_path / RETRAINING_LOCK_FILENAME, os.O_RDWR | os.O_CREAT)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another process is re-training.
+                return
+
+            with self.lock:
+                state = dict(self.connection.execute("SELECT key, value FROM state"))
+                (last_id, num_chunks) = self.connection.execute(
+                    "SELECT MAX(id), COUNT(*) FROM chunks"
+                ).fetchone()
+            if num_chunks < max(
+                self.min_training_size,
+                state.get("trained_size", 0) * self.retraining_growth,
+            ):
+                return
+            index = self._train(last_id, num_chunks)
+
+            # Add the chunks added while training.
+            for ids, vectors in self._iter_vectors(after_id=last_id):
+                index.add_with_ids(vectors, ids)
+                last_id = int(ids[-1])
+            version = state.get("version", 0) + 1
+            atomic_write(
+                self._get_index_path(version),
+                lambda f: self.faiss.serialize_index(index).tofile(f),
+            )
+            with self.lock:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)",
+                    [
+                        ("version", version),
+                        ("last_id", last_id),
+                        ("trained_size", num_chunks),
+                    ],
+                )
+            self._swap_index(index, version, last_id, num_chunks)
+
+            # Other processes read the state before the index, and skip an index
+            # removed in the meantime.
+            for path in self.root_path.glob(INDEX_FILENAME_FORMAT.format(version="*")):
+                if path != self._get_index_path(version):
+                    path.unlink(missing_ok=True)
+            logger.info("Re-trained the corpus index.")
+        except Exception:
+            logger.exception("Failed to re-train the corpus index.")
+        finally:
+            os.close(fd)
+
+    def _train(self, last_id: int, num_chunks: int) -> Any:
+        """Train an IVF index and add the chunks up to the ID to it.
+
+        Args:
+            last_id (int): the last ID of the chunks to add
+            num_chunks (int): number of the chunks up to the ID
+
+        Returns:
+            Any: the trained index
+        """
+        nlist = max(
+            1,
+            min(
+                int(4 * math.sqrt(num_chunks)),
+                num_chunks // TRAINING_VECTORS_PER_LIST,
+            ),
+        )
+        logger.info(
+            f"Re-training the corpus index with {num_chunks} chunks and "
+            f"{nlist} lists."
+        )
+
+        sample_size = min(num_chunks, nlist * TRAINING_VECTORS_PER_LIST)
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT vector FROM chunks WHERE id <= ? ORDER BY RANDOM() LIMIT ?",
+                (last_id, sample_size),
+            ).fetchall()
+        training_vectors = np.stack(
+            [np.frombuffer(vector, dtype=np.float32) for (vector,) in rows]
+        )
+        index = self.faiss.index_factory(
+            training_vectors.shape[1], f"IVF{nlist},{self.encoding}"
+        )
+        index.train(training_vectors)
+        self._set_nprobe(index)
+        for ids, vectors in self._iter_vectors(until_id=last_id):
+            index.add_with_ids(vectors, ids)
+        return index
+
+    def _set_nprobe(self, index: Any) -> None:
+        try:
+            self.faiss.extract_index_ivf(index).nprobe = self.nprobe
+        except RuntimeError:
+            # The index is not IVF.
+            pass
@@ -0,0 +1,103 @@
+import json
+import os
+import pathlib
+import tempfile
+from typing import IO, Callable
+
+import numpy as np
+from langchain.docstore.base import Docstore
+from langchain.docstore.document import Document
+
+
+class MappedDocstore(Docstore):
+    """Read-only docstore backed by memory-mapped files.
+
+    Each document is serialized as JSON and concatenated into a single file. The
+    document `i` is the byte range `offsets[i]:offsets[i + 1]` of the file, and is
+    decoded only when it is searched, so loading the docstore costs nothing.
+
+    Args:
+        chunks_path (pathlib.Path): path to the file of concatenated documents
+        offsets_path (pathlib.Path): path to the `.npy` file of offsets
+
+    """
+
+    def __init__(self, chunks_path: pathlib.Path, offsets_path: pathlib.Path) -> None:
+        self.offsets = np.load(offsets_path, mmap_mode="r")
+        # An empty file cannot be memory-mapped.
+        self.chunks = (
+            np.memmap(chunks_path, dtype=np.uint8, mode="r")
+            if self.offsets[-1] > 0
+            else np.zeros(0, dtype=np.uint8)
+        )
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def search(self, search: str) -> str | Document:
+        """Get the document by its index.
+
+        Args:
+            search (str): index of the document
+
+        Returns:
+            str | Document: the document, or a message if it is not found
+        """
+        if not search.isdigit() or int(search) >= len(self):
+            return f"ID {search} not found."
+        i = int(search)
+        chunk = json.loads(self.chunks[self.offsets[i] : self.offsets[i + 1]].tobytes())
+        return Document(page_content=chunk["page_content"], metadata=chunk["metadata"])
+
+    @staticmethod
+    def write(
+        documents: list[Document],
+        chunks_path: pathlib.Path,
+        offsets_path: pathlib.Path,
+    ) -> None:
+        """Write documents in the format read by this class.
+
+        Each file is written to a temporary file and renamed, so readers never see
+        a half-written file.
+
+        Args:
+            documents (list[Document]): documents in index order
+            chunks_path (pathlib.Path): path to the file of concatenated documents
+            offsets_path (pathlib.Path): path to the `.npy` file of offsets
+        """
+        offsets = [0]
+
+        def write_chunks(f: IO[bytes]) -> None:
+            for document in documents:
+                chunk = json.dumps(
+                    {
+                        "page_content": document.page_content,
+                        "metadata": document.metadata,
+                    },
+                    ensure_ascii=False,
+                ).encode("utf-8")
+                f.write(chunk)
+                offsets.append(offsets[-1] + len(chunk))
+
+        atomic_write(chunks_path, write_chunks)
+        atomic_write(
+            offsets_path, lambda f: np.save(f, np.array(offsets, dtype=np.int64))
+        )
+
+
+def atomic_write(path: pathlib.Path, write: Callable[[IO[bytes]], None]) -> None:
+    """Write a file via a temporary file in the same directory and rename it.
+
+    Args:
+        path (pathlib.Path): path to the file
+        write (Callable[[IO[bytes]], None]): function to write the content
+    """
+    with tempfile.NamedTemporaryFile(dir=path.parent, suffix=".tmp", delete=False) as f:
+        tmp_path = pathlib.Path(f.name)
+        try:
+            write(f)
+        except BaseException:
+            f.close()
+            tmp_path.unlink(missing_ok=True)
+            raise
+    os.replace(tmp_path, path)
@@ -0,0 +1,93 @@
+from typing import Final
+
+import numpy as np
+
+# Number of vectors compared at once, which bounds the memory of a search.
+SEARCH_BLOCK_SIZE: Final = 16384
+
+
+class MappedFlatIndex:
+    """Read-only exact L2 index which searches a memory-mapped vector matrix.
+
+    It implements the subset of the FAISS index interface used by langchain's
+    `FAISS` for searching. Unlike `faiss.IndexFlatL2`, the vectors are not copied
+    into the memory of the process. They are read from the page cache, which is
+    shared by the workers and reclaimable, block by block when searched.
+
+    Args:
+        vectors (np.ndarray): vectors of shape (number of vectors, dim), usually
+            loaded by `np.load(..., mmap_mode="r")`. `np.float16` is converted to
+            `np.float32` block by block.
+        block_size (int, optional): number of vectors compared at once.
+            Defaults to 16384.
+
+    """
+
+    def __init__(
+        self, vectors: np.ndarray, block_size: int = SEARCH_BLOCK_SIZE
+    ) -> None:
+        self.vectors = vectors
+        self.block_size = block_size
+        self.d = int(vectors.shape[1])
+        self.is_trained = True
+
+    @property
+    def ntotal(self) -> int:
+        return int(self.vectors.shape[0])
+
+    def search(self, x: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """Search the nearest vectors of the queries by the squared L2 distance.
+
+        Args:
+            x (np.ndarray): queries of shape (number of queries, dim)
+            k (int): number of vectors to return for each query
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: distances and indices of shape
+                (number of queries, k) in the order of distance. Missing results
+                are padded with the index -1 and the distance of infinity, as
+                FAISS does.
+        """
+        queries = np.ascontiguousarray(x, dtype=np.float32)
+        num_queries = queries.shape[0]
+        distances = np.full((num_queries, k), np.inf, dtype=np.float32)
+        indices = np.full((num_queries, k), -1, dtype=np.int64)
+        if k <= 0:
+            return distances, indices
+
+        query_norms = (queries**2).sum(axis=1, keepdims=True)
+        for start in range(0, self.ntotal, self.block_size):
+            block = np.asarray(
+                self.vectors[start : start + self.block_size], dtype=np.float32
+            )
+            block_distances = (
+                query_norms - 2 * queries @ block.T + (block**2).sum(axis=1)
+            )
+            block_indices = np.broadcast_to(
+                np.arange(start, start + len(block), dtype=np.int64),
+                block_distances.shape,
+            )
+            # Keep the k nearest of the results so far and the block.
+            candidate_distances = np.concatenate([distances, block_distances], axis=1)
+            candidate_indices = np.concatenate([indices, block_indices], axis=1)
+            nearest = np.argpartition(candidate_distances, k - 1, axis=1)[:, :k]
+            distances = np.take_along_axis(candidate_distances, nearest, axis=1)
+            indices = np.take_along_axis(candidate_indices, nearest, axis=1)
+
+        # Break ties by the index as FAISS does.
+        order = np.argsort(indices, axis=1)
+        distances = np.take_along_axis(distances, order, axis=1)
+        indices = np.take_along_axis(indices, order, axis=1)
+        order = np.argsort(distances, axis=1, kind="stable")
+        distances = np.take_along_axis(distances, order, axis=1)
+        indices = np.take_along_axis(indices, order, axis=1)
+        indices[np.isinf(distances)] = -1
+        return np.maximum(distances, 0.0), indices
+
+    def reconstruct(self, key: int) -> np.ndarray:
+        """Get the vector of the index."""
+        return np.asarray(self.vectors[key], dtype=np.float32)
+
+    def reconstruct_n(self, start: int, n: int) -> np.ndarray:
+        """Get the vectors of the range of indices."""
+        return np.asarray(self.vectors[start : start + n], dtype=np.float32)
@@ -0,0 +1,223 @@
+import pathlib
+from typing import Any, Callable, Final
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores import FAISS
+from langchain.vectorstores.faiss import dependable_faiss_import
+
+from src.usecase.vectorstore.mapped_docstore import MappedDocstore, atomic_write
+from src.usecase.vectorstore.mapped_flat_index import MappedFlatIndex
+
+MetadataFilter = dict[str, Any] | Callable[[dict[str, Any]], bool]
+
+VECTORS_FILENAME: Final = "vectors.npy"
+CHUNKS_FILENAME: Final = "chunks.jsonl"
+OFFSETS_FILENAME: Final = "offsets.npy"
+
+
+class PaperVectorStore(FAISS):
+    """Vectorstore for the chunks of a paper.
+
+    NOTE: This class extends `FAISS` class implemented in langchain to support
+    predicate filters on metadata (e.g. excluding the abstract) and direct lookup
+    of documents by metadata, so that a single index can serve every query.
+
+    Chunks of a section are consecutive in the index and may share one metadata
+    object, which must not be modified.
+
+    """
+
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: list[float],
+        k: int = 4,
+        filter: MetadataFilter | None = None,
+        fetch_k: int = 20,
+        **kwargs: Any,
+    ) -> list[tuple[Document, float]]:
+        """Return docs most similar to the embedding.
+
+        Args:
+            embedding (list[float]): embedding vector to look up documents
+            k (int, optional): number of documents to return. Defaults to 4.
+            filter (MetadataFilter | None, optional): dict to match metadata exactly
+                or predicate which receives metadata. Defaults to None.
+            fetch_k (int, optional): number of documents to fetch before
+                filtering. Defaults to 20.
+
+        Returns:
+            list[tuple[Document, float]]: documents and their L2 distance
+        """
+        if not callable(filter):
+            return super().similarity_search_with_score_by_vector(
+                embedding, k=k, filter=filter, fetch_k=fetch_k, **kwargs
+            )
+
+        docs_and_scores: Final = super().similarity_search_with_score_by_vector(
+            embedding, k=max(k, fetch_k), **kwargs
+        )
+        return [(doc, score) for doc, score in docs_and_scores if filter(doc.metadata)][
+            :k
+        ]
+
+    def get_documents_by_metadata(self, metadata: dict[str, Any]) -> list[Document]:
+        """Get documents whose metadata match the given one in index order.
+
+        Args:
+            metadata (dict[str, Any]): key-value pairs to match exactly
+
+        Returns:
+            list[Document]: matched documents
+        """
+        documents = []
+        for docstore_id in self.index_to_docstore_id.values():
+            document = self.docstore.search(docstore_id)
+            if isinstance(document, Document) and all(
+                document.metadata.get(key) == value for key, value in metadata.items()
+            ):
+                documents.append(document)
+        return documents
+
+    def get_documents(self) -> list[Document]:
+        """Get all documents in index order.
+
+        Returns:
+            list[Document]: documents
+        """
+        documents = []
+        for i in range(self.index.ntotal):
+            document = self.docstore.search(self.index_to_docstore_id[i])
+            if not isinstance(document, Document):
+                raise ValueError(f"Could not find document for id {i}, got {document}")
+            documents.append(document)
+        return documents
+
+    def get_vectors(self) -> np.ndarray:
+        """Get all vectors in index order.
+
+        Returns:
+            np.ndarray: vectors of shape (number of documents, dim)
+        """
+        return np.asarray(self.index.reconstruct_n(0, self.index.ntotal))
+
+    def save_compact(
+        self, folder_path: pathlib.Path, dtype: np.dtype | type = np.float32
+    ) -> None:
+        """Save the vectors and the documents in the compact format.
+
+        The vectors are saved as a matrix and the documents as a single file with
+        offsets, which are memory-mapped by `load_compact`. The vector file is
+        written last, so its existence means the index is complete.
+
+        Args:
+            folder_path (pathlib.Path): directory to save the index
+            dtype (np.dtype | type, optional): dtype of the saved vectors. Use
+                `np.float16` to halve the size. Defaults to `np.float32`.
+        """
+        folder_path.mkdir(parents=True, exist_ok=True)
+        MappedDocstore.write(
+            self.get_documents(),
+            folder_path / CHUNKS_FILENAME,
+            folder_path / OFFSETS_FILENAME,
+        )
+
+        vectors = self.get_vectors().astype(dtype)
+        atomic_write(folder_path / VECTORS_FILENAME, lambda f: np.save(f, vectors))
+
+    @staticmethod
+    def exists_compact(folder_path: pathlib.Path) -> bool:
+        """Whether a complete index in the compact format exists."""
+        return (folder_path / VECTORS_FILENAME).exists()
+
+    @classmethod
+    def load_compact(
+        cls, folder_path: pathlib.Path, embedding: Embeddings
+    ) -> "PaperVectorStore":
+        """Load the index saved by `save_compact` without embedding anything.
+
+        The vectors and the documents stay memory-mapped. The vectors are searched
+        in place by `MappedFlatIndex`, so the loaded index is read-only, and the
+        documents are decoded only when retrieved.
+
+        Args:
+            folder_path (pathlib.Path): directory of the index
+            embedding (Embeddings): embedding model to embed queries
+
+        Returns:
+            PaperVectorStore: the loaded vectorstore
+        """
+        vectors = np.load(folder_path / VECTORS_FILENAME, mmap_mode="r")
+        index = MappedFlatIndex(vectors)
+        docstore = MappedDocstore(
+            folder_path / CHUNKS_FILENAME, folder_path / OFFSETS_FILENAME
+        )
+        return cls(
+            embedding.embed_query,
+            index,
+            docstore,
+            {i: str(i) for i in range(len(docstore))},
+        )
+
+    def similarity_search_by_vectors(
+        self,
+        embeddings: np.ndarray,
+        k: list[int],
+        filters: list[MetadataFilter | None],
+        fetch_k: int = 20,
+    ) -> list[list[Document]]:
+        """Return docs most similar to each embedding by a single index search.
+
+        Args:
+            embeddings (np.ndarray): query embeddings of shape (n_queries, dim)
+            k (list[int]): number of documents to return for each query
+            filters (list[MetadataFilter | None]): filter for each query
+            fetch_k (int, optional): number of documents to fetch before
+                filtering. Defaults to 20.
+
+        Returns:
+            list[list[Document]]: documents for each query. `chunk_id`, the index of
+                the chunk in the vectorstore, is set in the metadata of copies, so
+                that neighboring chunks can be merged.
+        """
+        vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if self._normalize_L2:
+            faiss = dependable_faiss_import()
+            faiss.normalize_L2(vectors)
+        search_k = max(max(k), fetch_k if any(filters) else 0)
+        _, indices = self.index.search(vectors, search_k)
+
+        results = []
+        for row, each_k, each_filter in zip(indices, k, filters):
+            documents = []
+            for i in row:
+                # -1 is returned when there are fewer documents than search_k.
+                if i == -1:
+                    continue
+                document = self.docstore.search(self.index_to_docstore_id[i])
+                if isinstance(document, Document) and _match(
+                    document.metadata, each_filter
+                ):
+                    documents.append(
+                        Document(
+                            page_content=document.page_content,
+                            metadata={**document.metadata, "chunk_id": int(i)},
+                        )
+                    )
+                if len(documents) == each_k:
+                    break
+            results.append(documents)
+        return results
+
+
+def _match(metadata: dict[str, Any], filter: MetadataFilter | None) -> bool:
+    """Whether the metadata pass the filter."""
+    if filter is None:
+        return True
+    if callable(filter):
+        return filter(metadata)
+    return all(
+        metadata.get(key) in (value if isinstance(value, list) else [value])
+        for key, value in filter.items()
+    )
@@ -0,0 +1,79 @@
+import logging
+import time
+from typing import Callable, Final
+
+from src import routers
+
+logger: Final = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Models whose tokenizers are loaded at startup. They are the choices of the
+# `llm_model_name` form field.
+WARMUP_MODEL_NAMES: Final = ["gpt-3.5-turbo", "gpt-4"]
+
+
+def warmup() -> dict[str, float]:
+    """Do the first-use work of the app in advance, so the first request of a
+    worker is as fast as the others.
+
+    Each step is independent, and a failure of a step is logged and does not
+    prevent the worker from starting, e.g. tokenizers cannot be downloaded
+    offline.
+
+    Returns:
+        dict[str, float]: elapsed seconds of each step
+    """
+    steps: dict[str, Callable[[], None]] = {
+        "controllers": _create_controllers,
+        "tokenizers": _load_tokenizers,
+        "prompt_templates": _compile_prompt_templates,
+        "http_clients": _create_http_clients,
+    }
+    elapsed_times = dict()
+    for name, step in steps.items():
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception:
+            logger.warning(f"Warmup step `{name}` failed.", exc_info=True)
+        elapsed_times[name] = time.perf_counter() - start
+        logger.info(f"Warmup step `{name}` took {elapsed_times[name]:.2f} s.")
+    return elapsed_times
+
+
+def _create_controllers() -> None:
+    """Import the heavy dependencies and open the caches and indices."""
+    routers.get_summary_controller()
+    routers.get_job_controller()
+    routers.get_search_controller()
+
+
+def _load_tokenizers() -> None:
+    """Load the tiktoken encodings of the models."""
+    from src.usecase.text_chunker import get_encoding
+
+    for model_name in WARMUP_MODEL_NAMES:
+        get_encoding(model_name)
+
+
+def _compile_prompt_templates() -> None:
+    """Compile the prompt templates into the shared jinja2 environment."""
+    from src.usecase.summarizer.base_summarizer import (
+        PROMPT_TEMPLATE_DIR_PATH,
+        get_template_env,
+    )
+
+    template_env = get_template_env(PROMPT_TEMPLATE_DIR_PATH)
+    for template_name in template_env.list_templates():
+        template_env.get_template(template_name)
+
+
+def _create_http_clients() -> None:
+    """Create the HTTP client shared by the process.
+
+    Async clients belong to an event loop, so they are created by the lifespan of
+    the app instead.
+    """
+    from src.usecase.http_clients import get_http_client
+
+    get_http_client()
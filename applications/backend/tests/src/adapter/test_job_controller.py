@@ -0,0 +1,97 @@
+from src.adapter.job_controller import JobController
+from src.db.sqlite_rdb import SQLiteConnectionPool, SQLiteRDB
+
+
+def make_controller(tmp_path, max_finished_jobs: int) -> JobController:
+    pool = SQLiteConnectionPool(tmp_path / "papers.sqlite3")
+    job_repository = SQLiteRDB(
+        pool,
+        table_name="job",
+        columns={
+            "job_id": "TEXT NOT NULL",
+            "status": "TEXT NOT NULL",
+            "created_at": "REAL NOT NULL",
+            "finished_at": "REAL",
+        },
+        pk=["job_id"],
+        indices=[["status", "finished_at"]],
+    )
+    job_paper_repository = SQLiteRDB(
+        pool,
+        table_name="job_paper",
+        columns={
+            "job_id": "TEXT NOT NULL",
+            "paper_index": "INTEGER NOT NULL",
+            "filename": "TEXT NOT NULL",
+            "status": "TEXT NOT NULL",
+            "stage": "TEXT",
+            "error": "TEXT",
+            "result": "JSON",
+            "worker_id": "TEXT NOT NULL",
+        },
+        pk=["job_id", "paper_index"],
+        fk={"job_id": {"table": "job", "key": "job_id"}},
+    )
+    return JobController(
+        None,  # type: ignore
+        job_repository,
+        job_paper_repository,
+        tmp_path / "locks",
+        max_finished_jobs=max_finished_jobs,
+    )
+
+
+class TestJobController:
+    def test_discard_oldest_finished_jobs(self, tmp_path):
+        controller = make_controller(tmp_path, max_finished_jobs=2)
+        jobs = [
+            ("a", "completed", 3.0),
+            ("b", "completed", 1.0),
+            ("c", "running", None),
+            ("d", "completed", 4.0),
+            ("e", "completed", 2.0),
+        ]
+        controller.job_repository.set(
+            [
+                {"job_id": job_id, "status": status, "created_at": 0.0}
+                | {"finished_at": finished_at}
+                for job_id, status, finished_at in jobs
+            ]
+        )
+        controller.job_paper_repository.set(
+            [
+                {
+                    "job_id": job_id,
+                    "paper_index": 0,
+                    "filename": "paper.pdf",
+                    "status": "running",
+                    "worker_id": controller.worker_id,
+                }
+                for job_id, _, _ in jobs
+            ]
+        )
+
+        controller._discard_old_jobs()
+
+        remaining = {record["job_id"] for record in controller.job_repository.get({})}
+        assert remaining == {"a", "c", "d"}
+        assert {
+            record["job_id"] for record in controller.job_paper_repository.get({})
+        } == remaining
+
+    def test_find_old_jobs_by_index(self, tmp_path):
+        controller = make_controller(tmp_path, max_finished_jobs=2)
+        statements: list[str] = []
+        with controller.job_repository.pool.connection() as connection:
+            connection.set_trace_callback(statements.append)
+
+        controller._discard_old_jobs()
+
+        (query,) = [each for each in statements if each.startswith("SELECT")]
+        with controller.job_repository.pool.connection() as connection:
+            connection.set_trace_callback(None)
+            plan = connection.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()
+        # The index is scanned in order instead of sorting all finished jobs.
+        details = " ".join(row["detail"] for row in plan)
+        assert "job_status_finished_at" in details
+        assert "TEMP B-TREE" not in details
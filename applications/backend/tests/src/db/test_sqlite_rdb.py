@@ -0,0 +1,100 @@
+import sqlite3
+import threading
+
+import pytest
+
+from src.db.sqlite_rdb import SQLiteConnectionPool, SQLiteRDB
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = SQLiteConnectionPool(tmp_path / "test.sqlite3", max_connections=1)
+    yield pool
+    pool.close()
+
+
+def make_tables(pool: SQLiteConnectionPool) -> tuple[SQLiteRDB, SQLiteRDB]:
+    """Make tables of jobs and their papers, which reference the jobs."""
+    job = SQLiteRDB(
+        pool,
+        "job",
+        {"job_id": "TEXT NOT NULL", "status": "TEXT NOT NULL"},
+        pk=["job_id"],
+    )
+    job_paper = SQLiteRDB(
+        pool,
+        "job_paper",
+        {
+            "job_id": "TEXT NOT NULL",
+            "paper_index": "INTEGER NOT NULL",
+            "result": "JSON",
+        },
+        pk=["job_id", "paper_index"],
+        fk={"job_id": {"table": "job", "key": "job_id"}},
+    )
+    return job, job_paper
+
+
+class TestSQLiteConnectionPool:
+    def test_wait_for_connection_in_use(self, pool):
+        borrowed = []
+
+        def borrow() -> None:
+            with pool.connection() as connection:
+                borrowed.append(connection)
+
+        with pool.connection() as connection:
+            thread = threading.Thread(target=borrow)
+            thread.start()
+            thread.join(timeout=0.2)
+            # All connections are in use.
+            assert thread.is_alive()
+        thread.join(timeout=5.0)
+
+        assert not thread.is_alive()
+        # The connection is reused rather than opened again.
+        assert borrowed == [connection]
+
+    def test_roll_back_unfinished_transaction(self, pool):
+        job, _ = make_tables(pool)
+        with pool.connection() as connection:
+            connection.execute("BEGIN")
+            connection.execute("INSERT INTO job VALUES ('a', 'running')")
+
+        assert job.get({"job_id": "a"}) == []
+
+
+class TestSQLiteRDB:
+    def test_upsert_referenced_record(self, pool):
+        job, job_paper = make_tables(pool)
+        job.set([{"job_id": "a", "status": "running"}])
+        job_paper.set([{"job_id": "a", "paper_index": 0, "result": None}])
+
+        # Replacing the job would delete the record referenced by its papers.
+        job.set([{"job_id": "a", "status": "completed"}])
+
+        assert job.get({"job_id": "a"}) == [{"job_id": "a", "status": "completed"}]
+        assert len(job_paper.get({"job_id": "a"})) == 1
+        with pytest.raises(sqlite3.IntegrityError):
+            job_paper.set([{"job_id": "b", "paper_index": 0, "result": None}])
+
+    def test_encode_json_columns(self, pool):
+        job, job_paper = make_tables(pool)
+        job.set([{"job_id": "a", "status": "running"}])
+        result = {"summary": {"what": "論文の要約"}, "scores": [1, 2]}
+        job_paper.set(
+            [
+                {"job_id": "a", "paper_index": 0, "result": result},
+                {"job_id": "a", "paper_index": 1, "result": None},
+                {"job_id": "a", "paper_index": 2, "result": {"summary": None}},
+            ]
+        )
+
+        records = job_paper.get({"job_id": "a", "paper_index": [0, 1]})
+
+        assert sorted(records, key=lambda record: record["paper_index"]) == [
+            {"job_id": "a", "paper_index": 0, "result": result},
+            {"job_id": "a", "paper_index": 1, "result": None},
+        ]
+        assert job_paper.is_exist({"result": {"summary": None}})
+        assert job_paper.delete({"job_id": "a", "paper_index": [1, 2]}) == 2
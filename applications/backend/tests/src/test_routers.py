@@ -0,0 +1,78 @@
+import http
+import pathlib
+
+import fastapi
+import pytest
+from fastapi.testclient import TestClient
+
+from src import routers
+from src.adapter.summary_controller import SummaryController
+from src.domain.paper_format_dto import FormatOchiaiDTO, SummaryResultDTO
+
+CREDENTIALS = {
+    "openai_api_key": "sk-test",
+    "mathpix_api_key": "mathpix-key",
+    "mathpix_api_id": "mathpix-id",
+}
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setenv("BACKEND_STORAGE_ROOT", str(tmp_path))
+    routers.get_connection_pool.cache_clear()
+    routers.get_summary_controller.cache_clear()
+
+    async def summarize_saved_pdf(
+        self: SummaryController, pdf_file_path: pathlib.Path, filename: str, *args
+    ) -> SummaryResultDTO:
+        if filename.startswith("broken"):
+            return SummaryResultDTO(filename=filename, error="MathpixError: failed")
+        summary = FormatOchiaiDTO(
+            outline=filename,
+            contribution="",
+            method="",
+            evaluation="",
+            discussion="",
+        )
+        return SummaryResultDTO(filename=filename, summary=summary)
+
+    monkeypatch.setattr(SummaryController, "_summarize_saved_pdf", summarize_saved_pdf)
+    app = fastapi.FastAPI()
+    app.include_router(routers.router)
+    yield TestClient(app)
+    routers.get_connection_pool().close()
+    routers.get_connection_pool.cache_clear()
+    routers.get_summary_controller.cache_clear()
+
+
+def upload(filenames: list[str]) -> list[tuple[str, tuple[str, bytes, str]]]:
+    return [
+        ("pdf_files", (filename, f"%PDF {filename}".encode(), "application/pdf"))
+        for filename in filenames
+    ]
+
+
+class TestSummarize:
+    def test_summarize_papers_in_order(self, client):
+        response = client.post(
+            "/papers/summarize", data=CREDENTIALS, files=upload(["a.pdf", "b.pdf"])
+        )
+
+        assert response.status_code == http.HTTPStatus.OK
+        assert [summary["outline"] for summary in response.json()] == [
+            "a.pdf",
+            "b.pdf",
+        ]
+
+    def test_report_errors_of_failed_papers(self, client):
+        response = client.post(
+            "/papers/summarize",
+            data=CREDENTIALS,
+            files=upload(["a.pdf", "broken.pdf", "c.pdf"]),
+        )
+
+        assert response.status_code == http.HTTPStatus.BAD_GATEWAY
+        assert response.json() == {
+            "detail": "Failed to summarize 1 papers. "
+            "`broken.pdf`: MathpixError: failed"
+        }
@@ -0,0 +1,55 @@
+import sqlite3
+
+from src.usecase.embeddings.cached_embeddings import EmbeddingCache
+
+
+def count_entries(cache: EmbeddingCache) -> tuple[int, int]:
+    """Get the number of entries kept by the triggers and the actual one."""
+    (num_entries,) = cache.connection.execute(
+        "SELECT num_entries FROM embeddings_count"
+    ).fetchone()
+    (actual_num_entries,) = cache.connection.execute(
+        "SELECT COUNT(*) FROM embeddings"
+    ).fetchone()
+    return num_entries, actual_num_entries
+
+
+class TestEmbeddingCache:
+    def test_evict_least_recently_used(self, tmp_path):
+        cache = EmbeddingCache(tmp_path / "cache.sqlite3", max_entries=3)
+        cache.set_many({"a": [1.0], "b": [2.0], "c": [3.0]})
+        # Updating an entry does not change the number of entries.
+        cache.set_many({"a": [4.0]})
+        assert count_entries(cache) == (3, 3)
+
+        cache.set_many({"d": [5.0]})
+
+        assert count_entries(cache) == (3, 3)
+        assert cache.get_many(["a", "b", "c", "d"]) == {
+            "a": [4.0],
+            "c": [3.0],
+            "d": [5.0],
+        }
+
+    def test_count_entries_of_older_cache(self, tmp_path):
+        cache_path = tmp_path / "cache.sqlite3"
+        connection = sqlite3.connect(cache_path)
+        connection.execute(
+            "CREATE TABLE embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        connection.executemany(
+            "INSERT INTO embeddings VALUES (?, ?, ?)",
+            [(f"old_{i}", bytes(4), float(i)) for i in range(5)],
+        )
+        connection.commit()
+        connection.close()
+
+        cache = EmbeddingCache(cache_path, max_entries=5)
+        assert count_entries(cache) == (5, 5)
+        cache.set_many({"new": [1.0]})
+
+        assert count_entries(cache) == (5, 5)
+        assert "old_0" not in cache.get_many(["old_0", "new"])
+        # The number is not counted again by another instance.
+        assert count_entries(EmbeddingCache(cache_path, max_entries=5)) == (5, 5)
@@ -0,0 +1,36 @@
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from src.usecase.embeddings.query_embedding_cache import QueryEmbeddingCache
+
+
+class AsymmetricEmbeddings(Embeddings):
+    """Embeddings which embed queries and documents differently."""
+
+    def __init__(self) -> None:
+        self.num_queries = 0
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [[float(len(text)), 0.0] for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        self.num_queries += 1
+        return [0.0, float(len(text))]
+
+
+class TestQueryEmbeddingCache:
+    def test_embed_as_queries(self, tmp_path):
+        embeddings = AsymmetricEmbeddings()
+        cache = QueryEmbeddingCache(tmp_path / "query_embeddings.npz")
+
+        vectors = cache.embed_queries(embeddings, "model", ["a", "bc"])
+        cache.embed_queries(embeddings, "model", ["bc"])
+
+        np.testing.assert_array_equal(vectors, [[0.0, 1.0], [0.0, 2.0]])
+        assert embeddings.num_queries == 2
+        # The embeddings are loaded from the file by another process.
+        loaded = QueryEmbeddingCache(tmp_path / "query_embeddings.npz")
+        np.testing.assert_array_equal(
+            loaded.embed_queries(embeddings, "model", ["a", "bc"]), vectors
+        )
+        assert embeddings.num_queries == 2
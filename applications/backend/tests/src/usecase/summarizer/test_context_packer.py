@@ -0,0 +1,70 @@
+import pytest
+import tiktoken
+from langchain.docstore.document import Document
+
+from src.usecase.summarizer import context_packer
+from src.usecase.summarizer.context_packer import ContextPacker
+
+
+@pytest.fixture
+def packer(monkeypatch):
+    """Packer whose tokens are bytes, since tiktoken downloads real encodings."""
+    encoding = tiktoken.Encoding(
+        name="bytes",
+        pat_str=r"[\s\S]",
+        mergeable_ranks={bytes([i]): i for i in range(256)},
+        special_tokens={"<|endoftext|>": 256},
+    )
+    monkeypatch.setattr(context_packer, "get_encoding", lambda model_name: encoding)
+    return ContextPacker("gpt-3.5-turbo", token_budget=20)
+
+
+def chunk(text: str, chunk_id: int, section_id: str = "1") -> Document:
+    return Document(
+        page_content=text, metadata={"section_id": section_id, "chunk_id": chunk_id}
+    )
+
+
+class TestContextPacker:
+    def test_merge_adjacent_chunks(self, packer):
+        packer.token_budget = 30
+        documents = [
+            chunk("ijklmnopqrst", 1),
+            chunk("0123456789", 0, section_id="2"),
+            chunk("abcdefghijklmnop", 0),
+        ]
+
+        packed = packer.pack(documents)
+
+        # The overlap is not repeated, and the passage takes the position of its
+        # most relevant chunk.
+        assert [document.page_content for document in packed] == [
+            "abcdefghijklmnopqrst",
+            "0123456789",
+        ]
+        assert packed[0].metadata["num_chunks"] == 2
+
+    def test_fit_in_budget(self, packer):
+        documents = [
+            chunk("a" * 12, 0, section_id="1"),
+            chunk("b" * 12, 0, section_id="2"),
+            chunk("c" * 8, 0, section_id="3"),
+            chunk("a" * 6, 5, section_id="4"),
+        ]
+
+        packed = packer.pack(documents)
+
+        # Passages which do not fit are skipped, and duplicates are dropped.
+        assert [document.page_content for document in packed] == ["a" * 12, "c" * 8]
+
+    def test_truncate_most_relevant_passage(self, packer):
+        packed = packer.pack([chunk("x" * 30, 0)])
+
+        assert [document.page_content for document in packed] == ["x" * 20]
+
+    def test_pack_special_token_text(self, packer):
+        text = "<|endoftext|> ends a document."
+
+        packed = packer.pack([chunk(text, 0)])
+
+        assert [document.page_content for document in packed] == [text[:20]]
@@ -0,0 +1,66 @@
+import asyncio
+
+from langchain.llms.fake import FakeListLLM
+
+from src.usecase.completion_cache import CompletionCache, use_completion_cache
+
+
+class TestCompletionCache:
+    def test_cache_only_in_context(self, tmp_path):
+        cache = CompletionCache(tmp_path / "cache.sqlite3")
+        llm = FakeListLLM(responses=["first", "second", "third", "fourth"])
+
+        # Calls outside the context are not cached.
+        assert llm("prompt") == "first"
+        assert llm("prompt") == "second"
+        with use_completion_cache(cache):
+            assert llm("prompt") == "third"
+            assert llm("prompt") == "third"
+        assert llm("prompt") == "fourth"
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_cache_in_tasks_of_context(self, tmp_path):
+        cache = CompletionCache(tmp_path / "cache.sqlite3")
+        llm = FakeListLLM(responses=["first", "second"])
+
+        async def run() -> list[str]:
+            with use_completion_cache(cache):
+                first = await llm.apredict("prompt")
+                return [first, *await asyncio.gather(llm.apredict("prompt"))]
+
+        assert asyncio.run(run()) == ["first", "first"]
+
+    def test_evict_least_recently_used(self, tmp_path):
+        cache = CompletionCache(tmp_path / "cache.sqlite3", max_entries=2)
+        llm = FakeListLLM(responses=["a", "b", "c", "d"])
+        with use_completion_cache(cache):
+            for prompt in ["1", "2", "3"]:
+                llm(prompt)
+        (num_entries,) = cache.connection.execute(
+            "SELECT num_entries FROM completions_count"
+        ).fetchone()
+        (actual_num_entries,) = cache.connection.execute(
+            "SELECT COUNT(*) FROM completions"
+        ).fetchone()
+
+        assert num_entries == actual_num_entries == 2
+        with use_completion_cache(cache):
+            assert llm("1") == "d"
+
+    def test_count_entries_after_expiry_and_clear(self, tmp_path):
+        cache = CompletionCache(tmp_path / "cache.sqlite3", ttl_seconds=-1.0)
+        llm = FakeListLLM(responses=["a", "b", "c"])
+        with use_completion_cache(cache):
+            llm("1")
+            llm("2")
+            # The expired entry is deleted by the lookup and stored again.
+            llm("1")
+        assert cache.connection.execute(
+            "SELECT num_entries FROM completions_count"
+        ).fetchone() == (2,)
+
+        cache.clear()
+
+        assert cache.connection.execute(
+            "SELECT num_entries FROM completions_count"
+        ).fetchone() == (0,)
@@ -0,0 +1,69 @@
+from src.usecase.mathpix_pdf_parser import MathpixPdfParser
+
+SAMPLE_TEXT = """\\title{Sample}
+\\begin{abstract}
+This is the abstract.
+\\end{abstract}
+\\section{Introduction}
+Intro text.
+![](https://cdn.mathpix.com/figure.jpg)
+More intro.
+\\subsection{Background}
+Background text.
+\\begin{tabular}{cc}
+a & b \\\\
+\\section{Not a heading}
+\\end{tabular}
+After table.
+\\section{Method}
+Method text.
+\\appendix
+\\section{Proofs}
+Proof text.
+"""
+
+
+class TestMathpixPdfParser:
+    def test_parse_pdf(self):
+        parsed_paper = MathpixPdfParser().parse_pdf(SAMPLE_TEXT)
+
+        assert parsed_paper.abstract == "\nThis is the abstract."
+        assert [section.section_title for section in parsed_paper.section] == [
+            "Introduction",
+            "Method",
+            "Proofs",
+        ]
+        introduction, method, proofs = parsed_paper.section
+        assert introduction.section_text == "Intro text.\nMore intro.\n"
+        assert introduction.subsection_list[0].subsection_title == "Background"
+        assert (
+            introduction.subsection_list[0].subsection_text
+            == "Background text.\n\nAfter table.\n"
+        )
+        assert method.section_text == "Method text.\n\n"
+        assert not method.is_appendix
+        assert proofs.is_appendix
+
+    def test_parse_pdf_with_malformed_figure_before_heading(self):
+        # The link is not closed at the end of the line, e.g. by an OCR error.
+        text = SAMPLE_TEXT.replace(
+            "![](https://cdn.mathpix.com/figure.jpg)\n",
+            "![](https://cdn.mathpix.com/figure.jpg\n",
+        )
+        parsed_paper = MathpixPdfParser().parse_pdf(text)
+
+        assert [section.section_title for section in parsed_paper.section] == [
+            "Introduction",
+            "Method",
+            "Proofs",
+        ]
+        introduction = parsed_paper.section[0]
+        assert introduction.subsection_list[0].subsection_title == "Background"
+        assert "figure.jpg" in introduction.section_text
+
+    def test_simple_figure_table_remover(self):
+        text = "a\n![](fig.png)\nb\n![](broken\nc)\n"
+
+        assert MathpixPdfParser().simple_figure_table_remover(text) == (
+            "a\nb\n![](broken\nc)\n"
+        )
@@ -0,0 +1,164 @@
+import asyncio
+from typing import Any
+
+import openai
+import pytest
+
+from src.domain.rate_limit_dto import RateLimitDTO
+from src.usecase import rate_limiter
+from src.usecase.rate_limiter import OpenAIRateLimiter, RateLimitedOpenAIClient
+
+MODEL_NAME = "gpt-3.5-turbo"
+
+
+class Clock:
+    """Clock which advances only by sleeping."""
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter.time, "time", clock.time)
+    monkeypatch.setattr(rate_limiter.time, "sleep", clock.sleep)
+    return clock
+
+
+class RateLimitedResource:
+    """Resource whose first call is rate limited."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+
+    async def acreate(self, **kwargs: Any) -> dict[str, Any]:
+        self.calls += 1
+        if self.calls == 1:
+            raise openai.error.RateLimitError(
+                "Rate limit reached.", headers={"retry-after": "20"}
+            )
+        return {"usage": {"total_tokens": 10}}
+
+
+def make_limiter(tmp_path) -> OpenAIRateLimiter:
+    return OpenAIRateLimiter(
+        tmp_path / "rate_limits.sqlite3",
+        rate_limits={
+            MODEL_NAME: RateLimitDTO(requests_per_minute=60, tokens_per_minute=600)
+        },
+    )
+
+
+class TestOpenAIRateLimiter:
+    def test_refill_bucket(self, tmp_path, clock):
+        limiter = make_limiter(tmp_path)
+        key = limiter.make_key("sk-test", MODEL_NAME)
+
+        assert limiter._try_acquire(key, MODEL_NAME, 300) == 0
+        assert limiter._try_acquire(key, MODEL_NAME, 300) == 0
+        # The bucket of tokens is empty, and refills 10 tokens per second.
+        assert limiter._try_acquire(key, MODEL_NAME, 300) == pytest.approx(30.0)
+
+        clock.sleep(15.0)
+        assert limiter._try_acquire(key, MODEL_NAME, 300) == pytest.approx(15.0)
+        limiter.acquire("sk-test", MODEL_NAME, 300)
+
+        assert clock.now == pytest.approx(1030.0)
+        # Refunded tokens are available at once, and a full bucket does not grow.
+        limiter.refund("sk-test", MODEL_NAME, 1000)
+        assert limiter._try_acquire(key, MODEL_NAME, 600) == 0
+        assert limiter._try_acquire(key, MODEL_NAME, 1) > 0
+
+    def test_block_bucket_after_rate_limit_error(self, tmp_path, clock, monkeypatch):
+        limiter = make_limiter(tmp_path)
+        # Another process shares the buckets through the database.
+        other_limiter = make_limiter(tmp_path)
+        key = limiter.make_key("sk-test", MODEL_NAME)
+        waits_of_other = []
+
+        def sleep(seconds: float) -> None:
+            waits_of_other.append(other_limiter._try_acquire(key, MODEL_NAME, 1))
+            clock.sleep(seconds)
+
+        monkeypatch.setattr(rate_limiter.time, "sleep", sleep)
+
+        class Resource:
+            calls = 0
+
+            def create(self, **kwargs: Any) -> dict[str, Any]:
+                self.calls += 1
+                if self.calls == 1:
+                    raise openai.error.RateLimitError(
+                        "Rate limit reached.", headers={"retry-after": "20"}
+                    )
+                return {"usage": {"total_tokens": 10}}
+
+        resource = Resource()
+        client = RateLimitedOpenAIClient(resource, limiter)
+
+        response = client.create(
+            model=MODEL_NAME,
+            messages=[{"role": "user", "content": "Hello"}],
+            api_key="sk-test",
+        )
+
+        assert response == {"usage": {"total_tokens": 10}}
+        assert resource.calls == 2
+        # The other process waits until the `Retry-After`, and the call retries
+        # after it.
+        assert waits_of_other == [pytest.approx(20.0)]
+        assert clock.now == pytest.approx(1020.0)
+
+    def test_acreate_in_event_loops(self, tmp_path, clock, monkeypatch):
+        async def sleep(seconds: float) -> None:
+            clock.sleep(seconds)
+
+        monkeypatch.setattr(rate_limiter.asyncio, "sleep", sleep)
+        limiter = make_limiter(tmp_path)
+        resource = RateLimitedResource()
+        client = RateLimitedOpenAIClient(resource, limiter)
+
+        async def main() -> list[Any]:
+            # Concurrent calls of a key wait for each other by a lock of the loop.
+            return await asyncio.gather(
+                *[
+                    client.acreate(
+                        model=MODEL_NAME,
+                        messages=[{"role": "user", "content": "Hello"}],
+                        api_key="sk-test",
+                    )
+                    for _ in range(2)
+                ]
+            )
+
+        # Each `asyncio.run` starts a new event loop, as `summarize` does.
+        responses = [*asyncio.run(main()), *asyncio.run(main())]
+
+        assert responses == [{"usage": {"total_tokens": 10}}] * 4
+        assert resource.calls == 5
+        assert clock.now >= 1020.0
+
+    def test_refund_actual_tokens_of_acreate(self, tmp_path, clock):
+        limiter = make_limiter(tmp_path)
+        resource = RateLimitedResource()
+        resource.calls = 1
+        client = RateLimitedOpenAIClient(resource, limiter)
+
+        asyncio.run(
+            client.acreate(
+                model=MODEL_NAME,
+                messages=[{"role": "user", "content": "Hello"}],
+                api_key="sk-test",
+            )
+        )
+
+        (tokens,) = limiter.connection.execute("SELECT tokens FROM buckets").fetchone()
+        # The estimated tokens are taken, and those not used are returned.
+        assert tokens == pytest.approx(600 - 10)
@@ -0,0 +1,99 @@
+import asyncio
+import multiprocessing
+import pathlib
+import time
+
+from src.usecase.single_flight import SingleFlight
+
+
+def append_line(log_path: pathlib.Path, line: str) -> None:
+    with log_path.open("a") as f:
+        f.write(f"{line}\n")
+
+
+def read_lines(log_path: pathlib.Path) -> list[str]:
+    return log_path.read_text().splitlines() if log_path.exists() else []
+
+
+def run_in_process(lock_dir: pathlib.Path, log_path: pathlib.Path) -> None:
+    """Hold the flight of the key for a while in another process."""
+
+    async def function() -> str:
+        append_line(log_path, "child start")
+        await asyncio.sleep(1.0)
+        append_line(log_path, "child end")
+        return "child"
+
+    asyncio.run(SingleFlight(lock_dir).run("parse", "key", function))
+
+
+class TestSingleFlight:
+    def test_share_result_of_leader(self):
+        single_flight = SingleFlight()
+        calls = []
+
+        async def function() -> str:
+            calls.append(None)
+            await asyncio.sleep(0.1)
+            return "result"
+
+        async def main() -> list[tuple[str, bool]]:
+            return await asyncio.gather(
+                *[single_flight.run("parse", "key", function) for _ in range(3)]
+            )
+
+        assert asyncio.run(main()) == [
+            ("result", False),
+            ("result", True),
+            ("result", True),
+        ]
+        assert len(calls) == 1
+        assert single_flight.in_flight == dict()
+
+    def test_retry_after_leader_cancelled(self):
+        single_flight = SingleFlight()
+        calls = []
+
+        async def function() -> str:
+            calls.append(None)
+            await asyncio.sleep(0.1)
+            return f"result {len(calls)}"
+
+        async def main() -> tuple[str, bool]:
+            leader = asyncio.create_task(single_flight.run("parse", "key", function))
+            await asyncio.sleep(0)
+            follower = asyncio.create_task(single_flight.run("parse", "key", function))
+            await asyncio.sleep(0.05)
+            leader.cancel()
+            return await follower
+
+        # The follower runs the function by itself instead of failing.
+        assert asyncio.run(main()) == ("result 2", False)
+        assert len(calls) == 2
+
+    def test_take_turns_across_processes(self, tmp_path):
+        log_path = tmp_path / "log.txt"
+        process = multiprocessing.get_context("spawn").Process(
+            target=run_in_process, args=(tmp_path / "locks", log_path)
+        )
+        process.start()
+        try:
+            deadline = time.monotonic() + 30.0
+            while "child start" not in read_lines(log_path):
+                assert time.monotonic() < deadline
+                time.sleep(0.05)
+
+            async def function() -> str:
+                append_line(log_path, "parent start")
+                return "parent"
+
+            single_flight = SingleFlight(
+                tmp_path / "locks", initial_poll_interval_seconds=0.01
+            )
+            result = asyncio.run(single_flight.run("parse", "key", function))
+        finally:
+            process.join()
+
+        # The parent waits for the lock of the child, and then runs by itself.
+        assert result == ("parent", False)
+        assert read_lines(log_path) == ["child start", "child end", "parent start"]
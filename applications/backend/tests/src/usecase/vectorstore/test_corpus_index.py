@@ -0,0 +1,91 @@
+import multiprocessing
+import pathlib
+
+import numpy as np
+from langchain.docstore.document import Document
+
+from src.usecase.vectorstore.corpus_index import CorpusIndex
+
+DIM = 8
+
+
+def make_paper(paper_id: str, num_chunks: int) -> tuple[list[Document], np.ndarray]:
+    """Make chunks of a paper with random vectors."""
+    rng = np.random.default_rng(abs(hash(paper_id)) % 2**32)
+    documents = [
+        Document(page_content=f"{paper_id} {i}", metadata={"section": "Introduction"})
+        for i in range(num_chunks)
+    ]
+    return documents, rng.standard_normal((num_chunks, DIM)).astype(np.float32)
+
+
+def add_paper(root_path: pathlib.Path, paper_id: str, num_chunks: int) -> None:
+    """Add a paper in another process, and wait for the re-training it starts."""
+    corpus_index = CorpusIndex(
+        root_path, encoding="Flat", min_training_size=200, retraining_growth=10.0
+    )
+    corpus_index.add_paper(paper_id, "key", *make_paper(paper_id, num_chunks))
+    if corpus_index.retraining_thread is not None:
+        corpus_index.retraining_thread.join()
+
+
+def run_processes(root_path: pathlib.Path, papers: list[tuple[str, int]]) -> None:
+    """Add the papers concurrently, each in its own process."""
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=add_paper, args=(root_path, paper_id, num_chunks))
+        for paper_id, num_chunks in papers
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+
+def search_all(corpus_index: CorpusIndex) -> list[str]:
+    """Get the contents of all chunks found by a search over the corpus."""
+    vector = np.zeros((1, DIM), dtype=np.float32)
+    (results,) = corpus_index.search(vector, k=len(corpus_index) + 10)
+    return sorted(document.page_content for document, _ in results)
+
+
+class TestCorpusIndex:
+    def test_search_chunks_added_by_other_processes(self, tmp_path):
+        corpus_index = CorpusIndex(tmp_path, encoding="Flat", min_training_size=200)
+        corpus_index.add_paper("a", "key", *make_paper("a", 3))
+
+        run_processes(tmp_path, [("b", 2)])
+
+        assert corpus_index.has_paper("b", "key")
+        assert search_all(corpus_index) == ["a 0", "a 1", "a 2", "b 0", "b 1"]
+
+    def test_add_paper_for_each_index_key(self, tmp_path):
+        corpus_index = CorpusIndex(tmp_path, encoding="Flat")
+        corpus_index.add_paper("a", "key", *make_paper("a", 3))
+        # Adding the paper again by the same settings does nothing.
+        corpus_index.add_paper("a", "key", *make_paper("a", 3))
+
+        assert not corpus_index.has_paper("a", "other key")
+        corpus_index.add_paper("a", "other key", *make_paper("a", 2))
+
+        assert corpus_index.has_paper("a", "key")
+        assert corpus_index.has_paper("a", "other key")
+        assert len(corpus_index) == 5
+        assert len(search_all(corpus_index)) == 5
+
+    def test_retrain_in_one_process(self, tmp_path):
+        corpus_index = CorpusIndex(tmp_path, encoding="Flat", min_training_size=200)
+
+        # Each paper makes the corpus large enough to re-train it once.
+        run_processes(tmp_path, [("a", 250), ("b", 250), ("c", 250)])
+
+        state = dict(corpus_index.connection.execute("SELECT key, value FROM state"))
+        assert state["version"] == 1
+        assert [path.name for path in tmp_path.glob("index.*.faiss")] == [
+            "index.1.faiss"
+        ]
+        # The saved index is loaded, and chunks are neither missed nor duplicated.
+        expected = sorted(f"{paper_id} {i}" for paper_id in "abc" for i in range(250))
+        assert search_all(corpus_index) == expected
+        assert corpus_index.version == 1
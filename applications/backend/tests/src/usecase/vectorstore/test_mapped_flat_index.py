@@ -0,0 +1,33 @@
+import faiss
+import numpy as np
+
+from src.usecase.vectorstore.mapped_flat_index import MappedFlatIndex
+
+
+class TestMappedFlatIndex:
+    def test_search_same_as_flat_index(self, tmp_path):
+        rng = np.random.default_rng(0)
+        np.save(tmp_path / "vectors.npy", rng.standard_normal((1000, 16)))
+        vectors = np.load(tmp_path / "vectors.npy", mmap_mode="r")
+        queries = rng.standard_normal((5, 16)).astype(np.float32)
+        flat_index = faiss.IndexFlatL2(16)
+        flat_index.add(np.asarray(vectors, dtype=np.float32))
+
+        index = MappedFlatIndex(vectors, block_size=64)
+        distances, indices = index.search(queries, 10)
+
+        expected_distances, expected_indices = flat_index.search(queries, 10)
+        np.testing.assert_array_equal(indices, expected_indices)
+        np.testing.assert_allclose(distances, expected_distances, rtol=1e-4)
+        np.testing.assert_array_equal(
+            index.reconstruct_n(0, index.ntotal), flat_index.reconstruct_n(0, 1000)
+        )
+
+    def test_pad_missing_results(self):
+        index = MappedFlatIndex(np.eye(3, dtype=np.float16))
+
+        distances, indices = index.search(np.eye(3, dtype=np.float32)[:1], 5)
+
+        assert indices.tolist() == [[0, 1, 2, -1, -1]]
+        assert distances[0, 0] == 0.0
+        assert np.isinf(distances[0, 3:]).all()
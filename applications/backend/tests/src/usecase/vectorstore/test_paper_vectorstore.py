@@ -0,0 +1,33 @@
+from langchain.docstore.document import Document
+from langchain.embeddings.fake import FakeEmbeddings
+
+from src.usecase.vectorstore.paper_vectorstore import PaperVectorStore
+
+
+def search_all(vectorstore: PaperVectorStore) -> list[list[tuple[str, int]]]:
+    """Search the chunks nearest to each chunk, and get their texts and IDs."""
+    results = vectorstore.similarity_search_by_vectors(
+        vectorstore.get_vectors(), k=[1] * 3, filters=[None] * 3
+    )
+    return [
+        [(document.page_content, document.metadata["chunk_id"]) for document in row]
+        for row in results
+    ]
+
+
+class TestPaperVectorStore:
+    def test_set_chunk_id_of_shared_metadata(self, tmp_path):
+        metadata = {"section_id": "1", "section": "Introduction"}
+        documents = [
+            Document(page_content=f"chunk {i}", metadata=metadata) for i in range(3)
+        ]
+        vectorstore = PaperVectorStore.from_documents(documents, FakeEmbeddings(size=8))
+
+        expected = [[("chunk 0", 0)], [("chunk 1", 1)], [("chunk 2", 2)]]
+        assert search_all(vectorstore) == expected
+        # The shared metadata is not modified.
+        assert metadata == {"section_id": "1", "section": "Introduction"}
+
+        vectorstore.save_compact(tmp_path)
+        loaded = PaperVectorStore.load_compact(tmp_path, FakeEmbeddings(size=8))
+        assert search_all(loaded) == expected